@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Item, Category, Rental, Purchase, Review, Message, Interest, UserInterests
+from .models import Item, Category, Rental, Purchase, Review, Message, Interest, UserInterests, QueuedEmail
 
 
 # admin.site.register(Item)
@@ -53,3 +53,10 @@ class InterestAdmin(admin.ModelAdmin):
         return ", ".join([category.name for category in obj.categories.all()])
 
     get_categories_display.short_description = 'Categories'
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'created_date', 'sent_date')
+    list_filter = ("status", )
+    search_fields = ("subject", "to", )
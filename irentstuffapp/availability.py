@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Item, Rental, rental_availability
+
+
+def booked_rentals(item_id, start_date, end_date):
+    """
+    Open rentals of the item that overlap the days from start_date up to end_date. Rental dates are half open:
+    the end date is the return day, so another rental may start on it. item_id may also be an OuterRef.
+    Served by the (item, status, end_date, start_date) index, which skips the rentals that ended before start_date.
+    """
+    return Rental.objects.filter(
+        item_id=item_id, status__in=Rental.OPEN_STATUSES, end_date__gt=start_date, start_date__lt=end_date
+    )
+
+
+def book_rental(rental):
+    """
+    Save a new rental unless it overlaps another open rental of the same item. The item row is locked while
+    checking, so two bookings for the same days cannot both succeed. The item's availability is updated in the
+    same transaction, and observers are notified once it commits.
+    """
+    with transaction.atomic():
+        Item.objects.select_for_update().only('pk').get(pk=rental.item_id)
+        if booked_rentals(rental.item_id, rental.start_date, rental.end_date).exists():
+            raise ValidationError('The item is already booked for some of these dates.')
+        rental.save()
+        Item.objects.filter(pk=rental.item_id).update(availability=rental_availability())
+        rental.notify_observers()
+
+
+def available_between(items, start_date, end_date):
+    """
+    Items that can be rented from start_date to end_date: an anti-join against their overlapping open rentals.
+    Items reserved for a purchase cannot be rented either.
+    """
+    return items.filter(active_purchase__isnull=True).exclude(
+        Exists(booked_rentals(OuterRef('pk'), start_date, end_date))
+    )
+
+
+def parse_date_range(start_value, end_value):
+    # Dates are given as YYYY-MM-DD; the range is ignored unless both dates are valid and in order
+    try:
+        start_date, end_date = parse_date(start_value or ''), parse_date(end_value or '')
+    except ValueError:
+        return None, None
+    if start_date is None or end_date is None or start_date >= end_date:
+        return None, None
+    return start_date, end_date
+
+
+def parse_month(value):
+    # Months are given as YYYY-MM, defaulting to the current month
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        return date(year, month, 1)
+    except (AttributeError, ValueError):
+        return timezone.localdate().replace(day=1)
+
+
+def free_ranges(item, month):
+    """
+    Days of the month on which the item can be booked, as half-open (start, end) ranges like the rental dates.
+    Days before today and sold items are never free.
+    """
+    month_end = (month + timedelta(days=31)).replace(day=1)
+    start = max(month, timezone.localdate())
+    if item.availability == 'sold' or start >= month_end:
+        return []
+
+    ranges = []
+    for booked_start, booked_end in booked_rentals(item.id, start, month_end).order_by('start_date').values_list(
+            'start_date', 'end_date'):
+        if booked_start > start:
+            ranges.append((start, booked_start))
+        start = max(start, booked_end)
+
+    if start < month_end:
+        ranges.append((start, month_end))
+    return ranges
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import AsyncClient, Client, override_settings
+
+
+class BenchmarkResult:
+    def __init__(self, handler, latencies, statuses, seconds):
+        self.handler = handler
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.seconds = seconds
+
+    @property
+    def requests_per_second(self):
+        return len(self.latencies) / self.seconds if self.seconds else 0.0
+
+    def percentile(self, percent):
+        # Latency in seconds that percent of the requests were served within
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(len(self.latencies) * percent / 100))
+        return self.latencies[index]
+
+    def __str__(self):
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(self.statuses.items()))
+        return (f'{self.handler}: {len(self.latencies)} requests in {self.seconds:.2f}s, '
+                f'{self.requests_per_second:.1f} requests/s, p50 {self.percentile(50) * 1000:.1f} ms, '
+                f'p95 {self.percentile(95) * 1000:.1f} ms ({statuses})')
+
+
+def allow_test_host():
+    # The test clients send Host: testserver, which ALLOWED_HOSTS rejects outside tests
+    return override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+
+
+def login_cookies(user):
+    # Session cookie for user, shared by every client so that all requests see the same logged in pages
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    return client.cookies
+
+
+def benchmark_wsgi(paths, total, concurrency, user=None):
+    """
+    Send total GET requests for paths, in turn, through the WSGI handler from concurrency threads, the way a
+    threaded WSGI server serves them. Each thread has its own database connection.
+    """
+    cookies = login_cookies(user)
+
+    def get(path):
+        client = Client(raise_request_exception=False)
+        client.cookies.load(cookies)
+        start = time.perf_counter()
+        response = client.get(path)
+        return time.perf_counter() - start, response.status_code
+
+    requests = [paths[number % len(paths)] for number in range(total)]
+    with allow_test_host():
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                responses = list(executor.map(get, requests))
+        else:
+            responses = [get(path) for path in requests]
+        seconds = time.perf_counter() - start
+
+    return BenchmarkResult('WSGI', [latency for latency, _ in responses],
+                           Counter(status for _, status in responses), seconds)
+
+
+def benchmark_asgi(paths, total, concurrency, user=None):
+    """
+    Send total GET requests for paths, in turn, through the ASGI handler with up to concurrency requests in flight
+    on one event loop, the way an ASGI server serves them.
+    """
+    cookies = login_cookies(user)
+
+    async def run():
+        client = AsyncClient(raise_request_exception=False)
+        client.cookies.load(cookies)
+        in_flight = asyncio.Semaphore(concurrency)
+
+        async def get(path):
+            async with in_flight:
+                start = time.perf_counter()
+                response = await client.get(path)
+                return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(get(paths[number % len(paths)]) for number in range(total)))
+        return responses, time.perf_counter() - start
+
+    # Run from a sync context like the ASGI server's, so sync code called from the views shares one thread
+    with allow_test_host():
+        responses, seconds = async_to_sync(run)()
+
+    return BenchmarkResult('ASGI', [latency for latency, _ in responses],
+                           Counter(status for _, status in responses), seconds)
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Message, system_user_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MESSAGE_BROKER = 'irentstuffapp.broker.LocalBroker'
+# Most missed messages read at once; catching up reads them in batches of this size
+MISSED_MESSAGES_LIMIT = 100
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+class MessageBroker(ABC):
+    """
+    Fan-out of events to the subscribers of a channel. publish() may be called from any thread; subscribe() returns
+    a subscription to use with async with, whose get() waits for the next event. Subclass this for a broker
+    shared between processes, such as Redis pub/sub, and select it with the MESSAGE_BROKER setting.
+    """
+    @abstractmethod
+    def publish(self, channel, event):
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel):
+        pass
+
+
+class LocalSubscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = None
+
+    async def __aenter__(self):
+        self.queue = asyncio.Queue(maxsize=self.broker.max_queued)
+        self.broker.add_subscriber(self.channel, asyncio.get_running_loop(), self.queue)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker.remove_subscriber(self.channel, self.queue)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBroker(MessageBroker):
+    """
+    In-process broker: events only reach subscribers served by the same process, so run a single ASGI process or
+    use a shared broker. A subscriber that falls behind by more than max_queued events misses the newer ones; the
+    browser catches up with Last-Event-ID when it reconnects.
+    """
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def add_subscriber(self, channel, loop, queue):
+        with self._lock:
+            self._subscribers.setdefault(channel, {})[queue] = loop
+
+    def remove_subscriber(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                pass
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def subscribe(self, channel):
+        return LocalSubscription(self, channel)
+
+
+def get_broker():
+    """
+    Return the process-wide broker from the MESSAGE_BROKER setting (LocalBroker by default).
+    """
+    broker_path = getattr(settings, 'MESSAGE_BROKER', DEFAULT_MESSAGE_BROKER)
+    with _brokers_lock:
+        if broker_path not in _brokers:
+            _brokers[broker_path] = import_string(broker_path)()
+        return _brokers[broker_path]
+
+
+def thread_channel(item_id, enquiring_user_id):
+    # The messages about an item with one enquiring user
+    return f'messages:{item_id}:{enquiring_user_id}'
+
+
+def message_event(message):
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'sender': message.sender.username,
+        'admin': message.sender_id == system_user_id(),
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def publish_message(message):
+    # Runs after the message is committed, so a failure only costs open pages the live update, not the request
+    try:
+        get_broker().publish(thread_channel(message.item_id, message.enquiring_user_id), message_event(message))
+    except Exception:
+        logger.exception('Cannot publish message %s', message.pk)
+
+
+def missed_message_events(item_id, enquiring_user_id, after, limit=MISSED_MESSAGES_LIMIT):
+    """
+    Events for the messages of a conversation newer than the message id after, oldest first.
+    """
+    messages = Message.objects.filter(item_id=item_id, enquiring_user_id=enquiring_user_id, id__gt=after)
+    return [message_event(message) for message in messages.select_related('sender').order_by('id')[:limit]]
+
+
+def format_event(event):
+    # Server-sent event, with the message id so that a reconnecting browser sends it back as Last-Event-ID
+    return f'id: {event["id"]}\nevent: message\ndata: {json.dumps(event)}\n\n'
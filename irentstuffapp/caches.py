@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Category
+
+
+CATEGORY_LIST_VERSION_KEY = 'irentstuffapp:categories:version'
+
+# In-process copy of the category list, valid for as long as the shared cache version is unchanged
+_local_category_list = {'version': None, 'categories': None}
+
+
+def new_cache_version():
+    # Time based, so that a version key that was evicted never restarts at a version some process still holds
+    return time.time_ns() // 1000
+
+
+def get_category_list_version():
+    version = cache.get(CATEGORY_LIST_VERSION_KEY)
+    if version is None:
+        cache.add(CATEGORY_LIST_VERSION_KEY, new_cache_version(), timeout=None)
+        version = cache.get(CATEGORY_LIST_VERSION_KEY)
+    return version
+
+
+def get_category_list():
+    """
+    Return all categories, cached in-process and in the shared cache.
+    The list is versioned, and invalidate_category_list bumps the version whenever a category changes.
+    """
+    version = get_category_list_version()
+    if _local_category_list['version'] == version:
+        return _local_category_list['categories']
+
+    key = f'irentstuffapp:categories:{version}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(key, categories, timeout=getattr(settings, 'CATEGORY_CACHE_TIMEOUT', 60 * 60))
+
+    _local_category_list.update(version=version, categories=categories)
+    return categories
+
+
+def invalidate_category_list():
+    try:
+        cache.incr(CATEGORY_LIST_VERSION_KEY)
+    except ValueError:
+        # The version key was evicted, so start a new version
+        cache.set(CATEGORY_LIST_VERSION_KEY, new_cache_version(), timeout=None)
+    _local_category_list.update(version=None, categories=None)
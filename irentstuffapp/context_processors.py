@@ -1,5 +1,14 @@
-from .models import Category  
+from .caches import get_category_list
+from .models import get_unread_message_count
+
 
 def category_list(request):
     """Context processor to add the list of categories to every context."""
-    return {'categories': Category.objects.all()}
+    return {'categories': get_category_list()}
+
+
+def unread_messages(request):
+    """Context processor to add the user's unread message count, for the inbox badge."""
+    if not request.user.is_authenticated:
+        return {}
+    return {'unread_message_count': get_unread_message_count(request.user)}
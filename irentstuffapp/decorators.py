@@ -1,30 +1,61 @@
+import asyncio
 from functools import wraps
 
-def apply_standard_discount(view_func):
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+
+
+def login_required_async(view_func):
+    """
+    login_required for async views, which Django's decorator only supports from Django 5.0.
+    Loading request.user queries the session and user tables, so it is done off the event loop.
+    """
     @wraps(view_func)
-    def _wrapped_view(request, *args, **kwargs):
-        response = view_func(request, *args, **kwargs)
+    async def _wrapped_view(request, *args, **kwargs):
+        if await sync_to_async(lambda: request.user.is_authenticated)():
+            return await view_func(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path())
+    return _wrapped_view
+
 
+def apply_standard_discount(view_func):
+    def apply(response):
         if hasattr(response, 'context_data'):
             item = response.context_data.get('item')
             if item and item.discount_percentage > 0:
                 discounted_price = item.price_per_day * (100 - item.discount_percentage) / 100
                 item.discounted_price = discounted_price
         return response
-    return _wrapped_view
 
-def apply_loyalty_discount(view_func):
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            return apply(await view_func(request, *args, **kwargs))
+        return _wrapped_async_view
+
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        response = view_func(request, *args, **kwargs)
+        return apply(view_func(request, *args, **kwargs))
+    return _wrapped_view
 
+def apply_loyalty_discount(view_func):
+    def apply(request, response):
         # Assuming there's a method to check loyalty discount eligibility
         if hasattr(response, 'context_data'):
             item = response.context_data.get('item')
-            user = request.user
             if 'apply_loyalty_discount' in request.POST and item.discounted_price:
                 loyalty_discount_rate = 0.95  # Example 5% additional discount
                 item.discounted_price *= loyalty_discount_rate
 
         return response
+
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            return apply(request, await view_func(request, *args, **kwargs))
+        return _wrapped_async_view
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        return apply(request, view_func(request, *args, **kwargs))
     return _wrapped_view
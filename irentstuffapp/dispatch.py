@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def observer_threads():
+    # Number of worker threads for observers; 0 runs them on the thread that committed
+    return getattr(settings, 'OBSERVER_THREADS', 4)
+
+
+def observer_queue_size():
+    # Notifications waiting for a worker; when the queue is full they run on the committing thread instead
+    return getattr(settings, 'OBSERVER_QUEUE_SIZE', 100)
+
+
+def get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=observer_threads(), thread_name_prefix='observers')
+            _slots = threading.BoundedSemaphore(observer_threads() + observer_queue_size())
+        return _executor, _slots
+
+
+def record_timing(name, seconds, failed):
+    with _metrics_lock:
+        metrics = _metrics.setdefault(name, {'calls': 0, 'failures': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        metrics['calls'] += 1
+        metrics['failures'] += failed
+        metrics['total_seconds'] += seconds
+        metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+
+
+def observer_metrics():
+    """
+    Calls, failures, and total and maximum time in seconds of each observer class since the process started.
+    """
+    with _metrics_lock:
+        return {name: dict(metrics) for name, metrics in _metrics.items()}
+
+
+def reset_observer_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def run_observers(observers, subject):
+    # A failing observer is logged and does not stop the others
+    for observer in observers:
+        name = type(observer).__name__
+        start = time.perf_counter()
+        failed = False
+        try:
+            observer.update(subject)
+        except Exception:
+            failed = True
+            logger.exception('%s failed for %s', name, subject)
+        finally:
+            seconds = time.perf_counter() - start
+            record_timing(name, seconds, failed)
+            logger.debug('%s took %.3fs for %s', name, seconds, subject)
+
+
+def run_in_worker(slots, func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('%s failed', func.__name__)
+    finally:
+        # Worker threads open their own database connections
+        connections.close_all()
+        slots.release()
+
+
+def submit(func, *args):
+    # Run func on the worker pool, or on this thread when there are no workers or the queue is full
+    if not observer_threads():
+        func(*args)
+        return
+    executor, slots = get_executor()
+    if slots.acquire(blocking=False):
+        executor.submit(run_in_worker, slots, func, *args)
+    else:
+        logger.warning('Worker queue is full, running %s on the request thread', func.__name__)
+        func(*args)
+
+
+def dispatch_observers(observers, subject):
+    """
+    Notify the observers of a rental or purchase once the current transaction commits, on the observer thread pool.
+    Nothing is sent if the transaction rolls back. Outside a transaction the observers are dispatched straight away.
+    """
+    observers = list(observers)
+    if not observers:
+        return
+
+    transaction.on_commit(lambda: submit(run_observers, observers, subject))
+
+
+def dispatch_task(func, *args):
+    """
+    Run func(*args) once the current transaction commits, on the same thread pool as the observers.
+    """
+    transaction.on_commit(lambda: submit(func, *args))
@@ -76,7 +76,7 @@ class RentalForm(forms.ModelForm):
         start_date = cleaned_data.get('start_date')
         end_date = cleaned_data.get('end_date')
 
-        if start_date < timezone.now().date():
+        if start_date and start_date < timezone.now().date():
             raise forms.ValidationError('Start date cannot be earlier than today.')
 
         if start_date and end_date and start_date >= end_date:
@@ -0,0 +1,153 @@
+import io
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Listing cards are about 200px wide, and the detail page about 400px; the larger sizes are for high density screens
+DEFAULT_IMAGE_WIDTHS = (200, 400, 800)
+
+
+def image_widths():
+    return sorted(getattr(settings, 'ITEM_IMAGE_WIDTHS', DEFAULT_IMAGE_WIDTHS))
+
+
+def image_quality():
+    return getattr(settings, 'ITEM_IMAGE_QUALITY', 80)
+
+
+def manifest_cache_timeout():
+    return getattr(settings, 'ITEM_IMAGE_MANIFEST_CACHE_TIMEOUT', 60 * 60)
+
+
+def manifest_name(name):
+    # item_images/photo.jpg -> item_images/photo.variants.json
+    return f'{os.path.splitext(name)[0]}.variants.json'
+
+
+def variant_name(name, width, extension):
+    # item_images/photo.jpg -> item_images/photo_400w.webp
+    return f'{os.path.splitext(name)[0]}_{width}w.{extension}'
+
+
+def manifest_cache_key(name):
+    return f'irentstuffapp:image_variants:{name}'
+
+
+def save_file(storage, name, content):
+    # Overwrite rather than let the storage pick another name, so that the names in the manifest stay predictable
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, ContentFile(content))
+
+
+def encode_image(image, image_format):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=image_quality(), optimize=image_format != 'WEBP')
+    return buffer.getvalue()
+
+
+def generate_image_variants(name, storage=None):
+    """
+    Create downsized copies of an uploaded image at each ITEM_IMAGE_WIDTHS width smaller than the original, in
+    WebP and in JPEG (PNG for images with transparency), and a manifest of them next to the original.
+    Returns the manifest, or None if the original cannot be read as an image.
+    """
+    storage = storage or default_storage
+    try:
+        with storage.open(name) as file, Image.open(file) as original:
+            # Phone photos are stored sideways with an EXIF orientation, which the variants would lose
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (FileNotFoundError, UnidentifiedImageError, OSError):
+        logger.warning('Cannot create variants of %s', name, exc_info=True)
+        return None
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    fallback_format, fallback_extension = ('PNG', 'png') if image.mode == 'RGBA' else ('JPEG', 'jpg')
+
+    width, height = image.size
+    variants = []
+    for variant_width in image_widths():
+        if variant_width >= width:
+            break
+        resized = image.resize((variant_width, max(1, round(height * variant_width / width))), Image.LANCZOS)
+        variants.append({
+            'width': resized.width,
+            'height': resized.height,
+            'webp': save_file(storage, variant_name(name, variant_width, 'webp'), encode_image(resized, 'WEBP')),
+            'fallback': save_file(storage, variant_name(name, variant_width, fallback_extension),
+                                  encode_image(resized, fallback_format)),
+        })
+
+    manifest = {'original': name, 'width': width, 'height': height, 'variants': variants}
+    save_file(storage, manifest_name(name), json.dumps(manifest).encode())
+    cache.set(manifest_cache_key(name), manifest, timeout=manifest_cache_timeout())
+    return manifest
+
+
+def read_manifest(name, storage):
+    try:
+        with storage.open(manifest_name(name)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def image_manifests(names, storage=None):
+    """
+    Return the manifests of the given images by name, from the cache or the manifest files. Images whose variants
+    have not been created yet are left out.
+    """
+    storage = storage or default_storage
+    keys = {manifest_cache_key(name): name for name in set(names) if name}
+    found = cache.get_many(keys)
+
+    read = {}
+    for key, name in keys.items():
+        if key not in found:
+            found[key] = read[key] = read_manifest(name, storage) or {}
+    cache.set_many({key: manifest for key, manifest in read.items() if manifest}, timeout=manifest_cache_timeout())
+    # Images without variants yet are remembered as {} briefly, so that their manifest is not looked for on every page
+    cache.set_many({key: manifest for key, manifest in read.items() if not manifest}, timeout=60)
+
+    return {keys[key]: manifest for key, manifest in found.items() if manifest}
+
+
+class ResponsiveImage:
+    """
+    The src, srcset and size of an item image for templates. Without a manifest it is just the original.
+    """
+    def __init__(self, name, manifest=None, storage=None):
+        storage = storage or default_storage
+        self.src = storage.url(name)
+        self.width = self.height = None
+        self.srcset = self.webp_srcset = ''
+        if manifest:
+            self.width, self.height = manifest['width'], manifest['height']
+            variants = manifest['variants']
+            original = f'{self.src} {self.width}w'
+            self.srcset = ', '.join([f'{storage.url(variant["fallback"])} {variant["width"]}w' for variant in variants] +
+                                    [original])
+            self.webp_srcset = ', '.join(f'{storage.url(variant["webp"])} {variant["width"]}w' for variant in variants)
+            if variants:
+                # Browsers without srcset support get the smallest variant rather than the original
+                self.src = storage.url(variants[0]['fallback'])
+
+
+def attach_responsive_images(items):
+    """
+    Set responsive_image on each item with an image, looking up all their manifests at once.
+    """
+    manifests = image_manifests(item.image.name for item in items if item.image)
+    for item in items:
+        item.responsive_image = ResponsiveImage(item.image.name, manifests.get(item.image.name)) if item.image else None
+    return items
@@ -0,0 +1,108 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.utils import timezone
+
+from .models import QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+def get_delivery_connection(**kwargs):
+    """
+    Connection used to actually deliver emails, from the QUEUED_EMAIL_DELIVERY_BACKEND setting (SMTP by default).
+    """
+    return get_connection(getattr(settings, 'QUEUED_EMAIL_DELIVERY_BACKEND', DEFAULT_DELIVERY_BACKEND), **kwargs)
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Email backend that stores messages in the QueuedEmail outbox instead of sending them during the request.
+    Enable it with EMAIL_BACKEND = 'irentstuffapp.mail.QueuedEmailBackend' and run the send_queued_emails command.
+    """
+    def send_messages(self, email_messages):
+        queued_emails = []
+        for message in email_messages:
+            if message.attachments:
+                # Attachments are not stored in the outbox, so these messages are delivered straight away
+                get_delivery_connection(fail_silently=self.fail_silently).send_messages([message])
+            else:
+                queued_emails.append(QueuedEmail.from_message(message))
+
+        QueuedEmail.objects.bulk_create(queued_emails)
+        return len(email_messages)
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff between delivery attempts: 1, 2, 4, ... minutes, capped at an hour.
+    """
+    return timedelta(minutes=min(2 ** (attempts - 1), 60))
+
+
+def record_delivery_failure(queued_email, error, max_attempts):
+    queued_email.attempts += 1
+    queued_email.last_error = str(error)
+    if queued_email.attempts >= max_attempts:
+        queued_email.status = 'failed'
+        logger.error('Giving up on queued email %s after %s attempts: %s', queued_email.pk, queued_email.attempts, error)
+    else:
+        queued_email.next_attempt_date = timezone.now() + retry_delay(queued_email.attempts)
+    queued_email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_date'])
+
+
+def claim_due_emails(batch_size, lease):
+    """
+    Claim up to batch_size due emails by pushing their next attempt back by the lease, so that a concurrent worker
+    skips them. If this worker dies mid-batch the emails become due again once the lease expires.
+    """
+    now = timezone.now()
+    candidates = QueuedEmail.objects.filter(status='queued', next_attempt_date__lte=now).order_by('next_attempt_date', 'id')
+
+    claimed = []
+    for queued_email in candidates[:batch_size]:
+        if QueuedEmail.objects.filter(pk=queued_email.pk, next_attempt_date=queued_email.next_attempt_date).update(
+                next_attempt_date=now + lease):
+            claimed.append(queued_email)
+    return claimed
+
+
+def send_queued_emails(batch_size=None, max_attempts=None):
+    """
+    Deliver one batch of due emails over a single connection. Returns the number of emails processed.
+    """
+    batch_size = batch_size or getattr(settings, 'QUEUED_EMAIL_BATCH_SIZE', 50)
+    max_attempts = max_attempts or getattr(settings, 'QUEUED_EMAIL_MAX_ATTEMPTS', 5)
+
+    batch = claim_due_emails(batch_size, lease=timedelta(minutes=10))
+    if not batch:
+        return 0
+
+    connection = get_delivery_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        # The mail server is unreachable, so the whole batch is retried later
+        for queued_email in batch:
+            record_delivery_failure(queued_email, error, max_attempts)
+        return len(batch)
+
+    try:
+        for queued_email in batch:
+            try:
+                connection.send_messages([queued_email.to_message(connection)])
+            except Exception as error:
+                record_delivery_failure(queued_email, error, max_attempts)
+            else:
+                queued_email.status = 'sent'
+                queued_email.sent_date = timezone.now()
+                queued_email.save(update_fields=['status', 'sent_date'])
+    finally:
+        connection.close()
+
+    return len(batch)
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from irentstuffapp.benchmark import benchmark_asgi, benchmark_wsgi
+
+
+class Command(BaseCommand):
+    help = ("Compare the throughput of pages served through the WSGI and ASGI handlers with concurrent requests. "
+            "Run it against a copy of the production database, with DEBUG off.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/stuff/'], help='Paths to request in turn (default: /stuff/)')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests for each handler.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once.')
+        parser.add_argument('--user', help='Username to log in as, for pages that need a login such as /inbox/.')
+        parser.add_argument('--handler', choices=['wsgi', 'asgi', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'No user named {options["user"]}')
+
+        arguments = (options['paths'], options['requests'], max(1, options['concurrency']), user)
+        if options['handler'] in ('wsgi', 'both'):
+            self.stdout.write(str(benchmark_wsgi(*arguments)))
+        if options['handler'] in ('asgi', 'both'):
+            self.stdout.write(str(benchmark_asgi(*arguments)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from irentstuffapp.models import Item
+
+
+class Command(BaseCommand):
+    help = "Check that every item's active rental and purchase match its open rentals and purchases."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Repair the items that are out of step.')
+
+    def handle(self, *args, **options):
+        mismatches = Item.check_active_transactions(fix=options['fix'])
+        for item_id, field_name, stored_id, expected_id in mismatches:
+            self.stdout.write(f'Item {item_id}: {field_name} is {stored_id}, expected {expected_id}')
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All active rentals and purchases are consistent'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(mismatches)} active rentals and purchases'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Found {len(mismatches)} inconsistent active rentals and purchases, run with --fix to repair them'))
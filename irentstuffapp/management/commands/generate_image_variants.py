@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from irentstuffapp.images import generate_image_variants, image_manifests
+from irentstuffapp.models import Item
+
+
+class Command(BaseCommand):
+    help = ("Create the thumbnails and WebP copies of item images uploaded before they were created on upload, "
+            "or of every item image with --all.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recreate the variants of images that already have them.')
+
+    def handle(self, *args, **options):
+        names = list(Item.objects.exclude(image='').values_list('image', flat=True).distinct())
+        if not options['all']:
+            existing = image_manifests(names)
+            names = [name for name in names if name not in existing]
+
+        created = 0
+        for name in names:
+            if generate_image_variants(name) is not None:
+                created += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Created variants of {created} of {len(names)} item images'))
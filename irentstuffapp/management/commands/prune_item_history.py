@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from irentstuffapp.models import Item, ItemStatesCaretaker
+
+
+class Command(BaseCommand):
+    help = ("Delete saved item versions older than the retention period or beyond the undo depth, keeping the newest "
+            "version of each item. Run it once to compact history saved before the undo depth was enforced.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'ITEM_HISTORY_RETENTION_DAYS', 365),
+            help='Keep versions saved within this many days (default: ITEM_HISTORY_RETENTION_DAYS or 365)',
+        )
+        parser.add_argument(
+            '--keep', type=int, default=ItemStatesCaretaker.max_depth(),
+            help='Keep at most this many versions of each item (default: ITEM_HISTORY_MAX_DEPTH or 20)',
+        )
+
+    def handle(self, *args, **options):
+        saved_before = timezone.now() - timedelta(days=options['days'])
+        keep = options['keep']
+
+        items = Item.objects.annotate(versions=Count('caretaker'), oldest_saved=Min('caretaker__datetime_saved'))
+        stale = items.filter(Q(oldest_saved__lt=saved_before) | Q(versions__gt=keep) if keep else
+                             Q(oldest_saved__lt=saved_before))
+
+        deleted = 0
+        for item in stale.iterator():
+            deleted += ItemStatesCaretaker.prune(item, keep=keep, saved_before=saved_before)
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} item versions saved before {saved_before:%Y-%m-%d}'
+                                             f'{f" or beyond the newest {keep}" if keep else ""}'))
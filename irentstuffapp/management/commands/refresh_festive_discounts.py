@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from irentstuffapp.festive_discount_strategies import get_discount_strategy
+from irentstuffapp.models import Item
+
+
+class Command(BaseCommand):
+    help = "Recompute festive discount prices for all items. Schedule this to run just after midnight each day."
+
+    def handle(self, *args, **options):
+        discount_strategy = get_discount_strategy()
+        updated = Item.refresh_festive_discounts()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{timezone.localdate()}: applied {type(discount_strategy).__name__} to {updated} items'
+        ))
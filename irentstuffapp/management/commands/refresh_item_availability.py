@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from irentstuffapp.models import Item
+
+
+class Command(BaseCommand):
+    help = ("Mark items as rented out on the days their bookings cover, and available again once they end. "
+            "Schedule this to run just after midnight each day.")
+
+    def handle(self, *args, **options):
+        updated = Item.refresh_rental_availability()
+
+        self.stdout.write(self.style.SUCCESS(f'{timezone.localdate()}: updated the availability of {updated} items'))
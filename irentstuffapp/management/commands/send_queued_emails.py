@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from irentstuffapp.mail import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Deliver emails queued by QueuedEmailBackend in batches over a single connection, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Number of emails sent per connection.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new emails.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between polls with --loop.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = send_queued_emails(batch_size=options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} queued emails'))
@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# Frozen copies of the index names and create_search_index()/drop_search_index() in search.py as they were when this
+# migration was written. ensure_search_index() recreates the SQLite triggers with the current ones after migrating.
+SQLITE_FTS_TABLE = 'irentstuffapp_item_fts'
+SQLITE_FTS_TRIGGERS = ('irentstuffapp_item_fts_insert', 'irentstuffapp_item_fts_delete', 'irentstuffapp_item_fts_update')
+POSTGRES_SEARCH_INDEX = 'irentstuffapp_item_search_gin'
+
+
+def create_item_search_index(apps, schema_editor):
+    item_model = apps.get_model('irentstuffapp', 'Item')
+    vendor = schema_editor.connection.vendor
+    table = item_model._meta.db_table
+
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+            f"title, description, content='{table}', content_rowid='id', tokenize='porter unicode61', prefix='2 3')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TRIGGERS[0]} AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); "
+            f"END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TRIGGERS[1]} AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, old.description); "
+            f"END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TRIGGERS[2]} AFTER UPDATE OF title, description ON {table} BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, old.description); "
+            f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); "
+            f"END"
+        )
+        schema_editor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        index = GinIndex(SearchVector('title', 'description', config='english'), name=POSTGRES_SEARCH_INDEX)
+        schema_editor.add_index(item_model, index)
+
+
+def drop_item_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        for trigger in SQLITE_FTS_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_SEARCH_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irentstuffapp", "0019_purchase_deal_reserved_date"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_item_search_index, drop_item_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.3 on 2026-10-17 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('irentstuffapp', '0021_queuedemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageReadReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.PositiveBigIntegerField(default=0)),
+                ('read_date', models.DateTimeField(auto_now=True)),
+                ('enquiring_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_read_receipts', to='irentstuffapp.item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_read_receipts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='messagereadreceipt',
+            constraint=models.UniqueConstraint(fields=('user', 'item', 'enquiring_user'), name='messagereadreceipt_unique_thread'),
+        ),
+    ]
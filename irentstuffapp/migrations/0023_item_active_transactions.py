@@ -0,0 +1,38 @@
+# Generated by Django 4.2.3 on 2026-10-17 12:44
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def set_active_transactions(apps, schema_editor):
+    Item = apps.get_model('irentstuffapp', 'Item')
+    Rental = apps.get_model('irentstuffapp', 'Rental')
+    Purchase = apps.get_model('irentstuffapp', 'Purchase')
+
+    def first_open(model):
+        return Subquery(model.objects.filter(item=OuterRef('pk')).exclude(status__in=('completed', 'cancelled'))
+                        .order_by('id').values('id')[:1])
+
+    Item.objects.update(active_rental=first_open(Rental), active_purchase=first_open(Purchase))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('irentstuffapp', '0022_messagereadreceipt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='active_purchase',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='irentstuffapp.purchase'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='active_rental',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='irentstuffapp.rental'),
+        ),
+        migrations.RunPython(set_active_transactions, migrations.RunPython.noop),
+    ]
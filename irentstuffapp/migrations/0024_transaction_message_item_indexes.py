@@ -0,0 +1,61 @@
+# Generated by Django 4.2.3 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('irentstuffapp', '0023_item_active_transactions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['created_date', 'id'], name='item_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['discount_percentage', 'id'], name='item_discount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['item', 'enquiring_user', 'timestamp'], name='message_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'is_read'], name='message_recipient_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(condition=models.Q(('status__in', ('reserved', 'confirmed'))), fields=['item', 'id'], name='purchase_item_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['item', 'status'], name='purchase_item_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['item', 'buyer', 'status', 'deal_date'], name='purchase_item_buyer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['item', 'owner', 'status'], name='purchase_item_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('status__in', ('pending', 'confirmed'))), fields=['item', 'id'], name='rental_item_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['item', 'status'], name='rental_item_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['item', 'renter', 'status', 'start_date'], name='rental_item_renter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['item', 'owner', 'status'], name='rental_item_owner_idx'),
+        ),
+    ]
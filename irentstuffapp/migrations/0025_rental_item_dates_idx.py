@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-17 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('irentstuffapp', '0024_transaction_message_item_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='rental',
+            name='rental_item_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['item', 'status', 'end_date', 'start_date'], name='rental_item_dates_idx'),
+        ),
+    ]
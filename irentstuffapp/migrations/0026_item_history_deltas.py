@@ -0,0 +1,73 @@
+# Generated by Django 4.2.3 on 2026-10-17 13:00
+
+from django.db import migrations, models
+from django.db.backends.utils import format_number
+
+CHECKPOINT_INTERVAL = 10
+# Frozen copies of ITEM_HISTORY_FIELDS and item_history_state() as they were when this migration was written
+ITEM_HISTORY_FIELDS = (
+    'owner', 'title', 'description', 'category', 'condition', 'availability', 'price_per_day', 'deposit', 'image',
+    'created_date', 'deleted_date',
+)
+
+
+def item_history_state(obj):
+    # JSON-ready values of the history fields of a historical ItemMemento
+    state = {}
+    for name in ITEM_HISTORY_FIELDS:
+        field = obj._meta.get_field(name)
+        value = field.value_from_object(obj)
+        if value is None:
+            state[name] = None
+        elif isinstance(field, models.DecimalField):
+            state[name] = format_number(field.to_python(value), field.max_digits, field.decimal_places)
+        else:
+            state[name] = field.value_to_string(obj)
+    return state
+
+
+def encode_item_history(apps, schema_editor):
+    # Store each full memento as the fields that changed since the item's previous version
+    ItemStatesCaretaker = apps.get_model('irentstuffapp', 'ItemStatesCaretaker')
+
+    previous_item_id = previous_state = None
+    since_checkpoint = 0
+    versions = ItemStatesCaretaker.objects.select_related('memento').order_by('item_id', 'datetime_saved', 'id')
+    for version in versions.iterator():
+        state = item_history_state(version.memento)
+        if version.item_id != previous_item_id or since_checkpoint + 1 >= CHECKPOINT_INTERVAL:
+            version.changes, version.is_checkpoint = state, True
+            since_checkpoint = 0
+        else:
+            version.changes = {name: value for name, value in state.items() if previous_state.get(name) != value}
+            since_checkpoint += 1
+        version.save(update_fields=['changes', 'is_checkpoint'])
+        previous_item_id, previous_state = version.item_id, state
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('irentstuffapp', '0025_rental_item_dates_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemstatescaretaker',
+            name='changes',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='itemstatescaretaker',
+            name='is_checkpoint',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(encode_item_history, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='itemstatescaretaker',
+            name='memento',
+        ),
+        migrations.DeleteModel(
+            name='ItemMemento',
+        ),
+    ]
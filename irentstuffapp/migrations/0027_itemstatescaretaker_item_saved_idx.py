@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-17 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('irentstuffapp', '0026_item_history_deltas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemstatescaretaker',
+            index=models.Index(fields=['item', 'datetime_saved'], name='caretaker_item_saved_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.3 on 2026-10-17 13:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_conversations(apps, schema_editor):
+    # Summarise the existing messages of each conversation
+    Message = apps.get_model('irentstuffapp', 'Message')
+    Conversation = apps.get_model('irentstuffapp', 'Conversation')
+
+    unread = models.Q(is_read=False)
+    threads = Message.objects.order_by().values('item', 'enquiring_user').annotate(
+        owner=models.Max('item__owner'),
+        message_count=models.Count('id'),
+        owner_unread=models.Count('id', filter=unread & models.Q(recipient=models.F('item__owner'))),
+        enquirer_unread=models.Count(
+            'id', filter=unread & models.Q(recipient=models.F('enquiring_user')) & ~models.Q(recipient=models.F('item__owner'))),
+        last_message_id=models.Max('id'),
+        last_message_at=models.Max('timestamp'),
+    )
+    Conversation.objects.bulk_create(
+        Conversation(
+            item_id=thread['item'], enquiring_user_id=thread['enquiring_user'], owner_id=thread['owner'],
+            message_count=thread['message_count'], owner_unread=thread['owner_unread'],
+            enquirer_unread=thread['enquirer_unread'], last_message_id=thread['last_message_id'],
+            last_message_at=thread['last_message_at'],
+        )
+        for thread in threads.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('irentstuffapp', '0027_itemstatescaretaker_item_saved_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('owner_unread', models.PositiveIntegerField(default=0)),
+                ('enquirer_unread', models.PositiveIntegerField(default=0)),
+                ('last_message_id', models.PositiveBigIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('enquiring_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enquiring_conversations', to=settings.AUTH_USER_MODEL)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='irentstuffapp.item')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='owner_conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'last_message_at'], name='conversation_owner_idx'), models.Index(fields=['enquiring_user', 'last_message_at'], name='conversation_enquirer_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('item', 'enquiring_user'), name='conversation_unique_thread'),
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,35 @@
 from abc import ABC, abstractmethod
 from datetime import timedelta
+from functools import lru_cache
+from decimal import Decimal
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.mail import EmailMultiAlternatives
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.template.loader import render_to_string
+from django.db import models, transaction
+from django.db.backends.utils import format_number
+from django.db.models import Case, CharField, Count, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.template.loader import get_template
 from django.utils import timezone
 from django.utils.html import strip_tags
 
+from .dispatch import dispatch_observers
 from .festive_discount_strategies import get_discount_strategy
 
 
-def send_email(subject, message, email_to):
+@lru_cache(maxsize=None)
+def get_email_template(template_name):
+    # Email templates are compiled once per process rather than on every notification
+    return get_template(template_name)
+
+
+def render_email(template_name, context):
+    return get_email_template(template_name).render(context)
+
+
+def build_email(subject, message, email_to):
     email_from = settings.DEFAULT_FROM_EMAIL
     plain_message = strip_tags(message)
     email = EmailMultiAlternatives(
@@ -22,7 +39,52 @@ def send_email(subject, message, email_to):
         [email_to],
     )
     email.attach_alternative(message, "text/html")
-    email.send()
+    return email
+
+
+def send_email(subject, message, email_to):
+    build_email(subject, message, email_to).send()
+
+
+class EmailDispatcher:
+    """
+    Collects the emails for one or more events and sends them together over a single connection.
+    """
+    def __init__(self):
+        self.emails = []
+
+    def add(self, subject, template_name, context, email_to):
+        self.emails.append(build_email(subject, render_email(template_name, context), email_to))
+
+    def send(self):
+        if self.emails:
+            get_connection().send_messages(self.emails)
+        self.emails = []
+
+
+# In-process copy of the system user that sends admin messages, cleared by signals.py when that user changes
+_system_user = {'id': None, 'user': None}
+
+
+def system_user_id():
+    # Id of the user that admin messages are sent from, for telling them apart without loading the user
+    return getattr(settings, 'SYSTEM_USER_ID', 1)
+
+
+def get_system_user():
+    """
+    Return the user that admin messages are sent from, set with the SYSTEM_USER_ID setting (1 by default).
+    """
+    user_id = system_user_id()
+    if _system_user['id'] != user_id:
+        _system_user.update(id=user_id, user=User.objects.get(id=user_id))
+    return _system_user['user']
+
+
+def invalidate_system_user(user_id=None):
+    # Only the cached user's own changes matter, so other users can be saved without clearing it
+    if user_id is None or user_id == _system_user['id']:
+        _system_user.update(id=None, user=None)
 
 
 # Define the Observer interface
@@ -34,36 +96,35 @@ class RentalObserver(ABC):
 
 # Implement concrete Observers (classes responsible for sending emails and messages)
 class RentalEmailSender(RentalObserver):
+    # Pass a shared dispatcher to send the emails of several rentals together, e.g. for bulk cancellations
+    def __init__(self, dispatcher=None):
+        self.dispatcher = dispatcher
+
     def update(self, rental):
         # Logic to send email to the renter or owner based on rental state change
+        dispatcher = self.dispatcher or EmailDispatcher()
+        context = {'rental': rental}
 
         if rental.status == 'pending':
-            subject = 'iRentStuff.app - You added a Rental'
-            html_message = render_to_string('emails/rental_added_email.html', {'rental': rental})
-            send_email(subject, html_message, rental.owner.email)
-
-            subject2 = 'iRentStuff.app - You have a Rental Offer'
-            html_message2 = render_to_string('emails/rental_added_email2.html', {'rental': rental})
-            send_email(subject2, html_message2, rental.renter.email)
+            dispatcher.add('iRentStuff.app - You added a Rental', 'emails/rental_added_email.html', context, rental.owner.email)
+            dispatcher.add('iRentStuff.app - You have a Rental Offer', 'emails/rental_added_email2.html', context, rental.renter.email)
 
         elif rental.status == 'confirmed':
-            subject = 'iRentStuff.app - you have a Rental Acceptance'
-            html_message = render_to_string('emails/rental_confirmed_email.html', {'rental': rental})
-            send_email(subject, html_message, rental.owner.email)
-
-            subject2 = 'iRentStuff.app - You accepted a Rental Offer'
-            html_message2 = render_to_string('emails/rental_confirmed_email2.html', {'rental': rental})
-            send_email(subject2, html_message2, rental.renter.email)
+            dispatcher.add('iRentStuff.app - you have a Rental Acceptance', 'emails/rental_confirmed_email.html', context,
+                           rental.owner.email)
+            dispatcher.add('iRentStuff.app - You accepted a Rental Offer', 'emails/rental_confirmed_email2.html', context,
+                           rental.renter.email)
 
         elif rental.status == 'completed':
-            subject = 'iRentStuff.app - you have set a rental to Complete'
-            html_message = render_to_string('emails/rental_completed_email.html', {'rental': rental})
-            send_email(subject, html_message, rental.owner.email)
+            dispatcher.add('iRentStuff.app - you have set a rental to Complete', 'emails/rental_completed_email.html', context,
+                           rental.owner.email)
 
         elif rental.status == 'cancelled':
-            subject = 'iRentStuff.app - you have cancelled a rental'
-            html_message = render_to_string('emails/rental_cancelled_email.html', {'rental': rental})
-            send_email(subject, html_message, rental.owner.email)
+            dispatcher.add('iRentStuff.app - you have cancelled a rental', 'emails/rental_cancelled_email.html', context,
+                           rental.owner.email)
+
+        if not self.dispatcher:
+            dispatcher.send()
 
 
 class RentalMessageSender(RentalObserver):
@@ -74,7 +135,7 @@ class RentalMessageSender(RentalObserver):
             message = Message()
             message.item = rental.item
             message.enquiring_user = rental.renter
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = rental.renter
             message.subject = 'Admin'
             message.content = 'Rental has been offered. Period of rental is from ' + str(rental.start_date) + ' to ' + str(rental.end_date)
@@ -84,7 +145,7 @@ class RentalMessageSender(RentalObserver):
             message = Message()
             message.item = rental.item
             message.enquiring_user = rental.renter
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = rental.owner
             message.subject = 'Admin'
             message.content = 'Rental has been accepted. Period of rental is from ' + str(rental.start_date) + ' to ' + str(rental.end_date)
@@ -94,7 +155,7 @@ class RentalMessageSender(RentalObserver):
             message = Message()
             message.item = rental.item
             message.enquiring_user = rental.renter
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = rental.renter
             message.subject = 'Admin'
             message.content = 'Rental has been completed. Period of rental is from ' + str(rental.start_date) + ' to ' + str(rental.end_date)
@@ -104,7 +165,7 @@ class RentalMessageSender(RentalObserver):
             message = Message()
             message.item = rental.item
             message.enquiring_user = rental.renter
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = rental.renter
             message.subject = 'Admin'
             message.content = 'Rental has been cancelled.'
@@ -119,6 +180,124 @@ class PositiveDecimalField(models.DecimalField):
         self.validators.append(MinValueValidator(0.01, message='Value should be at least 0.01.'))
 
 
+ACTIVE_TRANSACTION_FIELDS = ('active_rental', 'active_purchase')
+FESTIVE_DISCOUNT_FIELDS = ('festive_discount_description', 'festive_discount_percentage', 'festive_discount_price')
+
+
+def first_open_transaction(model):
+    # Filtering on the open statuses, rather than excluding the closed ones, lets the partial item_open indexes be used
+    return model.objects.filter(status__in=model.OPEN_STATUSES).order_by(*model.ACTIVE_ORDERING)
+
+
+def update_active_transaction(obj, field_name):
+    """
+    Keep the item's active_rental or active_purchase pointer in step with a rental or purchase that has just been saved.
+    The pointer is the first open transaction of the item in ACTIVE_ORDERING: the earliest booking for rentals.
+    """
+    next_open = first_open_transaction(type(obj)).filter(item_id=obj.item_id).values('id')[:1]
+    Item.objects.filter(pk=obj.item_id).update(**{field_name: Subquery(next_open)})
+
+
+def rental_availability():
+    """
+    Database expression for an item's availability from its rentals: rented out while an open booking covers today.
+    Items with a pending purchase or sold keep their availability.
+    """
+    today = timezone.localdate()
+    current = Rental.objects.filter(
+        item=OuterRef('pk'), status__in=Rental.OPEN_STATUSES, start_date__lte=today, end_date__gt=today
+    )
+    return Case(
+        When(availability__in=('pending_purchase', 'sold'), then=F('availability')),
+        When(Exists(current), then=Value('active_rental')),
+        default=Value('available'),
+    )
+
+
+def transition_state(obj, new_state, field_name):
+    """
+    Move a rental or purchase from the status it was read with to new_state, as a compare-and-set
+    UPDATE ... WHERE status=<expected>, and update the item's availability and active pointer in the same transaction.
+    Returns whether this call made the transition; if another request changed the status first, nothing is written.
+    Observers are only notified if this call won, and not until the transaction commits.
+    """
+    date_field = obj.STATE_DATE_FIELDS[new_state]
+    now = timezone.now()
+
+    with transaction.atomic():
+        won = type(obj).objects.filter(pk=obj.pk, status=obj.status).update(status=new_state, **{date_field: now})
+        if not won:
+            return False
+
+        obj.status = new_state
+        setattr(obj, date_field, now)
+        update_active_transaction(obj, field_name)
+        availability = obj.item_availability()
+        if availability is not None:
+            Item.objects.filter(pk=obj.item_id).update(availability=availability)
+        obj.notify_observers()
+    return True
+
+
+def festive_discount_key(description, percentage, price):
+    # Festive discount values as stored in the database (2 decimal places), for comparing computed and saved values
+    def stored_decimal(value):
+        return None if value is None else round(Decimal(str(value)), 2)
+    return description, stored_decimal(percentage), stored_decimal(price)
+
+
+def festive_discount_price_expression(percentage):
+    """
+    Database expression for an item's deposit after a festive discount of the given percentage.
+    """
+    return Round(F('deposit') * (1 - Decimal(percentage) / 100), 2)
+
+
+class ItemQuerySet(models.QuerySet):
+    # Fields shown on item cards and used for ordering listings, so that rendering a page needs no further queries
+    LISTING_FIELDS = (
+        'id', 'title', 'image', 'condition', 'availability', 'price_per_day', 'deposit', 'discount_percentage',
+        'created_date', 'category_id', 'owner__username', 'category__name',
+    )
+
+    def for_listing(self):
+        """
+        Fetch the owner and category of each item in the same query, loading only the fields needed by listings.
+        """
+        return self.select_related('owner', 'category').only(*self.LISTING_FIELDS)
+
+    def with_prices(self):
+        """
+        Annotate items with their discounted rental price and today's festive discount on the purchase price,
+        so that they are computed in the same SELECT and can be used for sorting and filtering.
+        """
+        price_field = DecimalField(max_digits=10, decimal_places=2)
+        discounted_price = Case(
+            When(discount_percentage__gt=0, then=F('price_per_day') * (1 - F('discount_percentage') * Decimal('0.01'))),
+            default=F('price_per_day'),
+            output_field=price_field,
+        )
+
+        description, percentage = get_discount_strategy().get_discount_details(None)
+        if percentage:
+            eligible = Q(festive_discounts=True, availability='available', deposit__isnull=False)
+            festive_description = Case(When(eligible, then=Value(description)), default=None, output_field=CharField())
+            festive_percentage = Case(When(eligible, then=Value(Decimal(percentage))), default=None, output_field=price_field)
+            festive_price = Case(
+                When(eligible, then=festive_discount_price_expression(percentage)), default=None, output_field=price_field
+            )
+        else:
+            festive_description = Value(None, output_field=CharField())
+            festive_percentage = festive_price = Value(None, output_field=price_field)
+
+        return self.annotate(
+            discounted_price=discounted_price,
+            festive_description=festive_description,
+            festive_percentage=festive_percentage,
+            festive_price=festive_price,
+        )
+
+
 class Item(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
@@ -142,10 +321,56 @@ class Item(models.Model):
     festive_discount_description = models.TextField(blank=True, null=True)
     festive_discount_price = PositiveDecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
     festive_discount_percentage = PositiveDecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
+    # First open (not completed or cancelled) rental and purchase, kept up to date by Rental.save and Purchase.save
+    active_rental = models.ForeignKey('Rental', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    active_purchase = models.ForeignKey('Purchase', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+
+    objects = ItemQuerySet.as_manager()
+
+    # Image name as stored in the database, so that saving an item only creates image variants for a new upload
+    saved_image_name = None
+
+    class Meta:
+        indexes = [
+            # Listing orders, see ITEMS_LIST_ORDERING and the interest display templates
+            models.Index(fields=['created_date', 'id'], name='item_created_idx'),
+            models.Index(fields=['discount_percentage', 'id'], name='item_discount_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            item.saved_image_name = values[field_names.index('image')]
+        return item
+
+    @classmethod
+    def check_active_transactions(cls, fix=False):
+        """
+        Compare every item's active rental and purchase with the open rentals and purchases, and optionally repair them.
+        Returns a list of (item id, field name, stored id, expected id) for the pointers that were wrong.
+        """
+        expected = {
+            'active_rental': Subquery(first_open_transaction(Rental).filter(item=OuterRef('pk')).values('id')[:1]),
+            'active_purchase': Subquery(first_open_transaction(Purchase).filter(item=OuterRef('pk')).values('id')[:1]),
+        }
+        items = cls.objects.annotate(**{f'expected_{name}': expression for name, expression in expected.items()})
+
+        mismatches = []
+        for item in items.only('id', *ACTIVE_TRANSACTION_FIELDS).iterator():
+            for name in expected:
+                stored_id, expected_id = getattr(item, f'{name}_id'), getattr(item, f'expected_{name}')
+                if stored_id != expected_id:
+                    mismatches.append((item.id, name, stored_id, expected_id))
+
+        if fix:
+            for item_id, name, stored_id, expected_id in mismatches:
+                cls.objects.filter(pk=item_id).update(**{name: expected_id})
+        return mismatches
+
     # Discount decorator for Rental discounts
     def apply_discount(func):
         def wrapper(request, *args, **kwargs):
@@ -159,68 +384,111 @@ class Item(models.Model):
     # Discount strategy for Purchase discounts
     def calculate_festive_discount_price(self):
         discount_strategy = get_discount_strategy()
+        stored = (self.festive_discount_description, self.festive_discount_percentage, self.festive_discount_price)
 
         (self.festive_discount_description,
          self.festive_discount_percentage,
          self.festive_discount_price) = discount_strategy.calculate_discounted_deposit(self.deposit)
 
-        self.save()
+        # The item detail page calls this on every view, so only write when the discount has changed
+        if festive_discount_key(*stored) != festive_discount_key(
+                self.festive_discount_description, self.festive_discount_percentage, self.festive_discount_price):
+            self.save(update_fields=FESTIVE_DISCOUNT_FIELDS)
+
+    def clear_festive_discount(self):
+        if self.festive_discount_description or self.festive_discount_percentage or self.festive_discount_price:
+            self.festive_discount_description = self.festive_discount_percentage = self.festive_discount_price = None
+            self.save(update_fields=FESTIVE_DISCOUNT_FIELDS)
+
+    @classmethod
+    def refresh_festive_discounts(cls):
+        """
+        Recompute the festive discount fields of every item for today's discount strategy.
+        Runs once per day from the refresh_festive_discounts command, using bulk UPDATEs instead of saving each item.
+        """
+        discount_strategy = get_discount_strategy()
+        # Festive strategies give a flat percentage, so the details do not depend on the deposit
+        description, percentage = discount_strategy.get_discount_details(None)
+        no_discount = {'festive_discount_description': None, 'festive_discount_percentage': None, 'festive_discount_price': None}
+
+        updated = cls.objects.filter(festive_discounts=False).update(**no_discount)
+
+        eligible_items = cls.objects.filter(festive_discounts=True, availability='available')
+        if percentage:
+            updated += eligible_items.filter(deposit__isnull=False).update(
+                festive_discount_description=description,
+                festive_discount_percentage=percentage,
+                festive_discount_price=festive_discount_price_expression(percentage),
+            )
+            updated += eligible_items.filter(deposit__isnull=True).update(**no_discount)
+        else:
+            updated += eligible_items.update(**no_discount)
+
+        return updated
+
+    @classmethod
+    def refresh_rental_availability(cls):
+        """
+        Bookings start and end on their dates without anything being saved, so recompute once a day which items are
+        rented out today. Returns the number of items whose availability changed.
+        """
+        return cls.objects.alias(current=rental_availability()).exclude(availability=F('current')).update(
+            availability=rental_availability()
+        )
 
     def create_memento(self):
         """
         Create a memento object representing the current state of the Item.
         """
-        return ItemMemento(
-            item=self,
-            owner=self.owner,
-            title=self.title,
-            description=self.description,
-            category=self.category,
-            condition=self.condition,
-            availability=self.availability,
-            price_per_day=self.price_per_day,
-            deposit=self.deposit,
-            image=self.image,
-            created_date=self.created_date,
-            deleted_date=self.deleted_date
-        )
+        return ItemMemento(item_history_state(self))
 
     def restore_from_memento(self, memento):
         """
         Restore the Item to a previous state using the provided memento.
         """
-        self.owner = memento.owner
-        self.title = memento.title
-        self.description = memento.description
-        self.category = memento.category
-        self.condition = memento.condition
-        self.availability = memento.availability
-        self.price_per_day = memento.price_per_day
-        self.deposit = memento.deposit
-        self.image = memento.image
-        self.created_date = memento.created_date
-        self.deleted_date = memento.deleted_date
-        self.save()
+        for name, value in memento.state.items():
+            field = self._meta.get_field(name)
+            setattr(self, field.attname, None if value is None else field.to_python(value))
+        # Only the saved fields, so that restoring cannot reset the active rental and purchase
+        self.save(update_fields=list(memento.state))
 
         # Delete the memento from the database
         # memento.delete()
 
 
-class ItemMemento(models.Model):
-    item = models.ForeignKey(Item, on_delete=models.CASCADE)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)
-    title = models.CharField(max_length=255)
-    description = models.TextField(blank=True)
-    category = models.ForeignKey('Category', on_delete=models.SET_NULL, null=True)
-    condition = models.CharField(max_length=255, choices=[('excellent', 'Excellent'), ('good', 'Good'), ('fair', 'Fair'), ('poor', 'Poor')])
-    availability = models.CharField(max_length=255, choices=[
-        ('available', 'Available'), ('active_rental', 'Active Rental'), ('pending_purchase', 'Pending Purchase'), ('sold', 'Sold')
-        ], default='available')
-    price_per_day = models.DecimalField(max_digits=10, decimal_places=2)
-    deposit = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
-    image = models.ImageField(upload_to='item_images/')
-    created_date = models.DateTimeField()
-    deleted_date = models.DateTimeField(blank=True, null=True)
+# Item fields that are saved in its history and restored by undo
+ITEM_HISTORY_FIELDS = (
+    'owner', 'title', 'description', 'category', 'condition', 'availability', 'price_per_day', 'deposit', 'image',
+    'created_date', 'deleted_date',
+)
+
+
+def item_history_state(obj):
+    # JSON-ready values of the history fields of an item, as strings that the fields' to_python() reads back
+    state = {}
+    for name in ITEM_HISTORY_FIELDS:
+        field = obj._meta.get_field(name)
+        value = field.value_from_object(obj)
+        if value is None:
+            state[name] = None
+        elif isinstance(field, models.DecimalField):
+            # Written out to the field's decimal places, so that 12 and 12.00 are not recorded as a change
+            state[name] = format_number(field.to_python(value), field.max_digits, field.decimal_places)
+        else:
+            state[name] = field.value_to_string(obj)
+    return state
+
+
+class ItemMemento:
+    """
+    Snapshot of the history fields of an Item. Mementos are not stored whole: the caretaker stores each version as
+    the fields that changed since the previous version, with a full checkpoint every few versions.
+    """
+    def __init__(self, state):
+        self.state = state
+
+    def changes_since(self, previous):
+        return {name: value for name, value in self.state.items() if previous.state.get(name) != value}
 
 
 class Category(models.Model):
@@ -231,30 +499,122 @@ class Category(models.Model):
 
 
 class ItemStatesCaretaker(models.Model):
+    """
+    One saved version of an item. Checkpoints hold every history field, other versions only the fields that changed
+    since the version before, so a version is restored by replaying the changes since the last checkpoint.
+    """
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='caretaker')
-    memento = models.ForeignKey(ItemMemento, on_delete=models.CASCADE)
+    changes = models.JSONField(default=dict)
+    is_checkpoint = models.BooleanField(default=False)
     datetime_saved = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # Newest versions of an item, for undo and for replaying back to a checkpoint
+            models.Index(fields=['item', 'datetime_saved'], name='caretaker_item_saved_idx'),
+        ]
+
+    @classmethod
+    def history(cls, item):
+        # Newest version first
+        return cls.objects.filter(item=item).order_by('-datetime_saved', '-id')
+
+    @staticmethod
+    def checkpoint_interval():
+        return getattr(settings, 'ITEM_HISTORY_CHECKPOINT_INTERVAL', 10)
+
+    @staticmethod
+    def max_depth():
+        # Number of versions kept per item, or None to keep them all
+        return getattr(settings, 'ITEM_HISTORY_MAX_DEPTH', 20)
+
+    @staticmethod
+    def replay(versions):
+        """
+        Rebuild the memento of the first of versions (newest first), reading back to its checkpoint.
+        Returns None if there are no versions, or if they do not reach back to a checkpoint.
+        """
+        changes = []
+        for version in versions:
+            changes.append(version.changes)
+            if version.is_checkpoint:
+                state = {}
+                for version_changes in reversed(changes):
+                    state.update(version_changes)
+                return ItemMemento(state)
+        return None
+
+    def get_memento(self):
+        """
+        Rebuild the memento of this version by replaying the changes since the last checkpoint, in one query.
+        """
+        versions = ItemStatesCaretaker.history(self.item).filter(
+            Q(datetime_saved__lt=self.datetime_saved) | Q(datetime_saved=self.datetime_saved, id__lte=self.id)
+        )
+        return self.replay(versions.iterator(chunk_size=self.checkpoint_interval()))
+
     def save_state(self):
         """
-        Save the current state of the Item by creating a new memento.
+        Save the current state of the Item as a new version, storing only the fields that changed since the
+        previous version, or all of them when the previous checkpoint is checkpoint_interval() versions back.
+        Versions beyond max_depth() are pruned in the same transaction.
         """
         memento = self.item.create_memento()
-        memento.save()
-        self.memento = memento
+        interval = self.checkpoint_interval()
+
+        with transaction.atomic():
+            previous = self.replay(ItemStatesCaretaker.history(self.item)[:interval - 1]) if interval > 1 else None
 
-        ct1 = ItemStatesCaretaker(item=self.item, memento=memento)
+            if previous is None:
+                ct1 = ItemStatesCaretaker(item=self.item, changes=memento.state, is_checkpoint=True)
+            else:
+                ct1 = ItemStatesCaretaker(item=self.item, changes=memento.changes_since(previous))
 
-        ct1.save()
+            ct1.save()
+            self.prune(self.item, keep=self.max_depth())
 
     def restore_state(self):
         """
-        Restore the Item to a previous state using the stored memento.
+        Restore the Item to the state saved in this version.
         """
-        self.item.restore_from_memento(self.memento)
+        self.item.restore_from_memento(self.get_memento())
 
     def delete_state(self):
-        self.delete
+        self.delete()
+
+    @classmethod
+    def prune(cls, item, keep=None, saved_before=None):
+        """
+        Retention policy: delete the versions of the item beyond the newest keep versions and those saved before
+        saved_before, always keeping the newest version. The oldest version kept is rewritten as a checkpoint.
+        Returns the number of versions deleted.
+        """
+        versions = cls.history(item)
+        if keep and not saved_before and not versions[keep:keep + 1].exists():
+            # Within the undo depth, which is the usual case on save_state
+            return 0
+        newest = versions.first()
+        if newest is None:
+            return 0
+
+        # The oldest version to keep under each rule, and the newer of the two
+        oldest_kept = []
+        if keep:
+            oldest_kept.append(versions[keep - 1:keep].first() or versions.last())
+        if saved_before:
+            oldest_kept.append(versions.filter(datetime_saved__gte=saved_before).last() or newest)
+        if not oldest_kept:
+            return 0
+        kept = max(oldest_kept, key=lambda version: (version.datetime_saved, version.id))
+
+        older = cls.objects.filter(item=item).filter(
+            Q(datetime_saved__lt=kept.datetime_saved) | Q(datetime_saved=kept.datetime_saved, id__lt=kept.id)
+        )
+        with transaction.atomic():
+            if not kept.is_checkpoint:
+                cls.objects.filter(pk=kept.pk).update(changes=kept.get_memento().state, is_checkpoint=True)
+            deleted, _ = older.delete()
+        return deleted
 
 
 class Rental(models.Model):
@@ -274,9 +634,30 @@ class Rental(models.Model):
         )
     apply_loyalty_discount = models.BooleanField(default=False, help_text='Apply loyalty discount for this rental')
 
+    OPEN_STATUSES = ('pending', 'confirmed')
+    ACTIVE_ORDERING = ('start_date', 'id')
+    STATE_DATE_FIELDS = {
+        'pending': 'pending_date', 'confirmed': 'confirm_date', 'completed': 'complete_date',
+        'cancelled': 'cancelled_date',
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'id'], condition=Q(status__in=('pending', 'confirmed')), name='rental_item_open_idx'),
+            # Also serves overlap checks, which skip rentals that ended before the requested dates
+            models.Index(fields=['item', 'status', 'end_date', 'start_date'], name='rental_item_dates_idx'),
+            models.Index(fields=['item', 'renter', 'status', 'start_date'], name='rental_item_renter_idx'),
+            models.Index(fields=['item', 'owner', 'status'], name='rental_item_owner_idx'),
+        ]
+
     def __str__(self):
         return f'{self.item} ({self.owner}, {self.renter}): {self.start_date} - {self.end_date}'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            update_active_transaction(self, 'active_rental')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.observers = []
@@ -288,8 +669,8 @@ class Rental(models.Model):
         self.observers.remove(observer)
 
     def notify_observers(self):
-        for observer in self.observers:
-            observer.update(self)
+        # Observers run once the transaction commits, off the request thread (see dispatch.py)
+        dispatch_observers(self.observers, self)
 
     # Method that changes the state of the rental and triggers notifications
     def change_state(self, new_state):
@@ -310,6 +691,14 @@ class Rental(models.Model):
         # Notify all observers
         self.notify_observers()
 
+    def transition(self, new_state):
+        # Race-free change_state for requests; returns False if the rental was no longer in the status it was read with
+        return transition_state(self, new_state, 'active_rental')
+
+    def item_availability(self):
+        # The item stays rented out while another booking covers today
+        return rental_availability()
+
 
 class Purchase(models.Model):
     buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='purchases_as_renter')
@@ -326,9 +715,29 @@ class Purchase(models.Model):
         default='reserved'
         )
 
+    OPEN_STATUSES = ('reserved', 'confirmed')
+    ACTIVE_ORDERING = ('id',)
+    STATE_DATE_FIELDS = {
+        'reserved': 'deal_reserved_date', 'confirmed': 'deal_confirmed_date', 'completed': 'deal_complete_date',
+        'cancelled': 'deal_cancelled_date',
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'id'], condition=Q(status__in=('reserved', 'confirmed')), name='purchase_item_open_idx'),
+            models.Index(fields=['item', 'status'], name='purchase_item_status_idx'),
+            models.Index(fields=['item', 'buyer', 'status', 'deal_date'], name='purchase_item_buyer_idx'),
+            models.Index(fields=['item', 'owner', 'status'], name='purchase_item_owner_idx'),
+        ]
+
     def __str__(self):
         return f'{self.item} ({self.owner}, {self.buyer}): {self.deal_date}'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            update_active_transaction(self, 'active_purchase')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.observers = []
@@ -340,8 +749,8 @@ class Purchase(models.Model):
         self.observers.remove(observer)
 
     def notify_observers(self):
-        for observer in self.observers:
-            observer.update(self)
+        # Observers run once the transaction commits, off the request thread (see dispatch.py)
+        dispatch_observers(self.observers, self)
 
     # Method that changes the state of the rental and triggers notifications
     def change_state(self, new_state):
@@ -349,7 +758,7 @@ class Purchase(models.Model):
         if new_state == 'reserved':
             self.deal_reserved_date = timezone.now()
         elif new_state == 'confirmed':
-            self.confirm_date = timezone.now()
+            self.deal_confirmed_date = timezone.now()
         elif new_state == 'completed':
             self.deal_complete_date = timezone.now()
         elif new_state == 'cancelled':
@@ -361,6 +770,13 @@ class Purchase(models.Model):
         # Notify all observers
         self.notify_observers()
 
+    def transition(self, new_state):
+        # Race-free change_state for requests; returns False if the purchase was no longer in the status it was read with
+        return transition_state(self, new_state, 'active_purchase')
+
+    def item_availability(self):
+        return {'completed': 'sold', 'cancelled': 'available'}.get(self.status)
+
 
 # Define the Observer interface
 class PurchaseObserver(ABC):
@@ -371,36 +787,37 @@ class PurchaseObserver(ABC):
 
 # Implement concrete Observers (classes responsible for sending emails and messages)
 class PurchaseEmailSender(PurchaseObserver):
+    # Pass a shared dispatcher to send the emails of several purchases together, e.g. for bulk cancellations
+    def __init__(self, dispatcher=None):
+        self.dispatcher = dispatcher
+
     def update(self, purchase):
         # Logic to send email to the buyer or owner based on purchase state change
+        dispatcher = self.dispatcher or EmailDispatcher()
+        context = {'purchase': purchase}
 
         if purchase.status == 'reserved':
-            subject = 'iRentStuff.app - You made a Purchase reservation'
-            html_message = render_to_string('emails/purchase_added_email.html', {'purchase': purchase})
-            send_email(subject, html_message, purchase.owner.email)
-
-            subject2 = 'iRentStuff.app - You have a Purchase Offer'
-            html_message2 = render_to_string('emails/purchase_added_email2.html', {'purchase': purchase})
-            send_email(subject2, html_message2, purchase.buyer.email)
+            dispatcher.add('iRentStuff.app - You made a Purchase reservation', 'emails/purchase_added_email.html', context,
+                           purchase.owner.email)
+            dispatcher.add('iRentStuff.app - You have a Purchase Offer', 'emails/purchase_added_email2.html', context,
+                           purchase.buyer.email)
 
         elif purchase.status == 'confirmed':
-            subject = 'iRentStuff.app - you have a Purchase Acceptance'
-            html_message = render_to_string('emails/purchase_confirmed_email.html', {'purchase': purchase})
-            send_email(subject, html_message, purchase.owner.email)
-
-            subject2 = 'iRentStuff.app - You accepted a Purchase Offer'
-            html_message2 = render_to_string('emails/purchase_confirmed_email2.html', {'purchase': purchase})
-            send_email(subject2, html_message2, purchase.buyer.email)
+            dispatcher.add('iRentStuff.app - you have a Purchase Acceptance', 'emails/purchase_confirmed_email.html', context,
+                           purchase.owner.email)
+            dispatcher.add('iRentStuff.app - You accepted a Purchase Offer', 'emails/purchase_confirmed_email2.html', context,
+                           purchase.buyer.email)
 
         elif purchase.status == 'completed':
-            subject = 'iRentStuff.app - you have completed a sale'
-            html_message = render_to_string('emails/purchase_completed_email.html', {'purchase': purchase})
-            send_email(subject, html_message, purchase.owner.email)
+            dispatcher.add('iRentStuff.app - you have completed a sale', 'emails/purchase_completed_email.html', context,
+                           purchase.owner.email)
 
         elif purchase.status == 'cancelled':
-            subject = 'iRentStuff.app - you have cancelled a purchase'
-            html_message = render_to_string('emails/purchase_cancelled_email.html', {'purchase': purchase})
-            send_email(subject, html_message, purchase.owner.email)
+            dispatcher.add('iRentStuff.app - you have cancelled a purchase', 'emails/purchase_cancelled_email.html', context,
+                           purchase.owner.email)
+
+        if not self.dispatcher:
+            dispatcher.send()
 
 
 class PurchaseMessageSender(PurchaseObserver):
@@ -411,7 +828,7 @@ class PurchaseMessageSender(PurchaseObserver):
             message = Message()
             message.item = purchase.item
             message.enquiring_user = purchase.buyer
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = purchase.buyer
             message.subject = 'Admin'
             message.content = 'Purchase has been reserved. Deal date is on ' + str(purchase.deal_date)
@@ -421,7 +838,7 @@ class PurchaseMessageSender(PurchaseObserver):
             message = Message()
             message.item = purchase.item
             message.enquiring_user = purchase.buyer
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = purchase.owner
             message.subject = 'Admin'
             message.content = 'Purchase has been accepted. Deal date is on ' + str(purchase.deal_date)
@@ -431,7 +848,7 @@ class PurchaseMessageSender(PurchaseObserver):
             message = Message()
             message.item = purchase.item
             message.enquiring_user = purchase.buyer
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = purchase.buyer
             message.subject = 'Admin'
             message.content = 'Purchase has been completed.'
@@ -441,7 +858,7 @@ class PurchaseMessageSender(PurchaseObserver):
             message = Message()
             message.item = purchase.item
             message.enquiring_user = purchase.buyer
-            message.sender = User.objects.get(id=1)
+            message.sender = get_system_user()
             message.recipient = purchase.buyer
             message.subject = 'Admin'
             message.content = 'Purchase has been cancelled.'
@@ -470,9 +887,176 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'enquiring_user', 'timestamp'], name='message_thread_idx'),
+            models.Index(fields=['recipient', 'is_read'], name='message_recipient_unread_idx'),
+        ]
+
     def __str__(self):
         return f'{self.subject} - {self.sender} to {self.recipient} about {self.item.title} ({self.enquiring_user.username})'
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Conversation.record_message(self)
+
+
+class Conversation(models.Model):
+    """
+    Summary of a conversation, i.e. the messages about an item with one enquiring user, kept up to date as messages are
+    sent and read. The inbox lists these instead of grouping all of a user's messages.
+    """
+    item = models.ForeignKey(Item, related_name='conversations', on_delete=models.CASCADE)
+    owner = models.ForeignKey(User, related_name='owner_conversations', on_delete=models.CASCADE)
+    enquiring_user = models.ForeignKey(User, related_name='enquiring_conversations', on_delete=models.CASCADE)
+    message_count = models.PositiveIntegerField(default=0)
+    owner_unread = models.PositiveIntegerField(default=0)
+    enquirer_unread = models.PositiveIntegerField(default=0)
+    last_message_id = models.PositiveBigIntegerField(default=0)
+    last_message_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'enquiring_user'], name='conversation_unique_thread'),
+        ]
+        indexes = [
+            # Each side's inbox, most recent first
+            models.Index(fields=['owner', 'last_message_at'], name='conversation_owner_idx'),
+            models.Index(fields=['enquiring_user', 'last_message_at'], name='conversation_enquirer_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.item.title} ({self.enquiring_user.username}): {self.message_count} messages'
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Conversations the user takes part in, most recent first, annotated with the user's unread_count.
+        """
+        return cls.objects.filter(Q(owner=user) | Q(enquiring_user=user)).annotate(
+            unread_count=Case(When(owner=user, then=F('owner_unread')), default=F('enquirer_unread'))
+        ).order_by('-last_message_at', '-id')
+
+    @classmethod
+    def record_message(cls, message):
+        # Counted with F() expressions, so concurrent messages in the same conversation are not lost
+        conversation, _ = cls.objects.get_or_create(
+            item_id=message.item_id, enquiring_user_id=message.enquiring_user_id,
+            defaults={'owner_id': message.item.owner_id},
+        )
+        unread_field = 'owner_unread' if message.recipient_id == conversation.owner_id else 'enquirer_unread'
+        if not message.is_read:
+            transaction.on_commit(lambda: increment_unread_message_count(message.recipient_id))
+        is_latest = Q(last_message_id__lt=message.id)
+        cls.objects.filter(pk=conversation.pk).update(**{
+            'message_count': F('message_count') + 1,
+            unread_field: F(unread_field) + (0 if message.is_read else 1),
+            'last_message_id': Case(When(is_latest, then=Value(message.id)), default=F('last_message_id'),
+                                    output_field=models.PositiveBigIntegerField()),
+            'last_message_at': Case(When(is_latest, then=Value(message.timestamp)), default=F('last_message_at'),
+                                    output_field=models.DateTimeField()),
+        })
+
+    @classmethod
+    def update_unread(cls, item, enquiring_user):
+        """
+        Recount both sides' unread messages in a conversation after some have been read, in the same UPDATE. Messages
+        to the owner count as the owner's, and all others as the enquiring user's, as in record_message().
+        """
+        unread = Message.objects.filter(item=item, enquiring_user=enquiring_user, is_read=False).order_by()
+
+        def unread_count(messages):
+            return Coalesce(Subquery(messages.values('item').annotate(count=Count('id')).values('count')), 0)
+
+        cls.objects.filter(item=item, enquiring_user=enquiring_user).update(
+            owner_unread=unread_count(unread.filter(recipient=OuterRef('owner'))),
+            enquirer_unread=unread_count(unread.exclude(recipient=OuterRef('owner'))),
+        )
+
+        user_ids = (item.owner_id, enquiring_user.id)
+        invalidate_unread_message_counts(user_ids)
+        # Invalidate again once committed, in case another request cached the old counts in the meantime
+        transaction.on_commit(lambda: invalidate_unread_message_counts(user_ids))
+
+
+def unread_message_count_key(user_id):
+    return f'irentstuffapp:unread_messages:{user_id}'
+
+
+def get_unread_message_count(user):
+    """
+    Number of unread messages of the user, for the navbar badge. The count is cached, incremented as messages arrive
+    and recounted from the user's conversations after they read some, so rendering a page does not count messages.
+    """
+    key = unread_message_count_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = Conversation.for_user(user).aggregate(total=Sum('unread_count'))['total'] or 0
+        cache.add(key, count, timeout=getattr(settings, 'UNREAD_MESSAGE_CACHE_TIMEOUT', 5 * 60))
+        count = cache.get(key, count)
+    return count
+
+
+def increment_unread_message_count(user_id):
+    try:
+        cache.incr(unread_message_count_key(user_id))
+    except ValueError:
+        # Not cached, so the next read counts it from the conversations
+        pass
+
+
+def invalidate_unread_message_counts(user_ids):
+    cache.delete_many([unread_message_count_key(user_id) for user_id in user_ids])
+
+
+class MessageReadReceipt(models.Model):
+    """
+    Watermark of the last message a user has read in a conversation, i.e. the messages about an item with one
+    enquiring user. Marking messages read does not rely on it: a message can commit after a newer one was read.
+    """
+    user = models.ForeignKey(User, related_name='message_read_receipts', on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, related_name='message_read_receipts', on_delete=models.CASCADE)
+    enquiring_user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    read_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item', 'enquiring_user'], name='messagereadreceipt_unique_thread'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} read {self.item.title} ({self.enquiring_user.username}) up to message {self.last_read_message_id}'
+
+    @classmethod
+    def mark_read(cls, user, item, enquiring_user):
+        """
+        Mark the incoming messages of a conversation as read with a single UPDATE, and move the watermark to the
+        latest message. Reopening a conversation without new messages writes nothing. Returns the number of messages marked.
+        """
+        thread = Message.objects.filter(item=item, enquiring_user=enquiring_user)
+        unread = Q(recipient=user, is_read=False)
+        summary = thread.aggregate(last_id=models.Max('id'), unread=Count('id', filter=unread))
+        last_message_id = summary['last_id']
+        if last_message_id is None:
+            return 0
+
+        receipt, _ = cls.objects.get_or_create(user=user, item=item, enquiring_user=enquiring_user)
+        if not summary['unread'] and receipt.last_read_message_id >= last_message_id:
+            return 0
+
+        # Every unread message to the user, including older ones that committed after the watermark had passed them
+        marked = thread.filter(unread, id__lte=last_message_id).update(is_read=True) if summary['unread'] else 0
+
+        cls.objects.filter(pk=receipt.pk, last_read_message_id__lt=last_message_id).update(
+            last_read_message_id=last_message_id, read_date=timezone.now())
+        if marked:
+            Conversation.update_unread(item, enquiring_user)
+        return marked
+
 
 class Interest(models.Model):
     categories = models.ManyToManyField(Category)
@@ -492,25 +1076,93 @@ class UserInterests(models.Model):
 
 
 # 3 template classes: Top3Categories, ItemMinDiscount, NewlyCreated (more can be created if need be)
+# ordering ends with a unique field so that it can also be used for keyset pagination
 class InterestDisplayTemplate:
+    ordering = ('-created_date', '-id')
 
     def get_items(self, interest):
         raise NotImplementedError("Subclasses must implement this method")
 
 
 class Top3CategoryDisplay(InterestDisplayTemplate):
+    ordering = ('category_id', 'title', 'id')
+
     def get_items(self, interest):
         categories = interest.categories.all()
-        return Item.objects.filter(category__in=categories).order_by('category', 'title')
+        return Item.objects.filter(category__in=categories).order_by(*self.ordering)
 
 
 class ItemsDiscountDisplay(InterestDisplayTemplate):
+    ordering = ('-discount_percentage', '-id')
+
     def get_items(self, interest):
         discount = interest.discount
-        return Item.objects.filter(discount_percentage__gte=1).order_by('-discount_percentage')
+        return Item.objects.filter(discount_percentage__gte=1).order_by(*self.ordering)
 
 
 class NewlyListedItemsDisplay(InterestDisplayTemplate):
+    ordering = ('-created_date', '-id')
+
     def get_items(self, interest):
         day_filter = interest.item_cd_crit if interest.item_cd_crit else 3
-        return Item.objects.filter(created_date__gt=timezone.now() - timedelta(days=day_filter)).order_by('-created_date')
+        return Item.objects.filter(created_date__gt=timezone.now() - timedelta(days=day_filter)).order_by(*self.ordering)
+
+
+# Outbox of emails waiting to be delivered by the send_queued_emails command (see mail.py)
+class QueuedEmail(models.Model):
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    headers = models.JSONField(default=dict)
+    subject = models.TextField()
+    body = models.TextField(blank=True)
+    alternatives = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=255,
+        choices=[('queued', 'Queued'), ('sent', 'Sent'), ('failed', 'Failed')],
+        default='queued'
+        )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(default=timezone.now)
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_date'], name='queuedemail_due_idx')]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.to)} ({self.status})'
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Create an unsaved QueuedEmail from an EmailMessage, or an EmailMultiAlternatives with its HTML alternative.
+        """
+        return cls(
+            from_email=message.from_email,
+            to=list(message.to),
+            cc=list(message.cc),
+            bcc=list(message.bcc),
+            reply_to=list(message.reply_to),
+            headers=dict(message.extra_headers),
+            subject=message.subject,
+            body=message.body,
+            alternatives=[list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        )
+
+    def to_message(self, connection=None):
+        return EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email,
+            to=self.to,
+            cc=self.cc,
+            bcc=self.bcc,
+            reply_to=self.reply_to,
+            headers=self.headers,
+            alternatives=[tuple(alternative) for alternative in self.alternatives],
+            connection=connection,
+        )
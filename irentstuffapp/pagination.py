@@ -0,0 +1,111 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def get_page_size(request):
+    """
+    Return the page size requested with ?page_size=, bounded by the ITEMS_PAGE_SIZE / ITEMS_MAX_PAGE_SIZE settings.
+    """
+    default_page_size = getattr(settings, 'ITEMS_PAGE_SIZE', 24)
+    max_page_size = getattr(settings, 'ITEMS_MAX_PAGE_SIZE', 100)
+    try:
+        page_size = int(request.GET.get('page_size', default_page_size))
+    except ValueError:
+        page_size = default_page_size
+    return max(1, min(page_size, max_page_size))
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of the last row on a page into an opaque, URL-safe cursor token.
+    """
+    # str() keeps full microsecond precision for datetimes, which the seek comparison relies on
+    data = json.dumps(values, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decode a cursor token created by encode_cursor. Invalid tokens are treated as the first page.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_queryset(queryset, ordering, cursor=None):
+    """
+    Order queryset by ordering and filter it to the rows after the cursor.
+
+    ordering is a sequence of field names, prefixed with '-' for descending order, that must end with a unique field
+    such as 'id'. Rows after the cursor are found with a WHERE clause on the ordering fields instead of an OFFSET,
+    so each page costs the same regardless of how deep into the listing it is.
+    """
+    fields = [field.lstrip('-') for field in ordering]
+    queryset = queryset.order_by(*ordering)
+
+    values = decode_cursor(cursor)
+    if values is not None and len(values) == len(fields):
+        # (a > x) OR (a = x AND b > y) OR ... with the comparison flipped for descending fields
+        seek = Q()
+        for position, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{fields[position]}__{lookup}': values[position]})
+            for previous in range(position):
+                condition &= Q(**{fields[previous]: values[previous]})
+            seek |= condition
+        try:
+            queryset = queryset.filter(seek)
+        except (ValidationError, ValueError, TypeError):
+            # A tampered cursor falls back to the first page
+            pass
+
+    return queryset
+
+
+def keyset_page(items, ordering, page_size):
+    # items holds up to page_size + 1 rows; the extra one only tells whether there is a next page
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last_item = items[-1]
+        next_cursor = encode_cursor([getattr(last_item, field.lstrip('-')) for field in ordering])
+
+    return KeysetPage(items, next_cursor)
+
+
+def paginate_keyset(queryset, ordering, cursor=None, page_size=24):
+    """
+    Return one page of queryset using keyset (seek) pagination, see keyset_queryset.
+    """
+    queryset = keyset_queryset(queryset, ordering, cursor)
+    # Fetch one extra row to find out whether there is a next page
+    return keyset_page(list(queryset[:page_size + 1]), ordering, page_size)
+
+
+async def apaginate_keyset(queryset, ordering, cursor=None, page_size=24):
+    """
+    Async version of paginate_keyset, for async views.
+    """
+    queryset = keyset_queryset(queryset, ordering, cursor)
+    return keyset_page([item async for item in queryset[:page_size + 1]], ordering, page_size)
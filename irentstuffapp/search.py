@@ -0,0 +1,188 @@
+import re
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+
+SQLITE_FTS_TABLE = 'irentstuffapp_item_fts'
+SQLITE_FTS_TRIGGERS = ('irentstuffapp_item_fts_insert', 'irentstuffapp_item_fts_delete', 'irentstuffapp_item_fts_update')
+POSTGRES_SEARCH_CONFIG = 'english'
+POSTGRES_SEARCH_INDEX = 'irentstuffapp_item_search_gin'
+
+
+def search_terms(query):
+    """
+    Split a search query into lowercase words. Punctuation is dropped so the terms are safe to use in FTS queries.
+    """
+    return re.findall(r'\w+', query.lower())
+
+
+class SearchBackend:
+    def search(self, queryset, query):
+        """
+        Filter an Item queryset to the items matching query, annotated with a search_rank where higher is better.
+        """
+        raise NotImplementedError("Subclasses must implement search method")
+
+    def no_results(self, queryset):
+        # Still annotated so that the results can be ordered by search_rank
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+
+class SimpleSearchBackend(SearchBackend):
+    """
+    Fallback for databases without a full-text index. Every word must appear in the title or description.
+    """
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return self.no_results(queryset)
+
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(description__icontains=term)
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Searches the FTS5 index on item titles and descriptions, ranked by bm25.
+    """
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return self.no_results(queryset)
+
+        # Every word must match as a prefix, so that results show up while typing
+        match = ' '.join(f'"{term}"*' for term in terms)
+        table = queryset.model._meta.db_table
+        matching_ids = RawSQL(f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s', (match,))
+        # bm25 is lower for better matches, so it is negated to make search_rank higher for better matches
+        rank = RawSQL(
+            f'SELECT -bm25({SQLITE_FTS_TABLE}, 10.0, 1.0) FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (match,),
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matching_ids).annotate(search_rank=rank)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Searches a tsvector of item titles and descriptions, backed by a GIN expression index.
+    """
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        terms = search_terms(query)
+        if not terms:
+            return self.no_results(queryset)
+
+        search_query = SearchQuery(' & '.join(f'{term}:*' for term in terms), config=POSTGRES_SEARCH_CONFIG, search_type='raw')
+        search_vector = item_search_vector()
+        return queryset.annotate(search_vector=search_vector).filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(search_vector, search_query)
+        )
+
+
+def item_search_vector():
+    """
+    The tsvector expression searched by PostgresSearchBackend. The GIN index is built on this same expression.
+    """
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector('title', 'description', config=POSTGRES_SEARCH_CONFIG)
+
+
+def get_search_backend():
+    """
+    Return the search backend from the ITEMS_SEARCH_BACKEND setting, or the one matching the database in use.
+    """
+    backend_path = getattr(settings, 'ITEMS_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    elif connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SimpleSearchBackend()
+
+
+def create_search_index(schema_editor, item_model):
+    """
+    Create the full-text index for items. On SQLite the FTS5 table is kept in sync with the item table by triggers.
+    """
+    vendor = schema_editor.connection.vendor
+    table = item_model._meta.db_table
+
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+            f"title, description, content='{table}', content_rowid='id', tokenize='porter unicode61', prefix='2 3')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TRIGGERS[0]} AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); "
+            f"END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TRIGGERS[1]} AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, old.description); "
+            f"END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TRIGGERS[2]} AFTER UPDATE OF title, description ON {table} BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, old.description); "
+            f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); "
+            f"END"
+        )
+        schema_editor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+
+        schema_editor.add_index(item_model, GinIndex(item_search_vector(), name=POSTGRES_SEARCH_INDEX))
+
+
+def drop_search_index(schema_editor, item_model):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        for trigger in SQLITE_FTS_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_SEARCH_INDEX}')
+
+
+def ensure_search_index(using='default', **kwargs):
+    """
+    post_migrate handler that restores the SQLite FTS triggers. SQLite migrations that rebuild the item table drop
+    its triggers, so they are recreated and the index is rebuilt whenever any of them is missing.
+    """
+    from .models import Item
+
+    db_connection = connections[using]
+    if db_connection.vendor != 'sqlite':
+        return
+
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+            SQLITE_FTS_TRIGGERS,
+        )
+        trigger_count = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", (SQLITE_FTS_TABLE,))
+        fts_table_exists = cursor.fetchone()[0]
+
+    # The FTS table is only missing before its migration is applied or after it is rolled back
+    if fts_table_exists and trigger_count < len(SQLITE_FTS_TRIGGERS):
+        with db_connection.schema_editor() as schema_editor:
+            create_search_index(schema_editor, Item)
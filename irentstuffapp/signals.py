@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .broker import publish_message
+from .caches import invalidate_category_list
+from .dispatch import dispatch_task
+from .images import generate_image_variants, image_manifests
+from .models import Category, Item, Message, invalidate_system_user
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    invalidate_category_list()
+    # Invalidate again once committed, in case another request cached the old list in the meantime
+    transaction.on_commit(invalidate_category_list)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_system_user(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, **kwargs):
+    # Pushed to the conversation's listeners once committed, so they never see a message that was rolled back
+    if created:
+        transaction.on_commit(lambda: publish_message(instance))
+
+
+@receiver(post_save, sender=Item)
+def item_image_saved(sender, instance, update_fields=None, **kwargs):
+    # Thumbnails of a new upload are created in the background once committed; until then pages use the original
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    name = instance.image.name
+    if not name or name == instance.saved_image_name:
+        return
+    instance.saved_image_name = name
+    if name not in image_manifests([name]):
+        dispatch_task(generate_image_variants, name)
@@ -1,6 +1,53 @@
+from django.db.models import Count, Exists, OuterRef, Value
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
-from .models import Item, Rental, Purchase, Message, Review
+from .models import Item, Rental, Message, Review
+
+
+class ItemStateSnapshot:
+    """
+    Everything the item and user states check about an item, loaded up front in a fixed number of queries:
+    the item with its active rental and purchase, its message, undo and completed rental flags, and its reviews.
+    Pass it in the state context as 'snapshot'; without one the states query the database themselves.
+    """
+    def __init__(self, item, reviews):
+        self.item = item
+        self.reviews = reviews
+
+    @staticmethod
+    def item_queryset(user):
+        authenticated = user is not None and user.is_authenticated
+        return Item.objects.select_related(
+            'owner', 'category', 'active_rental__renter', 'active_purchase__buyer'
+        ).annotate(
+            has_messages=Exists(Message.objects.filter(item=OuterRef('pk'))),
+            undo_count=Count('caretaker'),
+            has_completed_rental_by_user=Exists(
+                Rental.objects.filter(item=OuterRef('pk'), renter=user, status='completed')
+            ) if authenticated else Value(False),
+        )
+
+    @staticmethod
+    def review_queryset(item):
+        return Review.objects.filter(rental__item=item).select_related('author')
+
+    @classmethod
+    def load(cls, item_id, user):
+        item = get_object_or_404(cls.item_queryset(user), pk=item_id)
+        return cls(item, list(cls.review_queryset(item)))
+
+    @classmethod
+    async def aload(cls, item_id, user):
+        """
+        Async version of load, with the same queries. user must already be loaded, see views.aget_user.
+        """
+        try:
+            item = await cls.item_queryset(user).aget(pk=item_id)
+        except Item.DoesNotExist:
+            raise Http404('No Item matches the given query.')
+        return cls(item, [review async for review in cls.review_queryset(item)])
 
 
 class ItemState:
@@ -18,17 +65,26 @@ class ItemState:
             return Message.objects.filter(item=context['item'])
 
     def show_item_messages(self, context):
-        if isinstance(context['user_state'], ConcreteUserIsItemOwner) and not Message.objects.filter(item=context['item']):
+        if 'snapshot' in context:
+            has_messages = context['snapshot'].item.has_messages
+        else:
+            has_messages = Message.objects.filter(item=context['item']).exists()
+
+        if isinstance(context['user_state'], ConcreteUserIsItemOwner) and not has_messages:
             return False
         else:
             return True
 
     def view_item_reviews(self, context):
+        if 'snapshot' in context:
+            return context['snapshot'].reviews
         return Review.objects.filter(rental__item=context['item'])
 
     def view_item_reviews_by_user(self, context):
         if isinstance(context['user_state'], ConcreteUserIsNotItemOwner):
-            return Rental.objects.filter(renter=context['user'], item=context['item'], status='completed')
+            if 'snapshot' in context:
+                return context['snapshot'].item.has_completed_rental_by_user
+            return Rental.objects.filter(renter=context['user'], item=context['item'], status='completed').exists()
 
     def can_cancel_rental(self, context):
         return False
@@ -40,7 +96,8 @@ class ItemState:
         return False
 
     def can_add_rental(self, context):
-        if isinstance(context['user_state'], ConcreteUserIsItemOwner) and not context['active_rental'] and not context['pending_purchase']:
+        # Rentals can be booked back to back, so only a pending purchase stops the owner adding one
+        if isinstance(context['user_state'], ConcreteUserIsItemOwner) and not context.get('pending_purchase'):
             return True
 
     def can_cancel_purchase(self, context):
@@ -118,27 +175,27 @@ class ConcreteUserIsItemOwner(UserState):
         return Item.objects.filter(item=context['item'])
 
     def view_active_rental_details(self, context):
-        return Rental.objects.filter(item=context['item']).exclude(status="completed").exclude(status="cancelled").first()
+        return context['item'].active_rental
 
     def view_pending_purchase_details(self, context):
-        return Purchase.objects.filter(item=context['item']).exclude(status="completed").exclude(status="cancelled").first()
+        return context['item'].active_purchase
 
 
 class ConcreteUserIsNotItemOwner(UserState):
     def view_active_rental_details(self, context):
-        try:
-            rental_object = Rental.objects.filter(
-                item=context['item'], renter=context['user']
-                ).exclude(status="completed").exclude(status="cancelled").first()
-        except Exception:
-            rental_object = None
-        return rental_object
+        rental_object = context['item'].active_rental
+        user_id = getattr(context['user'], 'id', None)
+        if rental_object is None or user_id is None:
+            return None
+        if rental_object.renter_id == user_id:
+            return rental_object
+        # The first booking is someone else's, so look for one of the user's later bookings
+        return Rental.objects.filter(
+            item=context['item'], renter_id=user_id, status__in=Rental.OPEN_STATUSES
+        ).order_by(*Rental.ACTIVE_ORDERING).first()
 
     def view_pending_purchase_details(self, context):
-        try:
-            purchase_object = Purchase.objects.filter(
-                item=context['item'], buyer=context['user']
-                ).exclude(status="completed").exclude(status="cancelled").first()
-        except Exception:
-            purchase_object = None
-        return purchase_object
+        purchase_object = context['item'].active_purchase
+        if purchase_object and purchase_object.buyer_id == getattr(context['user'], 'id', None):
+            return purchase_object
+        return None
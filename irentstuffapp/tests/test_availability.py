@@ -0,0 +1,197 @@
+from datetime import date, datetime, timedelta
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from irentstuffapp.availability import (available_between, book_rental, booked_rentals, free_ranges, parse_date_range,
+                                        parse_month)
+from irentstuffapp.models import Item, Category, Rental, Purchase
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+class AvailabilityTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+        self.renter = User.objects.create_user(username="testrenter", password="password456")
+        self.other_renter = User.objects.create_user(username="otherrenter", password="password789")
+        self.category = Category.objects.create(name="testcategory")
+        self.item = Item.objects.create(
+            owner=self.owner,
+            title="Test Item",
+            description="Test description",
+            category=self.category,
+            condition="excellent",
+            price_per_day=10.00,
+            deposit=50.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+        # A month that is entirely in the future
+        self.month = (timezone.localdate().replace(day=1) + timedelta(days=62)).replace(day=1)
+
+    def book(self, renter, start_day, end_day, status="pending"):
+        rental = Rental(owner=self.owner, renter=renter, item=self.item, status=status,
+                        start_date=self.month.replace(day=start_day), end_date=self.month.replace(day=end_day))
+        book_rental(rental)
+        return rental
+
+    def test_booked_rentals_overlap(self):
+        rental = self.book(self.renter, 10, 15)
+        self.book(self.renter, 1, 3).change_state("cancelled")
+
+        def booked(start_day, end_day):
+            return list(booked_rentals(self.item.id, self.month.replace(day=start_day), self.month.replace(day=end_day)))
+
+        self.assertEqual(booked(12, 20), [rental])
+        self.assertEqual(booked(5, 11), [rental])
+        # Rentals are returned on their end date, so the next one can start that day
+        self.assertEqual(booked(15, 20), [])
+        self.assertEqual(booked(5, 10), [])
+        # Cancelled rentals do not block the calendar
+        self.assertEqual(booked(1, 3), [])
+
+    def test_book_rental_rejects_overlap(self):
+        self.book(self.renter, 10, 15)
+        with self.assertRaises(ValidationError):
+            self.book(self.other_renter, 14, 20)
+        self.book(self.other_renter, 15, 20)
+        self.assertEqual(Rental.objects.filter(item=self.item).count(), 2)
+
+    def test_book_rental_sets_availability_from_today(self):
+        # A booking for a later month leaves the item available until it starts
+        self.book(self.renter, 10, 15)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.availability, "available")
+
+        today = timezone.localdate()
+        book_rental(Rental(owner=self.owner, renter=self.other_renter, item=self.item, start_date=today,
+                           end_date=today + timedelta(days=2)))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.availability, "active_rental")
+        # The earliest booking is the active one, whatever order they were made in
+        self.assertEqual(self.item.active_rental.renter, self.other_renter)
+
+    def test_refresh_rental_availability(self):
+        today = timezone.localdate()
+        rental = Rental.objects.create(owner=self.owner, renter=self.renter, item=self.item, status="confirmed",
+                                       start_date=today - timedelta(days=1), end_date=today + timedelta(days=1))
+
+        # The booking has started since it was made
+        self.assertEqual(Item.refresh_rental_availability(), 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.availability, "active_rental")
+        self.assertEqual(Item.refresh_rental_availability(), 0)
+
+        # ...and is due back today
+        Rental.objects.filter(pk=rental.pk).update(end_date=today)
+        self.assertEqual(Item.refresh_rental_availability(), 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.availability, "available")
+
+        # Sold items are left alone
+        Rental.objects.filter(pk=rental.pk).update(end_date=today + timedelta(days=1))
+        Item.objects.filter(pk=self.item.pk).update(availability="sold")
+        self.assertEqual(Item.refresh_rental_availability(), 0)
+
+    def test_free_ranges(self):
+        self.book(self.renter, 5, 10, status="confirmed")
+        self.book(self.other_renter, 10, 12)
+        self.book(self.renter, 20, 25)
+        next_month = (self.month + timedelta(days=31)).replace(day=1)
+
+        self.assertEqual(free_ranges(self.item, self.month), [
+            (self.month, self.month.replace(day=5)),
+            (self.month.replace(day=12), self.month.replace(day=20)),
+            (self.month.replace(day=25), next_month),
+        ])
+
+    def test_free_ranges_past_and_sold(self):
+        self.assertEqual(free_ranges(self.item, date(2020, 1, 1)), [])
+        self.item.availability = "sold"
+        self.assertEqual(free_ranges(self.item, self.month), [])
+
+    def test_parse_month(self):
+        self.assertEqual(parse_month("2024-05"), date(2024, 5, 1))
+        self.assertEqual(parse_month("not-a-month"), timezone.localdate().replace(day=1))
+        self.assertEqual(parse_month(None), timezone.localdate().replace(day=1))
+
+    def test_item_availability_json(self):
+        self.book(self.renter, 1, 10)
+        response = self.client.get(reverse("item_availability_json", kwargs={"item_id": self.item.id}),
+                                   {"month": self.month.strftime("%Y-%m")})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["month"], self.month.strftime("%Y-%m"))
+        self.assertEqual(data["free"][0]["start"], self.month.replace(day=10).isoformat())
+
+    def test_item_detail_shows_later_booking_to_its_renter(self):
+        self.book(self.renter, 1, 10)
+        later_rental = self.book(self.other_renter, 10, 12)
+
+        self.client.login(username="otherrenter", password="password789")
+        response = self.client.get(reverse("item_detail", kwargs={"item_id": self.item.id}))
+        self.assertEqual(response.context["active_rental"], later_rental)
+        self.assertTrue(response.context["accept_rental"])
+
+
+class AvailabilitySearchTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+        self.renter = User.objects.create_user(username="testrenter", password="password456")
+        self.tools = Category.objects.create(name="tools")
+        self.toys = Category.objects.create(name="toys")
+        self.items = {}
+        for title, category in (("Power drill", self.tools), ("Hammer drill", self.tools), ("Toy drill", self.toys),
+                                ("Ladder", self.tools)):
+            self.items[title] = Item.objects.create(
+                owner=self.owner,
+                title=title,
+                description="Test description",
+                category=category,
+                condition="excellent",
+                price_per_day=10.00,
+                deposit=50.00,
+                image="item_images/test_image.jpg",
+                created_date=datetime(2024, 2, 7, tzinfo=sgt),
+            )
+        self.start = timezone.localdate() + timedelta(days=10)
+        self.end = self.start + timedelta(days=5)
+
+        # The hammer drill is booked during the range, the power drill only right after it
+        Rental.objects.create(owner=self.owner, renter=self.renter, item=self.items["Hammer drill"], status="confirmed",
+                              start_date=self.start + timedelta(days=2), end_date=self.end + timedelta(days=2))
+        Rental.objects.create(owner=self.owner, renter=self.renter, item=self.items["Power drill"], status="pending",
+                              start_date=self.end, end_date=self.end + timedelta(days=3))
+        # The ladder is reserved for a purchase
+        Purchase.objects.create(owner=self.owner, buyer=self.renter, item=self.items["Ladder"], deal_date=self.start)
+
+    def test_available_between(self):
+        items = available_between(Item.objects.all(), self.start, self.end)
+        self.assertEqual(sorted(item.title for item in items), ["Power drill", "Toy drill"])
+
+    def test_parse_date_range(self):
+        self.assertEqual(parse_date_range("2024-05-01", "2024-05-03"), (date(2024, 5, 1), date(2024, 5, 3)))
+        self.assertEqual(parse_date_range("2024-05-03", "2024-05-01"), (None, None))
+        self.assertEqual(parse_date_range("2024-02-30", "2024-05-01"), (None, None))
+        self.assertEqual(parse_date_range("2024-05-01", None), (None, None))
+
+    def test_items_list_available_with_search_and_category(self):
+        response = self.client.get(reverse("items_list"), {
+            "search": "drill", "category": "tools",
+            "available_from": self.start.isoformat(), "available_to": self.end.isoformat(),
+        })
+        self.assertEqual([item.title for item in response.context["items"]], ["Power drill"])
+        self.assertContains(response, f"Available from {self.start.isoformat()} to {self.end.isoformat()}")
+
+    def test_items_list_json_available_paginated(self):
+        params = {"available_from": self.start.isoformat(), "available_to": self.end.isoformat(), "page_size": 1}
+        first_page = self.client.get(reverse("items_list_json"), params).json()
+        second_page = self.client.get(reverse("items_list_json"), dict(params, cursor=first_page["next_cursor"])).json()
+
+        self.assertEqual([item["title"] for item in first_page["items"] + second_page["items"]], ["Toy drill", "Power drill"])
+        self.assertIsNone(second_page["next_cursor"])
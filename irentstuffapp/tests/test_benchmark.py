@@ -0,0 +1,46 @@
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase
+from irentstuffapp.benchmark import BenchmarkResult, benchmark_asgi, benchmark_wsgi
+from irentstuffapp.models import Item
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+class BenchmarkTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+        self.renter = User.objects.create_user(username="testrenter", password="password456")
+        self.item = Item.objects.create(
+            owner=self.owner,
+            title="Test Item",
+            description="Test description",
+            condition="excellent",
+            price_per_day=10.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+        self.paths = ["/stuff/", f"/stuff/{self.item.id}/", "/inbox/"]
+
+    def test_benchmark_wsgi(self):
+        # One thread, as test data is only visible to this thread's connection
+        result = benchmark_wsgi(self.paths, 6, 1, user=self.renter)
+        self.assertEqual(len(result.latencies), 6)
+        self.assertEqual(dict(result.statuses), {200: 6})
+
+    def test_benchmark_asgi(self):
+        result = benchmark_asgi(self.paths, 6, 3, user=self.renter)
+        self.assertEqual(len(result.latencies), 6)
+        self.assertEqual(dict(result.statuses), {200: 6})
+
+    def test_login_required_pages_redirect_without_user(self):
+        result = benchmark_asgi(["/inbox/"], 2, 2)
+        self.assertEqual(dict(result.statuses), {302: 2})
+
+    def test_result(self):
+        result = BenchmarkResult("WSGI", [0.3, 0.1, 0.2, 0.4], {200: 4}, 2.0)
+        self.assertEqual(result.requests_per_second, 2.0)
+        self.assertEqual(result.percentile(50), 0.3)
+        self.assertEqual(result.percentile(95), 0.4)
+        self.assertIn("WSGI: 4 requests in 2.00s, 2.0 requests/s", str(result))
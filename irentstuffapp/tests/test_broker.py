@@ -0,0 +1,160 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from unittest.mock import patch
+from irentstuffapp.broker import LocalBroker, MessageBroker, get_broker, message_event, publish_message, thread_channel
+from irentstuffapp.models import Item, Message
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+class LocalBrokerTestCase(TestCase):
+    def test_publish_from_another_thread(self):
+        broker = LocalBroker()
+
+        async def receive():
+            async with broker.subscribe("messages:1:2") as subscription:
+                publisher = threading.Thread(target=broker.publish, args=("messages:1:2", {"id": 1}))
+                publisher.start()
+                event = await asyncio.wait_for(subscription.get(), timeout=5)
+                publisher.join()
+                return event
+
+        self.assertEqual(asyncio.run(receive()), {"id": 1})
+        # Subscribers are removed when they leave
+        self.assertEqual(broker._subscribers, {})
+
+    def test_message_broker_is_abstract(self):
+        with self.assertRaises(TypeError):
+            MessageBroker()
+
+    def test_publish_only_reaches_the_channel(self):
+        broker = LocalBroker()
+
+        async def receive():
+            async with broker.subscribe("messages:1:2") as subscription:
+                broker.publish("messages:1:3", {"id": 1})
+                broker.publish("messages:1:2", {"id": 2})
+                return await asyncio.wait_for(subscription.get(), timeout=5)
+
+        self.assertEqual(asyncio.run(receive()), {"id": 2})
+
+    def test_slow_subscriber_drops_events(self):
+        broker = LocalBroker(max_queued=1)
+
+        async def receive():
+            async with broker.subscribe("messages:1:2") as subscription:
+                broker.publish("messages:1:2", {"id": 1})
+                broker.publish("messages:1:2", {"id": 2})
+                await asyncio.sleep(0)
+                return subscription.queue.qsize()
+
+        self.assertEqual(asyncio.run(receive()), 1)
+
+
+class ItemMessagesStreamTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+        self.renter = User.objects.create_user(username="testrenter", password="password456")
+        self.other_user = User.objects.create_user(username="otheruser", password="password789")
+        self.item = Item.objects.create(
+            owner=self.owner,
+            title="Test Item",
+            description="Test description",
+            condition="excellent",
+            price_per_day=10.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+        self.messages = [
+            Message.objects.create(sender=self.renter, recipient=self.owner, item=self.item, enquiring_user=self.renter,
+                                   subject="message", content=f"Message {i}")
+            for i in range(3)
+        ]
+        self.url = reverse("item_messages_stream", kwargs={"item_id": self.item.id, "userid": self.renter.id})
+        self.async_client.force_login(self.owner)
+
+    def events(self, content):
+        return [json.loads(line[len("data: "):]) for line in content.splitlines() if line.startswith("data: ")]
+
+    def test_stream_sends_missed_messages(self):
+        self.client.login(username="testrenter", password="password456")
+        response = self.client.get(self.url, HTTP_LAST_EVENT_ID=str(self.messages[0].id))
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join(response.streaming_content).decode()
+        self.assertTrue(content.startswith("retry: "))
+        self.assertEqual([event["content"] for event in self.events(content)], ["Message 1", "Message 2"])
+        self.assertIn(f"id: {self.messages[2].id}\n", content)
+
+    def test_stream_forbidden_for_other_users(self):
+        self.client.login(username="otheruser", password="password789")
+        # Users who are not the owner only follow their own conversation
+        response = self.client.get(self.url, {"after": 0})
+        self.assertEqual(self.events(b"".join(response.streaming_content).decode()), [])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @override_settings(MESSAGE_STREAM_TIMEOUT=5)
+    async def test_stream_pushes_new_messages(self):
+        response = await self.async_client.get(self.url, {"after": self.messages[1].id})
+        content = aiter(response.streaming_content)
+
+        self.assertTrue((await anext(content)).startswith(b"retry: "))
+        self.assertEqual(self.events((await anext(content)).decode())[0]["content"], "Message 2")
+
+        # Messages published after the catch-up are pushed, and ones already sent are skipped
+        broker = get_broker()
+        broker.publish(thread_channel(self.item.id, self.renter.id), {"id": self.messages[2].id, "content": "Message 2"})
+        broker.publish(thread_channel(self.item.id, self.renter.id), {"id": self.messages[2].id + 1, "content": "New"})
+        self.assertEqual(self.events((await anext(content)).decode())[0]["content"], "New")
+
+    @override_settings(MESSAGE_STREAM_TIMEOUT=5)
+    async def test_stream_catches_up_in_batches(self):
+        with patch("irentstuffapp.views.MISSED_MESSAGES_LIMIT", 2):
+            response = await self.async_client.get(self.url, {"after": 0})
+            content = aiter(response.streaming_content)
+            await anext(content)
+            # All the missed messages are sent, not just the first batch
+            events = [self.events((await anext(content)).decode())[0]["content"] for _ in self.messages]
+        self.assertEqual(events, ["Message 0", "Message 1", "Message 2"])
+
+    def test_message_event(self):
+        event = message_event(self.messages[0])
+        self.assertEqual(event["sender"], "testrenter")
+        self.assertEqual(event["content"], "Message 0")
+        self.assertFalse(event["admin"])
+
+    def test_message_event_without_system_user(self):
+        # Admin messages are told apart by the sender id, so the system user row is not needed
+        with override_settings(SYSTEM_USER_ID=self.renter.id):
+            self.assertTrue(message_event(self.messages[0])["admin"])
+        with override_settings(SYSTEM_USER_ID=0), self.assertNumQueries(0):
+            self.assertFalse(message_event(self.messages[0])["admin"])
+
+    def test_message_published_on_commit(self):
+        with patch("irentstuffapp.signals.publish_message") as mock_publish_message:
+            with self.captureOnCommitCallbacks(execute=True):
+                message = Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item,
+                                                 enquiring_user=self.renter, subject="message", content="Reply")
+                mock_publish_message.assert_not_called()
+        mock_publish_message.assert_called_once_with(message)
+
+    def test_publish_message(self):
+        async def receive():
+            async with get_broker().subscribe(thread_channel(self.item.id, self.renter.id)) as subscription:
+                publish_message(self.messages[0])
+                return await asyncio.wait_for(subscription.get(), timeout=5)
+
+        self.assertEqual(asyncio.run(receive())["id"], self.messages[0].id)
+
+    def test_publish_message_failure_is_logged(self):
+        with patch("irentstuffapp.broker.get_broker", side_effect=ConnectionError):
+            with self.assertLogs("irentstuffapp.broker", level="ERROR"):
+                publish_message(self.messages[0])
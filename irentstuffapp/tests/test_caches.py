@@ -0,0 +1,99 @@
+from datetime import datetime
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+from django.urls import reverse
+from irentstuffapp.caches import get_category_list, invalidate_category_list, CATEGORY_LIST_VERSION_KEY
+from irentstuffapp.context_processors import category_list, unread_messages
+from irentstuffapp.models import Category, Item, Message, MessageReadReceipt, get_unread_message_count
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+class CategoryListCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        invalidate_category_list()
+        self.category = Category.objects.create(name="testcategory")
+
+    def test_category_list_is_cached(self):
+        self.assertEqual(get_category_list(), [self.category])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_category_list(), [self.category])
+            self.assertEqual(category_list(RequestFactory().get('/'))['categories'], [self.category])
+
+    def test_category_list_invalidated_on_save(self):
+        get_category_list()
+        self.category.name = "renamed"
+        self.category.save()
+        other_category = Category.objects.create(name="othercategory")
+        self.assertEqual([category.name for category in get_category_list()], ["renamed", "othercategory"])
+
+        other_category.delete()
+        self.assertEqual(get_category_list(), [self.category])
+
+    def test_category_list_version_evicted(self):
+        get_category_list()
+        cache.delete(CATEGORY_LIST_VERSION_KEY)
+        Category.objects.create(name="othercategory")
+        self.assertEqual(len(get_category_list()), 2)
+
+
+class UnreadMessageCountTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+        self.renter = User.objects.create_user(username="testrenter", password="password456")
+        self.item = Item.objects.create(
+            owner=self.owner,
+            title="Test Item",
+            description="Test description",
+            condition="excellent",
+            price_per_day=10.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+
+    def send(self, sender, recipient):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=sender, recipient=recipient, item=self.item, enquiring_user=self.renter,
+                                   subject="message", content="Test message")
+
+    def test_unread_count_is_cached_and_incremented(self):
+        self.send(self.renter, self.owner)
+        self.assertEqual(get_unread_message_count(self.owner), 1)
+
+        self.send(self.renter, self.owner)
+        self.send(self.owner, self.renter)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_message_count(self.owner), 2)
+            request = RequestFactory().get('/')
+            request.user = self.owner
+            self.assertEqual(unread_messages(request), {'unread_message_count': 2})
+        self.assertEqual(get_unread_message_count(self.renter), 1)
+
+    def test_unread_count_recounted_after_reading(self):
+        self.send(self.renter, self.owner)
+        self.send(self.renter, self.owner)
+        self.assertEqual(get_unread_message_count(self.owner), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MessageReadReceipt.mark_read(self.owner, self.item, self.renter)
+        self.assertEqual(get_unread_message_count(self.owner), 0)
+
+    def test_unread_messages_context_processor_anonymous(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        self.assertEqual(unread_messages(request), {})
+
+    def test_unread_message_count_json(self):
+        self.send(self.renter, self.owner)
+        self.client.login(username="testowner", password="password123")
+
+        response = self.client.get(reverse("unread_message_count_json"))
+        self.assertEqual(response.json(), {"unread": 1})
+
+        # Unchanged counts are not sent again
+        response = self.client.get(reverse("unread_message_count_json"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
@@ -1,7 +1,8 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import TestCase, RequestFactory
 from unittest.mock import Mock
 from django.http import HttpRequest, HttpResponse
-from irentstuffapp.decorators import apply_standard_discount, apply_loyalty_discount
+from irentstuffapp.decorators import apply_standard_discount, apply_loyalty_discount, login_required_async
 
 class MockResponse(HttpResponse):
     def __init__(self, context_data=None):
@@ -11,6 +12,9 @@ class MockResponse(HttpResponse):
 def mock_view(request, *args, **kwargs):
     return MockResponse(context_data={'item': kwargs.get('item')})
 
+async def mock_async_view(request, *args, **kwargs):
+    return MockResponse(context_data={'item': kwargs.get('item')})
+
 class MockItem:
     def __init__(self, price_per_day, discount_percentage=0, discounted_price=None):
         self.price_per_day = price_per_day
@@ -74,3 +78,30 @@ class ApplyLoyaltyDiscountTestCase(TestCase):
         response = decorated_view(request, item=item)
 
         self.assertEqual(response.context_data['item'].discounted_price, 100 * 0.95)
+
+
+class AsyncViewDecoratorsTestCase(TestCase):
+    async def test_apply_standard_discount_to_async_view(self):
+        item = MockItem(price_per_day=100, discount_percentage=10)
+        decorated_view = apply_standard_discount(mock_async_view)
+
+        response = await decorated_view(HttpRequest(), item=item)
+
+        self.assertEqual(response.context_data['item'].discounted_price, 90)
+
+    async def test_login_required_async_redirects_anonymous_users(self):
+        request = RequestFactory().get('/inbox/')
+        request.user = AnonymousUser()
+
+        response = await login_required_async(mock_async_view)(request)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.endswith('?next=/inbox/'))
+
+    async def test_login_required_async_calls_view(self):
+        request = RequestFactory().get('/inbox/')
+        request.user = User(username="testuser")
+
+        response = await login_required_async(mock_async_view)(request)
+
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,70 @@
+import threading
+from django.db import transaction
+from django.test import TestCase, override_settings
+from irentstuffapp.dispatch import dispatch_observers, observer_metrics, reset_observer_metrics
+
+
+class RecordingObserver:
+    def __init__(self):
+        self.updates = []
+        self.threads = []
+        self.done = threading.Event()
+
+    def update(self, subject):
+        self.updates.append(subject)
+        self.threads.append(threading.current_thread())
+        self.done.set()
+
+
+class FailingObserver:
+    def update(self, subject):
+        raise ValueError("SMTP down")
+
+
+class DispatchObserversTestCase(TestCase):
+    def setUp(self):
+        reset_observer_metrics()
+
+    @override_settings(OBSERVER_THREADS=0)
+    def test_observers_run_after_commit(self):
+        observer = RecordingObserver()
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_observers([observer], "rental")
+            self.assertEqual(observer.updates, [])
+        self.assertEqual(observer.updates, ["rental"])
+
+    @override_settings(OBSERVER_THREADS=0)
+    def test_observers_not_run_on_rollback(self):
+        observer = RecordingObserver()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    dispatch_observers([observer], "rental")
+                    raise ValueError("Request failed")
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(observer.updates, [])
+
+    @override_settings(OBSERVER_THREADS=0)
+    def test_failing_observer_does_not_stop_others(self):
+        observer = RecordingObserver()
+        with self.assertLogs("irentstuffapp.dispatch", level="ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                dispatch_observers([FailingObserver(), observer], "rental")
+
+        self.assertEqual(observer.updates, ["rental"])
+        metrics = observer_metrics()
+        self.assertEqual(metrics["FailingObserver"]["failures"], 1)
+        self.assertEqual(metrics["RecordingObserver"]["calls"], 1)
+        self.assertEqual(metrics["RecordingObserver"]["failures"], 0)
+        self.assertGreaterEqual(metrics["RecordingObserver"]["max_seconds"], 0)
+
+    def test_observers_run_on_worker_thread(self):
+        observer = RecordingObserver()
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_observers([observer], "rental")
+
+        self.assertTrue(observer.done.wait(timeout=5))
+        self.assertEqual(observer.updates, ["rental"])
+        self.assertNotEqual(observer.threads[0], threading.current_thread())
@@ -0,0 +1,134 @@
+import io
+import shutil
+import tempfile
+from datetime import datetime
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from unittest.mock import patch
+from irentstuffapp.images import (ResponsiveImage, attach_responsive_images, generate_image_variants, image_manifests,
+                                  manifest_name)
+from irentstuffapp.models import Item
+from PIL import Image
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+def image_file(size, mode="RGB", image_format="JPEG"):
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+@override_settings(ITEM_IMAGE_WIDTHS=(200, 400, 800), OBSERVER_THREADS=0)
+class ImageVariantsTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+
+    def save_image(self, name, size, **kwargs):
+        return default_storage.save(name, ContentFile(image_file(size, **kwargs)))
+
+    def create_item(self, image):
+        return Item.objects.create(owner=self.owner, title="Test Item", description="Test description",
+                                   condition="excellent", price_per_day=10.00, deposit=50.00, image=image,
+                                   created_date=datetime(2024, 2, 7, tzinfo=sgt))
+
+    def test_generate_variants(self):
+        name = self.save_image("item_images/photo.jpg", (1000, 500))
+        manifest = generate_image_variants(name)
+
+        self.assertEqual((manifest["width"], manifest["height"]), (1000, 500))
+        self.assertEqual([(variant["width"], variant["height"]) for variant in manifest["variants"]],
+                         [(200, 100), (400, 200), (800, 400)])
+        variant = manifest["variants"][0]
+        self.assertEqual(variant["webp"], "item_images/photo_200w.webp")
+        self.assertEqual(variant["fallback"], "item_images/photo_200w.jpg")
+        with default_storage.open(variant["webp"]) as file, Image.open(file) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (200, 100)))
+        self.assertTrue(default_storage.exists(manifest_name(name)))
+
+        # Found from the manifest file when it is not cached
+        cache.clear()
+        self.assertEqual(image_manifests([name]), {name: manifest})
+        # Recreating the variants overwrites them rather than adding copies
+        generate_image_variants(name)
+        self.assertEqual(image_manifests([name])[name]["variants"][0]["webp"], "item_images/photo_200w.webp")
+
+    def test_small_and_transparent_images(self):
+        small = self.save_image("item_images/small.jpg", (300, 300))
+        self.assertEqual([variant["width"] for variant in generate_image_variants(small)["variants"]], [200])
+
+        transparent = self.save_image("item_images/logo.png", (500, 500), mode="RGBA", image_format="PNG")
+        self.assertEqual(generate_image_variants(transparent)["variants"][0]["fallback"], "item_images/logo_200w.png")
+
+    def test_unreadable_image(self):
+        with self.assertLogs("irentstuffapp.images", level="WARNING"):
+            self.assertIsNone(generate_image_variants("item_images/missing.jpg"))
+        self.assertEqual(image_manifests(["item_images/missing.jpg"]), {})
+
+    def test_responsive_image(self):
+        name = self.save_image("item_images/photo.jpg", (1000, 500))
+        image = ResponsiveImage(name, generate_image_variants(name))
+
+        self.assertEqual(image.src, "/media/item_images/photo_200w.jpg")
+        self.assertEqual(image.srcset.split(", ")[-1], "/media/item_images/photo.jpg 1000w")
+        self.assertIn("/media/item_images/photo_400w.webp 400w", image.webp_srcset)
+
+        # The original until its variants are created
+        image = ResponsiveImage(name)
+        self.assertEqual((image.src, image.srcset), ("/media/item_images/photo.jpg", ""))
+
+    def test_variants_created_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = self.create_item(SimpleUploadedFile("upload.jpg", image_file((1000, 500)), content_type="image/jpeg"))
+        self.assertIn(item.image.name, image_manifests([item.image.name]))
+
+        # Saving the item again does not look for them, whether or not it was reloaded
+        with patch("irentstuffapp.signals.image_manifests") as mock_image_manifests:
+            with self.captureOnCommitCallbacks() as callbacks:
+                item.save()
+                Item.objects.get(pk=item.pk).save()
+        self.assertEqual(callbacks, [])
+        mock_image_manifests.assert_not_called()
+
+        # Replacing the image creates the variants of the new one
+        item = Item.objects.get(pk=item.pk)
+        item.image = SimpleUploadedFile("replaced.jpg", image_file((1000, 500)), content_type="image/jpeg")
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertIn(item.image.name, image_manifests([item.image.name]))
+
+    def test_items_list_uses_srcset(self):
+        name = self.save_image("item_images/photo.jpg", (1000, 500))
+        generate_image_variants(name)
+        item = self.create_item(name)
+        self.assertTrue(attach_responsive_images([item])[0].responsive_image.srcset)
+
+        response = self.client.get(reverse("items_list"))
+        self.assertContains(response, 'srcset="/media/item_images/photo_200w.webp 200w')
+        self.assertContains(response, 'src="/media/item_images/photo_200w.jpg"')
+
+    def test_generate_image_variants_command(self):
+        generated = self.save_image("item_images/done.jpg", (1000, 500))
+        generate_image_variants(generated)
+        self.create_item(generated)
+        self.create_item(self.save_image("item_images/old.jpg", (1000, 500)))
+
+        out = StringIO()
+        call_command("generate_image_variants", stdout=out)
+        self.assertIn("Created variants of 1 of 1 item images", out.getvalue())
+        self.assertTrue(default_storage.exists("item_images/old_200w.webp"))
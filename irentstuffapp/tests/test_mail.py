@@ -0,0 +1,80 @@
+from datetime import timedelta
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from irentstuffapp.mail import send_queued_emails, retry_delay
+from irentstuffapp.models import QueuedEmail, send_email
+from io import StringIO
+from unittest.mock import patch
+
+LOCMEM_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+
+@override_settings(EMAIL_BACKEND='irentstuffapp.mail.QueuedEmailBackend', QUEUED_EMAIL_DELIVERY_BACKEND=LOCMEM_BACKEND)
+class QueuedEmailBackendTestCase(TestCase):
+    def test_send_email_is_queued(self):
+        send_email("Test Subject", "<p>Test message</p>", "user@test.com")
+
+        # Nothing is sent during the request
+        self.assertEqual(len(mail.outbox), 0)
+        queued_email = QueuedEmail.objects.get()
+        self.assertEqual(queued_email.status, "queued")
+        self.assertEqual(queued_email.to, ["user@test.com"])
+        self.assertEqual(queued_email.body, "Test message")
+        self.assertEqual(queued_email.alternatives, [["<p>Test message</p>", "text/html"]])
+
+    def test_send_queued_emails(self):
+        for i in range(3):
+            send_email(f"Test Subject {i}", "<p>Test message</p>", f"user{i}@test.com")
+
+        with patch("irentstuffapp.mail.get_connection", wraps=get_connection) as mock_get_connection:
+            self.assertEqual(send_queued_emails(batch_size=2), 2)
+            self.assertEqual(send_queued_emails(batch_size=2), 1)
+            self.assertEqual(send_queued_emails(batch_size=2), 0)
+
+        # One connection per batch
+        self.assertEqual(mock_get_connection.call_count, 2)
+        self.assertEqual([message.subject for message in mail.outbox], ["Test Subject 0", "Test Subject 1", "Test Subject 2"])
+        self.assertEqual(mail.outbox[0].alternatives, [("<p>Test message</p>", "text/html")])
+        self.assertEqual(QueuedEmail.objects.filter(status="sent").count(), 3)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        send_email("Test Subject", "<p>Test message</p>", "user@test.com")
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("Server down")):
+            send_queued_emails(max_attempts=2)
+        queued_email = QueuedEmail.objects.get()
+        self.assertEqual(queued_email.status, "queued")
+        self.assertEqual(queued_email.attempts, 1)
+        self.assertEqual(queued_email.last_error, "Server down")
+        self.assertGreater(queued_email.next_attempt_date, timezone.now())
+
+        # Not due again until the backoff has passed
+        self.assertEqual(send_queued_emails(max_attempts=2), 0)
+
+        QueuedEmail.objects.update(next_attempt_date=timezone.now())
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("Server down")):
+            send_queued_emails(max_attempts=2)
+        self.assertEqual(QueuedEmail.objects.get().status, "failed")
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_retry_delay(self):
+        self.assertEqual(retry_delay(1), timedelta(minutes=1))
+        self.assertEqual(retry_delay(3), timedelta(minutes=4))
+        self.assertEqual(retry_delay(10), timedelta(minutes=60))
+
+    def test_message_with_attachment_is_sent_immediately(self):
+        message = EmailMultiAlternatives("Test Subject", "Test message", "admin@irentstuff.app", ["user@test.com"])
+        message.attach("test.txt", "Attachment", "text/plain")
+        message.send()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_send_queued_emails_command(self):
+        send_email("Test Subject", "<p>Test message</p>", "user@test.com")
+        out = StringIO()
+        call_command("send_queued_emails", stdout=out)
+        self.assertIn("Processed 1 queued emails", out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
@@ -1,19 +1,25 @@
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from django.contrib.auth.models import User
 from django.core import mail
-from django.test import TestCase
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from irentstuffapp.models import (
-    Item, Category, Rental, Purchase, Review, Message,
+    Item, Category, Rental, Purchase, Review, Message, MessageReadReceipt, Conversation,
     ItemStatesCaretaker, RentalEmailSender, RentalMessageSender, RentalObserver,
     PurchaseEmailSender, PurchaseMessageSender,
-    Interest, UserInterests
+    Interest, UserInterests, EmailDispatcher, get_system_user, get_unread_message_count, invalidate_system_user
 )
 from irentstuffapp.models import Top3CategoryDisplay, ItemsDiscountDisplay, NewlyListedItemsDisplay, InterestDisplayTemplate
 from irentstuffapp.festive_discount_strategies import TestDiscountStrategy
+from io import StringIO
+from unittest.mock import patch
 import pytz
 
 sgt = pytz.timezone('Asia/Singapore')
 
+# Observers run on the test thread, once the test's captured on_commit callbacks are executed
+@override_settings(OBSERVER_THREADS=0)
 class RentalObserverPatternTestCase(TestCase):
     def setUp(self):
         self.owner = User.objects.create_user(
@@ -62,7 +68,8 @@ class RentalObserverPatternTestCase(TestCase):
         self.rental.add_observer(message_sender)
 
         # Change rental state to "pending"
-        self.rental.change_state("pending")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rental.change_state("pending")
 
         self.rental.refresh_from_db()
 
@@ -96,7 +103,8 @@ class RentalObserverPatternTestCase(TestCase):
         self.rental.add_observer(message_sender)
 
         # Change rental state to 'confirmed'
-        self.rental.change_state('confirmed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rental.change_state('confirmed')
 
         self.rental.refresh_from_db()
 
@@ -130,7 +138,8 @@ class RentalObserverPatternTestCase(TestCase):
         self.rental.add_observer(message_sender)
 
         # Change rental state to "completed"
-        self.rental.change_state("completed")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rental.change_state("completed")
 
         self.rental.refresh_from_db()
 
@@ -159,7 +168,8 @@ class RentalObserverPatternTestCase(TestCase):
         self.rental.add_observer(message_sender)
 
         # Change rental state to "cancelled"
-        self.rental.change_state("cancelled")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rental.change_state("cancelled")
 
         self.rental.refresh_from_db()
 
@@ -179,6 +189,68 @@ class RentalObserverPatternTestCase(TestCase):
         self.assertEqual(Message.objects.first().subject, 'Admin')
         self.assertIn('Rental has been cancelled.', Message.objects.first().content)
 
+    def test_rental_emails_sent_over_one_connection(self):
+        self.rental.add_observer(RentalEmailSender())
+
+        with patch("irentstuffapp.models.get_connection", wraps=get_connection) as mock_get_connection:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.rental.change_state("confirmed")
+
+        self.assertEqual(mock_get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_rental_emails_with_shared_dispatcher(self):
+        other_rental = Rental.objects.create(
+            owner=self.owner,
+            renter=self.renter,
+            item=self.item,
+            start_date=datetime.now(tz=sgt).date() + timedelta(3),
+            end_date=datetime.now(tz=sgt).date() + timedelta(4),
+        )
+        dispatcher = EmailDispatcher()
+        with self.captureOnCommitCallbacks(execute=True):
+            for rental in (self.rental, other_rental):
+                rental.add_observer(RentalEmailSender(dispatcher))
+                rental.change_state("cancelled")
+
+        # Nothing is sent until the dispatcher sends all the emails together
+        self.assertEqual(len(mail.outbox), 0)
+        with patch("irentstuffapp.models.get_connection", wraps=get_connection) as mock_get_connection:
+            dispatcher.send()
+        self.assertEqual(mock_get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_rental_transition(self):
+        self.rental.add_observer(RentalEmailSender())
+        stale_rental = Rental.objects.get(pk=self.rental.pk)
+        stale_rental.add_observer(RentalEmailSender())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.rental.transition("cancelled"))
+            # Emails are only sent once the transaction commits
+            self.assertEqual(len(mail.outbox), 0)
+        # A second request that read the rental as pending loses the race
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(stale_rental.transition("confirmed"))
+
+        self.rental.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual(self.rental.status, "cancelled")
+        self.assertIsNotNone(self.rental.cancelled_date)
+        self.assertEqual(self.item.availability, "available")
+        self.assertIsNone(self.item.active_rental)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_rental_transition_keeps_item_rented_for_other_bookings(self):
+        # Another booking that covers today, returned the day self.rental starts
+        next_rental = Rental.objects.create(owner=self.owner, renter=self.renter, item=self.item, status="confirmed",
+                                            start_date=self.rental.start_date - timedelta(1), end_date=self.rental.start_date)
+
+        self.assertTrue(self.rental.transition("cancelled"))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.availability, "active_rental")
+        self.assertEqual(self.item.active_rental, next_rental)
+
 
 # tests ItemStatesCaretaker and ItemMemento models (ItemMemento is instantiated in Item class)
 class MementoPatternTestCase(TestCase):
@@ -242,6 +314,89 @@ class MementoPatternTestCase(TestCase):
 
         self.assertEqual(self.item.title, initial_state['title'])
 
+    def save_version(self, **changes):
+        for name, value in changes.items():
+            setattr(self.item, name, value)
+        self.item.save()
+        ItemStatesCaretaker(item=self.item).save_state()
+        return ItemStatesCaretaker.history(self.item).first()
+
+    def test_versions_store_changed_fields(self):
+        checkpoint = ItemStatesCaretaker.history(self.item).get()
+        self.assertTrue(checkpoint.is_checkpoint)
+        self.assertEqual(checkpoint.changes['title'], "Test Item")
+
+        version = self.save_version(title="Updated Title", price_per_day=12)
+        self.assertFalse(version.is_checkpoint)
+        self.assertEqual(version.changes, {"title": "Updated Title", "price_per_day": "12.00"})
+
+    @override_settings(ITEM_HISTORY_CHECKPOINT_INTERVAL=3)
+    def test_checkpoint_interval(self):
+        for i in range(6):
+            self.save_version(title=f"Title {i}")
+        checkpoints = list(ItemStatesCaretaker.objects.filter(item=self.item).order_by('id')
+                           .values_list('is_checkpoint', flat=True))
+        self.assertEqual(checkpoints, [True, False, False, True, False, False, True])
+
+    @override_settings(ITEM_HISTORY_CHECKPOINT_INTERVAL=3)
+    def test_restore_replays_changes(self):
+        self.save_version(title="Title 1")
+        version = self.save_version(description="Description 2", condition="good")
+        self.save_version(title="Title 3", description="Description 3")
+
+        # One query for the versions back to the checkpoint, one to save the item
+        version.item = self.item
+        with self.assertNumQueries(2):
+            version.restore_state()
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.title, self.item.description, self.item.condition),
+                         ("Title 1", "Description 2", "good"))
+        self.assertEqual(self.item.category, self.category)
+
+    @override_settings(ITEM_HISTORY_CHECKPOINT_INTERVAL=3)
+    def test_prune(self):
+        for i in range(5):
+            self.save_version(title=f"Title {i}")
+        oldest_kept = ItemStatesCaretaker.history(self.item)[1]
+        self.assertFalse(oldest_kept.is_checkpoint)
+
+        self.assertEqual(ItemStatesCaretaker.prune(self.item, keep=2), 4)
+        oldest_kept.refresh_from_db()
+        self.assertTrue(oldest_kept.is_checkpoint)
+        self.assertEqual(oldest_kept.get_memento().state['title'], "Title 3")
+        self.assertEqual(ItemStatesCaretaker.history(self.item).first().get_memento().state['title'], "Title 4")
+
+    def test_prune_item_history_command(self):
+        ItemStatesCaretaker.objects.update(datetime_saved=datetime(2020, 1, 1, tzinfo=sgt))
+        self.save_version(title="Updated Title")
+
+        out = StringIO()
+        call_command("prune_item_history", "--days", "30", stdout=out)
+        self.assertIn("Deleted 1 item versions", out.getvalue())
+        self.assertEqual(ItemStatesCaretaker.history(self.item).get().get_memento().state['title'], "Updated Title")
+
+    @override_settings(ITEM_HISTORY_MAX_DEPTH=3, ITEM_HISTORY_CHECKPOINT_INTERVAL=10)
+    def test_save_state_keeps_max_depth(self):
+        for i in range(5):
+            self.save_version(title=f"Title {i}")
+
+        versions = list(ItemStatesCaretaker.history(self.item))
+        self.assertEqual(len(versions), 3)
+        self.assertTrue(versions[-1].is_checkpoint)
+        self.assertEqual([version.get_memento().state['title'] for version in versions],
+                         ["Title 4", "Title 3", "Title 2"])
+
+    @override_settings(ITEM_HISTORY_MAX_DEPTH=None)
+    def test_compact_item_history_command(self):
+        for i in range(5):
+            self.save_version(title=f"Title {i}")
+
+        out = StringIO()
+        call_command("prune_item_history", "--keep", "2", stdout=out)
+        self.assertIn("Deleted 4 item versions", out.getvalue())
+        self.assertEqual([version.get_memento().state['title'] for version in ItemStatesCaretaker.history(self.item)],
+                         ["Title 4", "Title 3"])
+
 
 class CategoryModelTestCase(TestCase):
     def setUp(self):
@@ -316,6 +471,70 @@ class ItemModelTestCase(TestCase):
         # Reset activation date
         TestDiscountStrategy.activation_date = datetime(2024, 5, 4).date()
 
+    def test_refresh_festive_discounts(self):
+        """Test refresh_festive_discounts bulk updates opted-in items and clears the rest"""
+        self.item.festive_discounts = True
+        self.item.save()
+        other_item = Item.objects.create(
+            owner=self.owner,
+            title="Other Item",
+            category=self.category,
+            condition="good",
+            price_per_day=5.00,
+            deposit=20.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+            festive_discounts=False,
+            festive_discount_description="Stale",
+        )
+
+        # Set activation date for a discount strategy
+        TestDiscountStrategy.activation_date = datetime.now(tz=timezone.utc).date()
+
+        with self.assertNumQueries(3):
+            Item.refresh_festive_discounts()
+
+        self.item.refresh_from_db()
+        other_item.refresh_from_db()
+        self.assertEqual(self.item.festive_discount_description, "Test")
+        self.assertEqual(self.item.festive_discount_percentage, 25.00)
+        self.assertAlmostEqual(float(self.item.festive_discount_price), 37.50)
+        self.assertIsNone(other_item.festive_discount_description)
+
+        # Reset activation date, after which the discount is cleared again
+        TestDiscountStrategy.activation_date = datetime(2024, 5, 4).date()
+        Item.refresh_festive_discounts()
+        self.item.refresh_from_db()
+        self.assertIsNone(self.item.festive_discount_description)
+        self.assertIsNone(self.item.festive_discount_price)
+
+    def test_with_prices(self):
+        """Test with_prices annotates discounted and festive prices in the query"""
+        self.item.discount_percentage = 15
+        self.item.festive_discounts = True
+        self.item.save()
+
+        # Set activation date for a discount strategy
+        TestDiscountStrategy.activation_date = datetime.now(tz=timezone.utc).date()
+
+        item = Item.objects.with_prices().get(pk=self.item.pk)
+        self.assertAlmostEqual(float(item.discounted_price), 8.50)
+        self.assertEqual(item.festive_description, "Test")
+        self.assertAlmostEqual(float(item.festive_percentage), 25.00)
+        self.assertAlmostEqual(float(item.festive_price), 37.50)
+
+        # Reset activation date
+        TestDiscountStrategy.activation_date = datetime(2024, 5, 4).date()
+
+        item = Item.objects.with_prices().get(pk=self.item.pk)
+        self.assertIsNone(item.festive_description)
+        self.assertIsNone(item.festive_price)
+
+        # Items without a discount keep their rental price
+        Item.objects.filter(pk=self.item.pk).update(discount_percentage=0)
+        item = Item.objects.with_prices().get(pk=self.item.pk)
+        self.assertAlmostEqual(float(item.discounted_price), 10.00)
+
 
 class RentalModelTestCase(TestCase):
     def setUp(self):
@@ -387,7 +606,53 @@ class RentalModelTestCase(TestCase):
         self.assertEqual(rental.status, "confirmed")
         self.assertEqual(str(rental), f'{self.item} ({self.owner}, {self.renter}): {self.rental.start_date} - {self.rental.end_date}')
 
+    def test_item_active_rental(self):
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, self.rental)
+
+        # A later open rental does not replace the first one
+        other_rental = Rental.objects.create(owner=self.owner, renter=self.enquiring_user, item=self.item,
+                                             start_date=date(2024, 3, 1), end_date=date(2024, 3, 2))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, self.rental)
 
+        # Closing the active rental moves on to the next open one
+        self.rental.change_state("completed")
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, other_rental)
+
+        other_rental.change_state("cancelled")
+        self.item.refresh_from_db()
+        self.assertIsNone(self.item.active_rental)
+
+    def test_stale_item_festive_discount_keeps_active_rental(self):
+        Item.objects.filter(pk=self.item.pk).update(festive_discount_description="Labour Day")
+        stale_item = Item.objects.get(pk=self.item.pk)
+        self.rental.change_state("completed")
+        other_rental = Rental.objects.create(owner=self.owner, renter=self.enquiring_user, item=self.item,
+                                             start_date=date(2024, 3, 1), end_date=date(2024, 3, 2))
+        stale_item.clear_festive_discount()
+
+        self.item.refresh_from_db()
+        self.assertIsNone(self.item.festive_discount_description)
+        self.assertEqual(self.item.active_rental, other_rental)
+
+    def test_check_active_transactions(self):
+        self.assertEqual(Item.check_active_transactions(), [])
+
+        Item.objects.filter(pk=self.item.pk).update(active_rental=None)
+        out = StringIO()
+        call_command("check_active_transactions", stdout=out)
+        self.assertIn(f"Item {self.item.id}: active_rental is None, expected {self.rental.id}", out.getvalue())
+
+        call_command("check_active_transactions", "--fix", stdout=StringIO())
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, self.rental)
+        self.assertEqual(Item.check_active_transactions(), [])
+
+
+# Observers run on the test thread, once the test's captured on_commit callbacks are executed
+@override_settings(OBSERVER_THREADS=0)
 class PurchaseObserverPatternTestCase(TestCase):
     def setUp(self):
         self.owner = User.objects.create_user(
@@ -435,7 +700,8 @@ class PurchaseObserverPatternTestCase(TestCase):
         self.purchase.add_observer(message_sender)
 
         # Change purchase state to "reserved"
-        self.purchase.change_state("reserved")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.purchase.change_state("reserved")
 
         self.purchase.refresh_from_db()
 
@@ -469,7 +735,8 @@ class PurchaseObserverPatternTestCase(TestCase):
         self.purchase.add_observer(message_sender)
 
         # Change purchase state to 'confirmed'
-        self.purchase.change_state('confirmed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.purchase.change_state('confirmed')
 
         self.purchase.refresh_from_db()
 
@@ -503,7 +770,8 @@ class PurchaseObserverPatternTestCase(TestCase):
         self.purchase.add_observer(message_sender)
 
         # Change purchase state to "completed"
-        self.purchase.change_state("completed")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.purchase.change_state("completed")
 
         self.purchase.refresh_from_db()
 
@@ -532,7 +800,8 @@ class PurchaseObserverPatternTestCase(TestCase):
         self.purchase.add_observer(message_sender)
 
         # Change purchase state to "cancelled"
-        self.purchase.change_state("cancelled")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.purchase.change_state("cancelled")
 
         self.purchase.refresh_from_db()
 
@@ -552,6 +821,25 @@ class PurchaseObserverPatternTestCase(TestCase):
         self.assertEqual(Message.objects.first().subject, 'Admin')
         self.assertIn('Purchase has been cancelled.', Message.objects.first().content)
 
+    def test_purchase_transition(self):
+        self.purchase.add_observer(PurchaseMessageSender())
+        stale_purchase = Purchase.objects.get(pk=self.purchase.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.purchase.transition("confirmed"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(stale_purchase.transition("cancelled"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.purchase.transition("completed"))
+
+        self.purchase.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual(self.purchase.status, "completed")
+        self.assertIsNotNone(self.purchase.deal_confirmed_date)
+        self.assertEqual(self.item.availability, "sold")
+        self.assertIsNone(self.item.active_purchase)
+        self.assertEqual(Message.objects.count(), 2)
+
 
 class ReviewModelTestCase(TestCase):
     def setUp(self):
@@ -678,6 +966,65 @@ class MessageModelTestCase(TestCase):
         self.assertFalse(message.is_read)
         self.assertEqual(str(message), "Test Message Subject - renter to owner about Test Item (enquirer)",)
 
+    def test_conversation_summary(self):
+        reply = Message.objects.create(
+            sender=self.owner,
+            recipient=self.enquiring_user,
+            item=self.item,
+            enquiring_user=self.enquiring_user,
+            subject="message",
+            content="Reply",
+        )
+
+        conversation = Conversation.objects.get(item=self.item, enquiring_user=self.enquiring_user)
+        self.assertEqual(conversation.owner, self.owner)
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual((conversation.owner_unread, conversation.enquirer_unread), (1, 1))
+        self.assertEqual(conversation.last_message_id, reply.id)
+        self.assertEqual(conversation.last_message_at, reply.timestamp)
+
+        # Reading the conversation clears the reader's side only
+        MessageReadReceipt.mark_read(self.owner, self.item, self.enquiring_user)
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.owner_unread, conversation.enquirer_unread), (0, 1))
+
+    def test_admin_messages_read_by_their_recipient(self):
+        admin = User.objects.create_user(username="admin", password="password")
+        notice = Message.objects.create(sender=admin, recipient=self.enquiring_user, item=self.item,
+                                        enquiring_user=self.enquiring_user, subject="message", content="Notice")
+        self.assertEqual(get_unread_message_count(self.enquiring_user), 1)
+
+        # The owner opening the conversation leaves the enquiring user's messages unread
+        MessageReadReceipt.mark_read(self.owner, self.item, self.enquiring_user)
+        notice.refresh_from_db()
+        self.assertFalse(notice.is_read)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(MessageReadReceipt.mark_read(self.enquiring_user, self.item, self.enquiring_user), 1)
+        conversation = Conversation.objects.get(item=self.item, enquiring_user=self.enquiring_user)
+        self.assertEqual((conversation.owner_unread, conversation.enquirer_unread), (0, 0))
+        self.assertEqual(get_unread_message_count(self.enquiring_user), 0)
+
+    def test_conversations_for_user(self):
+        other_item = Item.objects.create(
+            owner=self.renter,
+            title="Other Item",
+            description="Test description",
+            category=self.category,
+            condition="excellent",
+            price_per_day=10.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+        Message.objects.create(sender=self.owner, recipient=self.renter, item=other_item, enquiring_user=self.owner,
+                               subject="message", content="Enquiry")
+
+        conversations = list(Conversation.for_user(self.owner))
+        self.assertEqual([conversation.item for conversation in conversations], [other_item, self.item])
+        # Unread counts are the user's own side of each conversation
+        self.assertEqual([conversation.unread_count for conversation in conversations], [0, 1])
+        self.assertEqual([conversation.unread_count for conversation in Conversation.for_user(self.renter)], [1])
+
 
 class InterestModelTestCase(TestCase):
     def setUp(self):
@@ -760,3 +1107,32 @@ class DisplayTemplateTests(TestCase):
         display = InterestDisplayTemplate()
         with self.assertRaises(NotImplementedError):
             display.get_items(self.interest)
+
+
+class SystemUserTestCase(TestCase):
+    def setUp(self):
+        invalidate_system_user()
+        self.admin = User.objects.create_user(username="admin", password="testpassword1", email="admin@test.com")
+        self.other_admin = User.objects.create_user(username="otheradmin", password="testpassword2", email="other@test.com")
+
+    def test_system_user_is_cached(self):
+        self.assertEqual(get_system_user(), self.admin)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_system_user(), self.admin)
+
+    def test_system_user_setting(self):
+        with override_settings(SYSTEM_USER_ID=self.other_admin.id):
+            self.assertEqual(get_system_user(), self.other_admin)
+        self.assertEqual(get_system_user(), self.admin)
+
+    def test_system_user_invalidated_on_change(self):
+        get_system_user()
+
+        # Saving another user keeps the cached system user
+        self.other_admin.save()
+        with self.assertNumQueries(0):
+            get_system_user()
+
+        self.admin.username = "renamed"
+        self.admin.save()
+        self.assertEqual(get_system_user().username, "renamed")
@@ -0,0 +1,76 @@
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase, RequestFactory, override_settings
+from irentstuffapp.models import Item, Category
+from irentstuffapp.pagination import get_page_size, encode_cursor, decode_cursor, paginate_keyset
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+class CursorTestCase(TestCase):
+    def test_cursor_round_trip(self):
+        created_date = datetime(2024, 2, 7, 10, 30, 15, 123456, tzinfo=sgt)
+        cursor = encode_cursor([created_date, 42])
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), [str(created_date), 42])
+
+    def test_invalid_cursor(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor('not a cursor!'))
+        self.assertIsNone(decode_cursor(encode_cursor({'id': 1})))
+
+    @override_settings(ITEMS_PAGE_SIZE=10, ITEMS_MAX_PAGE_SIZE=50)
+    def test_get_page_size(self):
+        factory = RequestFactory()
+        self.assertEqual(get_page_size(factory.get('/stuff/')), 10)
+        self.assertEqual(get_page_size(factory.get('/stuff/', {'page_size': '5'})), 5)
+        self.assertEqual(get_page_size(factory.get('/stuff/', {'page_size': '500'})), 50)
+        self.assertEqual(get_page_size(factory.get('/stuff/', {'page_size': 'abc'})), 10)
+
+
+class PaginateKeysetTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="testpassword1")
+        self.category = Category.objects.create(name="testcategory")
+        # Items 0-1 and 2-3 share a created date so that pages have to break ties on id
+        for i in range(5):
+            Item.objects.create(
+                owner=self.owner,
+                title=f"Test Item {i}",
+                category=self.category,
+                condition="excellent",
+                price_per_day=10.00,
+                deposit=50.00,
+                image="item_images/test_image.jpg",
+                created_date=datetime(2024, 2, 7 + i // 2, tzinfo=sgt),
+                discount_percentage=i * 10 // 20 * 10,
+            )
+
+    def collect_pages(self, ordering, page_size):
+        pages = []
+        cursor = None
+        while True:
+            page = paginate_keyset(Item.objects.all(), ordering, cursor, page_size)
+            pages.append([item.title for item in page.items])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_paginate_descending(self):
+        ordering = ('-created_date', '-id')
+        pages = self.collect_pages(ordering, 2)
+        expected = [item.title for item in Item.objects.order_by(*ordering)]
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:5]])
+
+    def test_paginate_mixed_fields(self):
+        ordering = ('-discount_percentage', 'title', 'id')
+        pages = self.collect_pages(ordering, 3)
+        expected = [item.title for item in Item.objects.order_by(*ordering)]
+        self.assertEqual(pages, [expected[0:3], expected[3:5]])
+
+    def test_tampered_cursor_returns_first_page(self):
+        cursor = encode_cursor(['not a date', 1])
+        page = paginate_keyset(Item.objects.all(), ('-created_date', '-id'), cursor, 2)
+        self.assertEqual(len(page.items), 2)
+        self.assertTrue(page.has_next)
@@ -0,0 +1,77 @@
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from irentstuffapp.models import Item, Category
+from irentstuffapp.search import (
+    search_terms, get_search_backend, SimpleSearchBackend, SQLiteSearchBackend
+)
+import pytz
+
+sgt = pytz.timezone('Asia/Singapore')
+
+
+class SearchBackendTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="testpassword1")
+        self.tools = Category.objects.create(name="tools")
+        self.camping = Category.objects.create(name="camping")
+        self.drill = self.create_item("Cordless Drill", "Powerful drill with two batteries", self.tools)
+        self.saw = self.create_item("Circular Saw", "Comes with a spare blade, great next to a drill", self.tools)
+        self.tent = self.create_item("Camping Tent", "Four person tent", self.camping)
+
+    def create_item(self, title, description, category):
+        return Item.objects.create(
+            owner=self.owner,
+            title=title,
+            description=description,
+            category=category,
+            condition="good",
+            price_per_day=10.00,
+            deposit=50.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+
+    def search(self, query, queryset=None, backend=None):
+        backend = backend or get_search_backend()
+        queryset = queryset if queryset is not None else Item.objects.all()
+        return list(backend.search(queryset, query).order_by('-search_rank', '-id'))
+
+    def test_search_terms(self):
+        self.assertEqual(search_terms('Cordless "drill"* OR tent!'), ['cordless', 'drill', 'or', 'tent'])
+
+    def test_default_backend_for_sqlite(self):
+        self.assertIsInstance(get_search_backend(), SQLiteSearchBackend)
+
+    @override_settings(ITEMS_SEARCH_BACKEND='irentstuffapp.search.SimpleSearchBackend')
+    def test_backend_setting(self):
+        self.assertIsInstance(get_search_backend(), SimpleSearchBackend)
+
+    def test_search_title_and_description_ranked(self):
+        # Title matches rank above description matches
+        self.assertEqual(self.search("drill"), [self.drill, self.saw])
+
+    def test_search_prefix(self):
+        self.assertEqual(self.search("cordl dri"), [self.drill])
+
+    def test_search_with_category_filter(self):
+        self.assertEqual(self.search("drill", Item.objects.filter(category=self.tools)), [self.drill, self.saw])
+        self.assertEqual(self.search("drill", Item.objects.filter(category=self.camping)), [])
+
+    def test_search_index_follows_item_changes(self):
+        self.tent.title = "Camping Hammock"
+        self.tent.description = "Sleeps one"
+        self.tent.save()
+        self.assertEqual(self.search("tent"), [])
+        self.assertEqual(self.search("hammock"), [self.tent])
+
+        self.drill.delete()
+        self.assertEqual(self.search("cordless"), [])
+
+    def test_search_without_terms(self):
+        self.assertEqual(self.search("!!!"), [])
+
+    def test_simple_backend(self):
+        backend = SimpleSearchBackend()
+        self.assertEqual(set(self.search("drill", backend=backend)), {self.drill, self.saw})
+        self.assertEqual(self.search("person tent", backend=backend), [self.tent])
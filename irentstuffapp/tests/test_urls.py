@@ -2,6 +2,11 @@ from django.test import SimpleTestCase
 from django.urls import reverse, resolve
 from irentstuffapp.views import (
     items_list,
+    items_list_json,
+    item_availability_json,
+    unread_message_count_json,
+    item_messages_stream,
+    item_messages_json,
     item_detail_with_state_pattern,
     add_item,
     edit_item,
@@ -34,6 +39,26 @@ class TestUrls(SimpleTestCase):
         url = reverse("items_list")
         self.assertEquals(resolve(url).func, items_list)
 
+    def test_items_list_json_url_resolves(self):
+        url = reverse("items_list_json")
+        self.assertEquals(resolve(url).func, items_list_json)
+
+    def test_item_availability_json_url_resolves(self):
+        url = reverse("item_availability_json", kwargs={"item_id": "4050"})
+        self.assertEquals(resolve(url).func, item_availability_json)
+
+    def test_unread_message_count_json_url_resolves(self):
+        url = reverse("unread_message_count_json")
+        self.assertEquals(resolve(url).func, unread_message_count_json)
+
+    def test_item_messages_stream_url_resolves(self):
+        url = reverse("item_messages_stream", kwargs={"item_id": "4050", "userid": "2"})
+        self.assertEquals(resolve(url).func, item_messages_stream)
+
+    def test_item_messages_json_url_resolves(self):
+        url = reverse("item_messages_json", kwargs={"item_id": "4050", "userid": "2"})
+        self.assertEquals(resolve(url).func, item_messages_json)
+
     def test_item_detail_url_resolves(self):
         url = reverse("item_detail", kwargs={"item_id": "4050"})
         self.assertEquals(resolve(url).func, item_detail_with_state_pattern)
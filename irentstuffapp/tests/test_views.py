@@ -1,13 +1,16 @@
 from datetime import datetime, timedelta, date
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from django.core import mail
 from django.core.files.base import ContentFile
-from django.http import JsonResponse, HttpRequest
-from django.test import TestCase, Client
+from django.db import connection
+from django.http import Http404, JsonResponse, HttpRequest
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from irentstuffapp.models import (Item, Category, Message, Rental, Purchase, Interest, UserInterests,
+from irentstuffapp.models import (Item, Category, Message, MessageReadReceipt, Rental, Purchase, Review, Interest, UserInterests,
                                   InterestDisplayTemplate, Top3CategoryDisplay, ItemsDiscountDisplay, NewlyListedItemsDisplay)
 from irentstuffapp.forms import ItemForm, ItemEditForm, RentalForm, PurchaseForm
+from irentstuffapp.states import ItemStateSnapshot
 from irentstuffapp.views import index
 from PIL import Image
 from unittest.mock import patch
@@ -87,12 +90,12 @@ class InboxViewTestCase(TestCase):
         # Check that the correct template is used
         self.assertTemplateUsed(response, "irentstuffapp/inbox.html")
 
-        # Check that the messages are grouped correctly
+        # Check that the messages are grouped correctly, most recent conversation first
         self.assertEqual(len(response.context["grouped_messages"]), 2)
         self.assertEqual(response.context["grouped_messages"][0]["message_count"], 1)
         self.assertEqual(response.context["grouped_messages"][1]["message_count"], 1)
-        self.assertEqual(response.context["grouped_messages"][0]["item__title"], "Test Item 1")
-        self.assertEqual(response.context["grouped_messages"][1]["item__title"], "Test Item 2")
+        self.assertEqual(response.context["grouped_messages"][0]["item__title"], "Test Item 2")
+        self.assertEqual(response.context["grouped_messages"][1]["item__title"], "Test Item 1")
 
 
 class CheckUserExistsViewTestCase(TestCase):
@@ -317,6 +320,166 @@ class ItemsListViewTestCase(TestCase):
         self.assertContains(response, "Test Item 1")
         self.assertContains(response, "Test Item 2")
 
+    def test_items_list_pagination(self):
+        response = self.client.get(reverse("items_list") + "?page_size=1")
+        self.assertEqual(len(response.context["items"]), 1)
+        self.assertContains(response, "Next page")
+        self.assertTrue(response.context["is_first_page"])
+
+        # Follow the cursor to the second and last page
+        response = self.client.get(reverse("items_list") + "?" + response.context["next_page_query"])
+        self.assertEqual(len(response.context["items"]), 1)
+        self.assertIsNone(response.context["next_page_query"])
+        self.assertContains(response, "First page")
+
+    def test_items_list_json(self):
+        response = self.client.get(reverse("items_list_json"), {"page_size": 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["items"]), 1)
+        self.assertIsNotNone(data["next_cursor"])
+
+        response = self.client.get(reverse("items_list_json"), {"page_size": 1, "cursor": data["next_cursor"]})
+        second_page = response.json()
+        self.assertEqual(len(second_page["items"]), 1)
+        self.assertNotEqual(second_page["items"][0]["id"], data["items"][0]["id"])
+        self.assertIsNone(second_page["next_cursor"])
+
+    def test_items_list_is_read_only(self):
+        # Festive discounts are refreshed by a scheduled command, so listing items must not write
+        Item.objects.update(festive_discounts=True)
+        with patch.object(Item, "save") as mock_save:
+            response = self.client.get(reverse("items_list"))
+        self.assertEqual(response.status_code, 200)
+        mock_save.assert_not_called()
+
+
+class ItemsListQueryBudgetTestCase(TestCase):
+    """
+    Listing pages must run the same number of queries whatever the page size, i.e. no queries per item card.
+    """
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="thisuser", password="password123")
+        self.category = Category.objects.create(name="testcategory")
+        self.interest = Interest.objects.create(created_date=datetime.now(tz=sgt), discount=True, item_cd_crit=7)
+        self.interest.categories.add(self.category)
+        UserInterests.objects.create(user=self.user, interest=self.interest)
+
+        # Items from several owners, new and discounted so that they show up on every listing page
+        for i in range(6):
+            owner = User.objects.create_user(username=f"owner{i}", password="password456")
+            Item.objects.create(
+                owner=owner,
+                title=f"Test Item {i}",
+                description="Test description",
+                category=self.category,
+                condition="excellent",
+                price_per_day=10.00,
+                deposit=50.00,
+                image="item_images/test_image.jpg",
+                created_date=datetime.now(tz=sgt) - timedelta(hours=i),
+                discount_percentage=10,
+            )
+
+    def count_queries(self, url, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"page_size": page_size})
+        self.assertEqual(response.status_code, 200)
+        items = response.context["items"] if response.context else response.json()["items"]
+        self.assertEqual(len(items), page_size)
+        return len(queries)
+
+    def assertQueryCountIndependentOfPageSize(self, url):
+        # Warm up the cached category list so that both requests are measured alike
+        self.client.get(url)
+        self.assertEqual(self.count_queries(url, 1), self.count_queries(url, 6))
+
+    def test_items_list_query_budget(self):
+        self.assertQueryCountIndependentOfPageSize(reverse("items_list"))
+        self.assertQueryCountIndependentOfPageSize(reverse("items_list") + "?search=item&category=testcategory")
+        self.assertQueryCountIndependentOfPageSize(reverse("items_list_json"))
+
+    def test_interest_views_query_budget(self):
+        self.client.login(username="thisuser", password="password123")
+        self.assertQueryCountIndependentOfPageSize(reverse("items_list"))
+        self.assertQueryCountIndependentOfPageSize(reverse("deals"))
+        self.assertQueryCountIndependentOfPageSize(reverse("new_items"))
+        self.assertQueryCountIndependentOfPageSize(reverse("fav_categories"))
+
+
+class ItemDetailQueryBudgetTestCase(TestCase):
+    """
+    The item detail page loads its state in a fixed number of queries, however many reviews and rentals the item has.
+    """
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username="testowner", password="password123")
+        self.renter = User.objects.create_user(username="testrenter", password="password456")
+        self.category = Category.objects.create(name="testcategory")
+        self.item = Item.objects.create(
+            owner=self.owner,
+            title="Test Item",
+            description="Test description",
+            category=self.category,
+            condition="excellent",
+            price_per_day=10.00,
+            deposit=50.00,
+            image="item_images/test_image.jpg",
+            created_date=datetime(2024, 2, 7, tzinfo=sgt),
+        )
+        Rental.objects.create(owner=self.owner, renter=self.renter, item=self.item, status="pending",
+                              start_date=datetime.now(tz=sgt).date() + timedelta(1),
+                              end_date=datetime.now(tz=sgt).date() + timedelta(2))
+        Message.objects.create(sender=self.renter, recipient=self.owner, item=self.item, enquiring_user=self.renter,
+                               subject="Test Subject", content="Test Content")
+
+    def add_reviewed_rentals(self, count):
+        for i in range(count):
+            author = User.objects.create_user(username=f"reviewer{Review.objects.count()}", password="password789")
+            rental = Rental.objects.create(owner=self.owner, renter=author, item=self.item, status="completed",
+                                           start_date=date(2024, 2, 7), end_date=date(2024, 2, 8))
+            Review.objects.create(author=author, rental=rental, rating=5, comment="Test comment",
+                                  created_date=datetime(2024, 2, 9, tzinfo=sgt))
+
+    def count_queries(self):
+        url = reverse("item_detail", kwargs={"item_id": self.item.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_snapshot_query_budget(self):
+        self.add_reviewed_rentals(3)
+        # Item with its flags and active rental and purchase, then the reviews
+        with self.assertNumQueries(2):
+            snapshot = ItemStateSnapshot.load(self.item.id, self.renter)
+            [review.author.username for review in snapshot.reviews]
+            self.assertEqual(snapshot.item.active_rental.renter, self.renter)
+        self.assertTrue(snapshot.item.has_messages)
+
+        with self.assertNumQueries(2):
+            ItemStateSnapshot.load(self.item.id, AnonymousUser())
+
+    async def test_snapshot_async_load(self):
+        snapshot = await ItemStateSnapshot.aload(self.item.id, self.renter)
+        self.assertEqual(snapshot.item.active_rental.renter, self.renter)
+        self.assertTrue(snapshot.item.has_messages)
+        self.assertEqual(snapshot.reviews, [])
+
+        with self.assertRaises(Http404):
+            await ItemStateSnapshot.aload(self.item.id + 1, AnonymousUser())
+
+    def test_item_detail_query_budget(self):
+        for username, password in (("testowner", "password123"), ("testrenter", "password456")):
+            self.client.login(username=username, password=password)
+            self.add_reviewed_rentals(1)
+            # Warm up the cached category list so that both requests are measured alike
+            self.count_queries()
+            few_reviews = self.count_queries()
+            self.add_reviewed_rentals(4)
+            self.assertEqual(self.count_queries(), few_reviews)
+
 
 class AddItemViewTestCase(TestCase):
     def setUp(self):
@@ -778,16 +941,45 @@ class AddRentalViewTestCase(TestCase):
         # Login as the owner
         self.client.login(username="testowner", password="password123")
 
-        # Make a POST request to add_rental view
-        response = self.client.post(reverse("add_rental", kwargs={"item_id": self.item.pk}))
+        # Make a POST request to add_rental view for dates that overlap the active rental
+        form_data = {
+            "start_date": datetime.today().date() + timedelta(days=4),
+            "end_date": datetime.today().date() + timedelta(days=7),
+            "renterid": "testrenter",
+        }
+        response = self.client.post(reverse("add_rental", kwargs={"item_id": self.item.pk}), form_data)
 
-        # Check that the user is redirected to the item detail page
-        self.assertEqual(response.status_code, 302)
-        self.assertRedirects(response, reverse("item_detail", kwargs={"item_id": self.item.pk}))
+        # Check that the form is shown again with the error
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "The item is already booked for some of these dates.")
 
         # Check that no rental was created and only 1 exists
         self.assertEqual(Rental.objects.filter(item=self.item).count(), 1)
 
+    def test_add_rental_back_to_back(self):
+        active_rental = Rental.objects.create(
+            owner=self.owner,
+            renter=self.renter,
+            item=self.item,
+            start_date=datetime.today().date() - timedelta(days=5),
+            end_date=datetime.today().date() + timedelta(days=5),
+            status="confirmed"
+        )
+        self.client.login(username="testowner", password="password123")
+
+        # The next rental starts on the day the active one is returned
+        form_data = {
+            "start_date": datetime.today().date() + timedelta(days=5),
+            "end_date": datetime.today().date() + timedelta(days=7),
+            "renterid": "testrenter",
+        }
+        response = self.client.post(reverse("add_rental", kwargs={"item_id": self.item.pk}), form_data)
+
+        self.assertRedirects(response, reverse("item_detail", kwargs={"item_id": self.item.pk}))
+        self.assertEqual(Rental.objects.filter(item=self.item, status="pending").count(), 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, active_rental)
+
     def test_add_rental_pending_purchases_exist(self):
         # Create a pending purchase for the item
         Purchase.objects.create(
@@ -837,6 +1029,7 @@ class AddRentalViewTestCase(TestCase):
         self.assertEqual(Rental.objects.filter(item=self.item).count(), 0)
 
 
+@override_settings(OBSERVER_THREADS=0)
 class AcceptRentalViewTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -861,7 +1054,7 @@ class AcceptRentalViewTestCase(TestCase):
         self.client.login(username="testrenter", password="password456")
 
         # Create a pending rental offer for the item
-        Rental.objects.create(
+        rental = Rental.objects.create(
             renter=self.renter,
             owner=self.owner,
             item=self.item,
@@ -871,7 +1064,10 @@ class AcceptRentalViewTestCase(TestCase):
         )
 
         # Make a POST request to accept the rental offer
-        response = self.client.post(reverse("accept_rental", kwargs={"item_id": self.item.id}), follow=True)
+        # Emails and messages are sent once the transition commits
+        with self.captureOnCommitCallbacks(execute=True):
+            url = reverse("accept_rental", kwargs={"item_id": self.item.id, "rental_id": rental.id})
+            response = self.client.post(url, follow=True)
 
         # Check if the rental status is updated to 'confirmed'
         rental = Rental.objects.get(item=self.item)
@@ -894,6 +1090,7 @@ class AcceptRentalViewTestCase(TestCase):
         self.assertRedirects(response, reverse("item_detail", kwargs={"item_id": self.item.id}))
 
 
+@override_settings(OBSERVER_THREADS=0)
 class CompleteRentalViewTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -918,7 +1115,7 @@ class CompleteRentalViewTestCase(TestCase):
         self.client.login(username="testowner", password="password123")
 
         # Create a confirmed rental for the item
-        Rental.objects.create(
+        rental = Rental.objects.create(
             renter=self.renter,
             owner=self.owner,
             item=self.item,
@@ -928,7 +1125,10 @@ class CompleteRentalViewTestCase(TestCase):
         )
 
         # Make a POST request to complete the rental
-        response = self.client.post(reverse("complete_rental", kwargs={"item_id": self.item.id}), follow=True)
+        # Emails and messages are sent once the transition commits
+        with self.captureOnCommitCallbacks(execute=True):
+            url = reverse("complete_rental", kwargs={"item_id": self.item.id, "rental_id": rental.id})
+            response = self.client.post(url, follow=True)
 
         # Check if the rental status is updated to 'completed'
         rental = Rental.objects.get(item=self.item)
@@ -945,7 +1145,61 @@ class CompleteRentalViewTestCase(TestCase):
         # Check if the response redirects to the item detail page
         self.assertRedirects(response, reverse("item_detail", kwargs={"item_id": self.item.id}))
 
+    def test_complete_rental_lost_race(self):
+        self.client.login(username="testowner", password="password123")
+        rental = Rental.objects.create(
+            renter=self.renter,
+            owner=self.owner,
+            item=self.item,
+            start_date=datetime.now().date() - timedelta(2),
+            end_date=datetime.now().date() - timedelta(1),
+            status="confirmed",
+        )
+
+        # Another request completes the rental between this request reading and updating it
+        with patch("irentstuffapp.views.Rental.transition", return_value=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                url = reverse("complete_rental", kwargs={"item_id": self.item.id, "rental_id": rental.id})
+                response = self.client.post(url, follow=True)
+
+        self.assertContains(response, "This rental has already been updated.")
+        self.assertEqual(len(mail.outbox), 0)
 
+    def test_complete_rental_by_id(self):
+        self.client.login(username="testowner", password="password123")
+        today = datetime.now().date()
+        later = Rental.objects.create(
+            renter=self.renter,
+            owner=self.owner,
+            item=self.item,
+            start_date=today + timedelta(5),
+            end_date=today + timedelta(7),
+            status="confirmed",
+        )
+        current = Rental.objects.create(
+            renter=self.renter,
+            owner=self.owner,
+            item=self.item,
+            start_date=today - timedelta(2),
+            end_date=today + timedelta(1),
+            status="confirmed",
+        )
+        # The detail page shows the earliest booking, although it was made last
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, current)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("complete_rental", kwargs={"item_id": self.item.id, "rental_id": current.id}))
+
+        current.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((current.status, later.status), ("completed", "confirmed"))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.active_rental, later)
+        self.assertEqual(self.item.availability, "available")
+
+
+@override_settings(OBSERVER_THREADS=0)
 class CancelRentalViewTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -976,7 +1230,7 @@ class CancelRentalViewTestCase(TestCase):
         self.client.login(username="testowner", password="password123")
 
         # Create a pending rental for the item
-        Rental.objects.create(
+        rental = Rental.objects.create(
             renter=self.renter,
             owner=self.owner,
             item=self.item,
@@ -986,9 +1240,11 @@ class CancelRentalViewTestCase(TestCase):
         )
 
         # Make a POST request to cancel the rental
-        response = self.client.post(
-            reverse("cancel_rental", kwargs={"item_id": self.item.id}), follow=True
-        )
+        # Emails and messages are sent once the transition commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("cancel_rental", kwargs={"item_id": self.item.id, "rental_id": rental.id}), follow=True
+            )
 
         # Check if the rental status is updated to 'cancelled'
         rental = Rental.objects.get(item=self.item)
@@ -1171,6 +1427,7 @@ class AddPurchaseViewTestCase(TestCase):
         self.assertFalse(Purchase.objects.filter(item=self.item).count(), 0)
 
 
+@override_settings(OBSERVER_THREADS=0)
 class AcceptPurchaseViewTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -1204,7 +1461,9 @@ class AcceptPurchaseViewTestCase(TestCase):
         )
 
         # Make a POST request to accept the purchase offer
-        response = self.client.post(reverse("accept_purchase", kwargs={"item_id": self.item.id}), follow=True)
+        # Emails and messages are sent once the transition commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("accept_purchase", kwargs={"item_id": self.item.id}), follow=True)
 
         # Check if the purchase status is updated to 'confirmed'
         purchase = Purchase.objects.get(item=self.item)
@@ -1227,6 +1486,7 @@ class AcceptPurchaseViewTestCase(TestCase):
         self.assertRedirects(response, reverse("item_detail", kwargs={"item_id": self.item.id}))
 
 
+@override_settings(OBSERVER_THREADS=0)
 class CompletePurchaseViewTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -1260,7 +1520,9 @@ class CompletePurchaseViewTestCase(TestCase):
         )
 
         # Make a POST request to complete the purchase
-        response = self.client.post(reverse("complete_purchase", kwargs={"item_id": self.item.id}), follow=True)
+        # Emails and messages are sent once the transition commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("complete_purchase", kwargs={"item_id": self.item.id}), follow=True)
 
         # Check if the purchase status is updated to 'completed'
         purchase = Purchase.objects.get(item=self.item)
@@ -1278,6 +1540,7 @@ class CompletePurchaseViewTestCase(TestCase):
         self.assertRedirects(response, reverse("item_detail", kwargs={"item_id": self.item.id}))
 
 
+@override_settings(OBSERVER_THREADS=0)
 class CancelPurchaseViewTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -1311,7 +1574,9 @@ class CancelPurchaseViewTestCase(TestCase):
         )
 
         # Make a POST request to complete the purchase
-        response = self.client.post(reverse("cancel_purchase", kwargs={"item_id": self.item.id}), follow=True)
+        # Emails and messages are sent once the transition commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("cancel_purchase", kwargs={"item_id": self.item.id}), follow=True)
 
         # Check if the purchase status is updated to 'completed'
         purchase = Purchase.objects.get(item=self.item)
@@ -1441,6 +1706,104 @@ class ItemMessagesViewTestCase(TestCase):
         # Check if the response status code is 200 (OK)
         self.assertEqual(response.status_code, 200)
 
+    def test_item_messages_marks_thread_read(self):
+        for i in range(5):
+            Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item, enquiring_user=self.renter,
+                                   subject="Test Subject", content=f"Reply {i}")
+        own_message = Message.objects.create(sender=self.renter, recipient=self.owner, item=self.item,
+                                             enquiring_user=self.renter, subject="Test Subject", content="Question")
+        self.client.login(username="testrenter", password="password456")
+        url = reverse("item_messages", kwargs={"item_id": self.item.id, "userid": self.renter.id})
+
+        self.client.get(url)
+        self.assertFalse(Message.objects.filter(sender=self.owner, is_read=False).exists())
+        # Messages sent by the user stay unread for the recipient
+        own_message.refresh_from_db()
+        self.assertFalse(own_message.is_read)
+        receipt = MessageReadReceipt.objects.get(user=self.renter, item=self.item, enquiring_user=self.renter)
+        self.assertEqual(receipt.last_read_message_id, own_message.id)
+
+    @override_settings(MESSAGES_PAGE_SIZE=3)
+    def test_item_messages_shows_latest_page(self):
+        replies = [Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item,
+                                          enquiring_user=self.renter, subject="Test Subject", content=f"Reply {i}")
+                   for i in range(4)]
+        self.client.login(username="testrenter", password="password456")
+        response = self.client.get(reverse("item_messages", kwargs={"item_id": self.item.id, "userid": self.renter.id}))
+
+        # The latest messages, oldest first, with a cursor for the ones before them
+        self.assertEqual([message.content for message in response.context["item_messages"]],
+                         ["Reply 1", "Reply 2", "Reply 3"])
+        self.assertEqual(response.context["last_message_id"], replies[-1].id)
+        self.assertIsNotNone(response.context["older_messages_cursor"])
+        self.assertContains(response, "Load older messages")
+
+    @override_settings(MESSAGES_PAGE_SIZE=2)
+    def test_item_messages_json_older_pages(self):
+        for i in range(3):
+            Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item,
+                                   enquiring_user=self.renter, subject="Test Subject", content=f"Reply {i}")
+        self.client.login(username="testrenter", password="password456")
+        url = reverse("item_messages_json", kwargs={"item_id": self.item.id, "userid": self.renter.id})
+
+        page = self.client.get(url).json()
+        self.assertEqual([message["content"] for message in page["messages"]], ["Reply 1", "Reply 2"])
+        page = self.client.get(url, {"cursor": page["older_cursor"]}).json()
+        self.assertEqual([message["content"] for message in page["messages"]], ["Test Content", "Reply 0"])
+        self.assertIsNone(page["older_cursor"])
+
+    @override_settings(MESSAGES_PAGE_SIZE=2)
+    def test_item_messages_json_newer_messages(self):
+        replies = [Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item,
+                                          enquiring_user=self.renter, subject="Test Subject", content=f"Reply {i}")
+                   for i in range(3)]
+        self.client.login(username="testrenter", password="password456")
+        url = reverse("item_messages_json", kwargs={"item_id": self.item.id, "userid": self.renter.id})
+
+        page = self.client.get(url, {"after": self.message.id}).json()
+        self.assertEqual([message["content"] for message in page["messages"]], ["Reply 0", "Reply 1"])
+        self.assertTrue(page["has_more"])
+        page = self.client.get(url, {"after": replies[1].id}).json()
+        self.assertEqual([message["id"] for message in page["messages"]], [replies[2].id])
+        self.assertFalse(page["has_more"])
+
+    def test_item_messages_json_forbidden_for_other_users(self):
+        User.objects.create_user(username="otheruser", password="password789")
+        url = reverse("item_messages_json", kwargs={"item_id": self.item.id, "userid": self.renter.id})
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        # Other users only see their own conversation with the owner, which is empty
+        self.client.login(username="otheruser", password="password789")
+        self.assertEqual(self.client.get(url).json()["messages"], [])
+
+    def test_mark_read_is_a_single_update(self):
+        for i in range(20):
+            Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item, enquiring_user=self.renter,
+                                   subject="Test Subject", content=f"Reply {i}")
+        MessageReadReceipt.objects.create(user=self.renter, item=self.item, enquiring_user=self.renter)
+
+        # Latest message id, receipt, one UPDATE for the messages, one for the watermark and one for the unread count
+        with self.assertNumQueries(5):
+            self.assertEqual(MessageReadReceipt.mark_read(self.renter, self.item, self.renter), 21)
+
+        # Nothing new to mark, so nothing is written
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(MessageReadReceipt.mark_read(self.renter, self.item, self.renter), 0)
+        self.assertFalse(any(query['sql'].startswith('UPDATE') for query in queries.captured_queries))
+
+    def test_mark_read_messages_committed_late(self):
+        late, latest = [Message.objects.create(sender=self.owner, recipient=self.renter, item=self.item,
+                                               enquiring_user=self.renter, subject="Test Subject", content=content)
+                        for content in ("Late", "Latest")]
+        # The latest message is read before the transaction of the one before it commits
+        Message.objects.filter(pk=late.pk).delete()
+        MessageReadReceipt.mark_read(self.renter, self.item, self.renter)
+        late.save(force_insert=True)
+
+        self.assertEqual(MessageReadReceipt.mark_read(self.renter, self.item, self.renter), 1)
+        late.refresh_from_db()
+        self.assertTrue(late.is_read)
+
 
 class CategoryInterestTestCase(TestCase):
     def setUp(self):
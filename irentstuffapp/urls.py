@@ -12,9 +12,9 @@ urlpatterns = [
     path('stuff/<int:item_id>/edit/', views.edit_item, name='edit_item'),
     path('stuff/<int:item_id>/undo/', views.restore_state, name='undo_item'),
     path('stuff/<int:item_id>/delete/', views.delete_item, name='delete_item'),
-    path('stuff/<int:item_id>/accept_rental/', views.accept_rental, name='accept_rental'),
-    path('stuff/<int:item_id>/complete_rental/', views.complete_rental, name='complete_rental'),
-    path('stuff/<int:item_id>/cancel_rental/', views.cancel_rental, name='cancel_rental'),
+    path('stuff/<int:item_id>/accept_rental/<int:rental_id>/', views.accept_rental, name='accept_rental'),
+    path('stuff/<int:item_id>/complete_rental/<int:rental_id>/', views.complete_rental, name='complete_rental'),
+    path('stuff/<int:item_id>/cancel_rental/<int:rental_id>/', views.cancel_rental, name='cancel_rental'),
     path('stuff/<int:item_id>/add_rental/', views.add_rental, name='add_rental'),
     path('stuff/<int:item_id>/add_rental/<str:username>', views.add_rental, name='add_rental'),
     path('stuff/<int:item_id>/add_purchase/', views.add_purchase, name='add_purchase'),
@@ -24,6 +24,7 @@ urlpatterns = [
     path('stuff/<int:item_id>/cancel_purchase/', views.cancel_purchase, name='cancel_purchase'),
     path('stuff/<int:item_id>/messages/', views.item_messages, name='item_messages_list'),
     path('stuff/<int:item_id>/messages/<int:userid>', views.item_messages, name='item_messages'),
+    path('stuff/<int:item_id>/messages/<int:userid>/stream/', views.item_messages_stream, name='item_messages_stream'),
     path('stuff/<int:item_id>/review/', views.add_review, name='add_review'),
     path('check_user_exists/<str:username>/', views.check_user_exists, name='check_user_exists'),
     path('inbox/', views.inbox, name='inbox'),
@@ -39,6 +40,10 @@ urlpatterns = [
          name="password_reset_complete"),
     path('stuff/', views.items_list, name='items_list'),
     path('stuff/category/<int:category_id>/', views.items_list, name='items_list_by_category'), 
+    path('api/stuff/', views.items_list_json, name='items_list_json'),
+    path('api/stuff/<int:item_id>/availability/', views.item_availability_json, name='item_availability_json'),
+    path('api/stuff/<int:item_id>/messages/<int:userid>/', views.item_messages_json, name='item_messages_json'),
+    path('api/messages/unread/', views.unread_message_count_json, name='unread_message_count_json'),
     path('interest/', views.category_interest, name='interest'),
     path('deals/', views.deals_view, name='deals'),
     path('newitems/', views.new_items_view, name='new_items'),
@@ -1,25 +1,37 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.core.mail import EmailMultiAlternatives
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models import Count
-from django.http import HttpResponse, JsonResponse, HttpResponseForbidden
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.urls import reverse
 from django.utils import timezone
+from django.views.decorators.http import etag
 
-from .decorators import apply_standard_discount, apply_loyalty_discount
+from .availability import available_between, book_rental, free_ranges, parse_date_range, parse_month
+from .broker import (MISSED_MESSAGES_LIMIT, format_event, get_broker, message_event, missed_message_events,
+                     thread_channel)
+from .caches import get_category_list
+from .decorators import apply_standard_discount, apply_loyalty_discount, login_required_async
 from .forms import ItemForm, ItemEditForm, RentalForm, MessageForm, ItemReviewForm, PurchaseForm
-from .models import (Item, Rental, Message, Category, Purchase,
+from .images import attach_responsive_images
+from .models import (Item, Rental, Conversation, Message, MessageReadReceipt, Purchase,
                      ItemStatesCaretaker, RentalEmailSender, RentalMessageSender, PurchaseEmailSender, PurchaseMessageSender,
-                     Interest, UserInterests, Top3CategoryDisplay, ItemsDiscountDisplay, NewlyListedItemsDisplay
+                     Interest, UserInterests, Top3CategoryDisplay, ItemsDiscountDisplay, NewlyListedItemsDisplay,
+                     get_unread_message_count, render_email, send_email
                      )
+from .pagination import apaginate_keyset, get_page_size, paginate_keyset
+from .search import get_search_backend
 from .states import (
     ItemState, ConcreteRentalPending, ConcretePurchaseReserved, ConcreteRentalOrPurchaseOngoing,
-    ConcreteUserIsItemOwner, ConcreteUserIsNotItemOwner
+    ConcreteUserIsItemOwner, ConcreteUserIsNotItemOwner, ItemStateSnapshot
 )
 
 import logging
@@ -31,74 +43,146 @@ def index(request):
     return HttpResponse("Index")
 
 
-# common function to manage the discount price displayed on the items list
-def items_discount_price(items):
-    for item in items:
-        if item.discount_percentage > 0:
-            discounted_price = item.price_per_day * (100 - item.discount_percentage) / 100
-            item.discounted_price = discounted_price
-        else:
-            item.discounted_price = item.price_per_day
-    return items
-
+# Newest listings first, or best matches first when searching; the trailing id makes the ordering unique for keyset pagination
+ITEMS_LIST_ORDERING = ('-created_date', '-id')
+ITEMS_SEARCH_ORDERING = ('-search_rank', '-id')
 
-@apply_standard_discount
-def items_list(request):
 
+# common function to build the items list and its ordering from the search and category filters
+def items_list_queryset(request, mystuff=False):
     search_query = request.GET.get('search', '')
     category_filter = request.GET.get('category', '')
+    available_from, available_to = parse_date_range(request.GET.get('available_from'), request.GET.get('available_to'))
 
-    # Check for any festive discounts on purchase price
-    for item in Item.objects.all():
-        if item.festive_discounts and item.availability == 'available':
-            try:
-                item.calculate_festive_discount_price()
-            except Exception:
-                # This exception ensures that in the edge case where the day changes (e.g. past 12mn) the festive discount details are reset
-                item.festive_discount_description = item.festive_discount_percentage = item.festive_discount_price = None
-                item.save()
-        if item.festive_discounts is False:
-            item.festive_discount_description = item.festive_discount_percentage = item.festive_discount_price = None
-            item.save()
-
+    # Festive discounts are recomputed daily by the refresh_festive_discounts command, so the listing stays read-only
     exclude_user = True
 
-    if request.user.is_authenticated and request.resolver_match.url_name == 'items_list_my':
+    if request.user.is_authenticated and mystuff:
         items = Item.objects.filter(owner=request.user)
         exclude_user = False
     else:
         items = Item.objects.all()
 
-    
-
     if search_query:
         exclude_user = False
-        items = items.filter(title__icontains=search_query)
- 
+        items = get_search_backend().search(items, search_query)
+
     if category_filter:
         exclude_user = False
         items = items.filter(category__name__iexact=category_filter)
 
+    if available_from:
+        exclude_user = False
+        items = available_between(items, available_from, available_to)
 
-    categories = Category.objects.all()
+    if request.user.is_authenticated and exclude_user:
+        items = items.exclude(owner=request.user)
 
-    if items:
-        items = items_discount_price(items)
+    # Sold items are not listed, so leave them out of the query to keep pages full
+    items = items.exclude(availability='sold').for_listing().with_prices()
+    ordering = ITEMS_SEARCH_ORDERING if search_query else ITEMS_LIST_ORDERING
+
+    return items, ordering
+
+
+# common function to paginate the items list by cursor and build the links to the other pages
+def items_page_context(request, items, ordering):
+    page = paginate_keyset(items, ordering, request.GET.get('cursor'), get_page_size(request))
+    attach_responsive_images(page.items)
+    return items_page_links(request, page)
+
+
+def items_page_links(request, page):
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    first_page_query = query.urlencode()
+    next_page_query = None
+    if page.has_next:
+        query['cursor'] = page.next_cursor
+        next_page_query = query.urlencode()
+
+    return {
+        'items': page.items,
+        'no_items_message': not page.items,
+        'is_first_page': not request.GET.get('cursor'),
+        'first_page_query': first_page_query,
+        'next_page_query': next_page_query,
+    }
 
-    if request.user.is_authenticated and exclude_user:
-        if items:
-            items = items.exclude(owner=request.user)
+
+async def aget_user(request):
+    """
+    Load request.user off the event loop, as it queries the session and user tables. Once loaded, the user can be
+    used from async code.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def arender(request, template_name, context):
+    # Templates and context processors may follow relations that were not loaded, which needs a sync context
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@apply_standard_discount
+async def items_list(request):
+    mystuff = request.resolver_match.url_name == 'items_list_my'
+    await aget_user(request)
+    items, ordering = items_list_queryset(request, mystuff)
+    categories = await sync_to_async(get_category_list)()
 
     context = {
-        'items': items,
         'categories': categories,
-        'searchstr': search_query,
-        'selected_category': category_filter,
-        'no_items_message': not items.exists(),
-        'mystuff': request.resolver_match.url_name == 'items_list_my'
+        'searchstr': request.GET.get('search', ''),
+        'selected_category': request.GET.get('category', ''),
+        'available_from': request.GET.get('available_from', ''),
+        'available_to': request.GET.get('available_to', ''),
+        'mystuff': mystuff
     }
+    page = await apaginate_keyset(items, ordering, request.GET.get('cursor'), get_page_size(request))
+    await sync_to_async(attach_responsive_images)(page.items)
+    context.update(items_page_links(request, page))
+
+    return await arender(request, 'irentstuffapp/items.html', context)
 
-    return render(request, 'irentstuffapp/items.html', context)
+
+def item_availability_json(request, item_id):
+    item = get_object_or_404(Item, pk=item_id)
+    month = parse_month(request.GET.get('month'))
+
+    return JsonResponse({
+        'item': item.id,
+        'month': month.strftime('%Y-%m'),
+        # Half open like rental dates: a rental from start to end fits in each range
+        'free': [{'start': start, 'end': end} for start, end in free_ranges(item, month)],
+    })
+
+
+def items_list_json(request):
+    items, ordering = items_list_queryset(request)
+    page = paginate_keyset(items, ordering, request.GET.get('cursor'), get_page_size(request))
+
+    return JsonResponse({
+        'items': [{
+            'id': item.id,
+            'title': item.title,
+            'owner': item.owner.username,
+            'category': item.category.name if item.category else None,
+            'condition': item.condition,
+            'availability': item.availability,
+            'price_per_day': item.price_per_day,
+            'discount_percentage': item.discount_percentage,
+            'discounted_price': item.discounted_price,
+            'deposit': item.deposit,
+            'festive_discount_description': item.festive_description,
+            'festive_discount_percentage': item.festive_percentage,
+            'festive_discount_price': item.festive_price,
+            'image': item.image.url if item.image else None,
+            'created_date': item.created_date,
+            'url': reverse('item_detail', kwargs={'item_id': item.id}),
+        } for item in page.items],
+        'next_cursor': page.next_cursor,
+    })
 
 
 @login_required
@@ -106,11 +190,9 @@ def deals_view(request):
     try:
         user_interests = UserInterests.objects.get(user=request.user)
         template = ItemsDiscountDisplay()
-        items = template.get_items(user_interests.interest).exclude(owner=request.user)
-        if items:
-            items = items_discount_price(items)
+        items = template.get_items(user_interests.interest).exclude(owner=request.user).for_listing().with_prices()
 
-        return render(request, 'irentstuffapp/items.html', {'items': items, 'no_items_message': not items.exists()})
+        return render(request, 'irentstuffapp/items.html', items_page_context(request, items, template.ordering))
     except UserInterests.DoesNotExist:
         return redirect('interest')
 
@@ -120,11 +202,9 @@ def new_items_view(request):
     try:
         user_interests = UserInterests.objects.get(user=request.user)
         template = NewlyListedItemsDisplay()
-        items = template.get_items(user_interests.interest).exclude(owner=request.user)
-        if items:
-            items = items_discount_price(items)
+        items = template.get_items(user_interests.interest).exclude(owner=request.user).for_listing().with_prices()
 
-        return render(request, 'irentstuffapp/items.html', {'items': items, 'no_items_message': not items.exists()})
+        return render(request, 'irentstuffapp/items.html', items_page_context(request, items, template.ordering))
     except UserInterests.DoesNotExist:
         return redirect('interest')
 
@@ -134,11 +214,9 @@ def fav_categories_view(request):
     try:
         user_interests = UserInterests.objects.get(user=request.user)
         template = Top3CategoryDisplay()
-        items = template.get_items(user_interests.interest).exclude(owner=request.user)
-        if items:
-            items = items_discount_price(items)
+        items = template.get_items(user_interests.interest).exclude(owner=request.user).for_listing().with_prices()
 
-        return render(request, 'irentstuffapp/items.html', {'items': items, 'no_items_message': not items.exists()})
+        return render(request, 'irentstuffapp/items.html', items_page_context(request, items, template.ordering))
     except UserInterests.DoesNotExist:
         return redirect('interest')
 
@@ -181,25 +259,32 @@ def add_review(request, item_id):
 
 
 @apply_loyalty_discount
-def item_detail_with_state_pattern(request, item_id):
-    item = get_object_or_404(Item, pk=item_id)
+async def item_detail_with_state_pattern(request, item_id):
+    # Load everything the states check in a fixed number of queries
+    snapshot = await ItemStateSnapshot.aload(item_id, await aget_user(request))
+    # The states fall back to querying for anything the snapshot does not have
+    context = await sync_to_async(item_detail_context)(request, snapshot)
+    return await arender(request, 'irentstuffapp/item_detail.html', context)
+
+
+def item_detail_context(request, snapshot):
+    item = snapshot.item
+    attach_responsive_images([item])
     is_owner = request.user == item.owner
     # msgshow = True
     undos = False
-    
+
     # Check for any festive discounts on purchase price
     if item.festive_discounts and item.availability == 'available':
         try:
             item.calculate_festive_discount_price()
         except Exception:
             # This exception ensures that in the edge case where the day changes (e.g. past 12mn) the festive discount details are reset
-            item.festive_discount_description = item.festive_discount_percentage = item.festive_discount_price = None
-            item.save()
+            item.clear_festive_discount()
     if item.festive_discounts is False:
-        item.festive_discount_description = item.festive_discount_percentage = item.festive_discount_price = None
-        item.save()
+        item.clear_festive_discount()
 
-    context = {'item': item, 'user': request.user}
+    context = {'item': item, 'user': request.user, 'snapshot': snapshot}
 
     if is_owner:
         user_state = ConcreteUserIsItemOwner(context)
@@ -256,8 +341,7 @@ def item_detail_with_state_pattern(request, item_id):
 
         else:
             # check if user has undos for this item
-            caretakercount = ItemStatesCaretaker.objects.filter(item=item).count()
-            if caretakercount > 1:
+            if item.undo_count > 1:
                 undos = True
 
             # check if there are any completed rentals that user may want to review
@@ -296,7 +380,7 @@ def item_detail_with_state_pattern(request, item_id):
                     'msgshow': msgshow,
                     'reviews': reviews,
                     'undos': undos})
-    return render(request, 'irentstuffapp/item_detail.html', context)
+    return context
 
 
 @login_required
@@ -309,21 +393,21 @@ def edit_item(request, item_id):
         return redirect('item_detail', item_id=item.id)
     
     # add logic to find if there is an associated existing rental
-    pending_rental = Rental.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if pending_rental.exists():
+    if item.active_rental_id:
         messages.error(request, 'You cannot edit an item when rental status is Pending or Confirmed!')
         return redirect('item_detail', item_id=item.id)
 
     # add logic to find if there is an associated existing purchase
-    pending_purchases = Purchase.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if pending_purchases.exists():
+    if item.active_purchase_id:
         messages.error(request, 'You cannot edit an item when purchase status is Reserved or Confirmed!')
         return redirect('item_detail', item_id=item.id)
 
     if request.method == 'POST':
         form = ItemEditForm(request.POST, request.FILES, instance=item)
         if form.is_valid():
-            form.save()
+            # Only the edited fields, so that a rental or purchase made since the item was loaded is kept
+            item = form.save(commit=False)
+            item.save(update_fields=ItemEditForm._meta.fields)
 
             # Call save_state to save the current state of the item
             save_state(request, item_id)
@@ -345,13 +429,11 @@ def delete_item(request, item_id):
         return redirect('item_detail', item_id=item.id)
 
     # add logic to find if associated rental confirmed/pending
-    pending_rental = Rental.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if pending_rental.exists():
+    if item.active_rental_id:
         messages.error(request, 'You cannot delete an item when rental status is Pending or Confirmed!')
         return redirect('item_detail', item_id=item.id)
 
-    pending_purchases = Purchase.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if pending_purchases.exists():
+    if item.active_purchase_id:
         messages.error(request, 'You cannot delete an item when purchase status is Reserved or Confirmed!')
         return redirect('item_detail', item_id=item.id)
 
@@ -375,10 +457,7 @@ def save_state(request, item_id):
         # Optionally, you can handle unauthorized access here
         return HttpResponseForbidden()
 
-    caretaker = ItemStatesCaretaker.objects.filter(item=item).first()
-    if not caretaker:
-        caretaker = ItemStatesCaretaker(item=item)
-
+    caretaker = ItemStatesCaretaker(item=item)
     caretaker.save_state()  # Save the current state of the item
 
     # messages.success(request, 'State saved successfully!')
@@ -395,21 +474,14 @@ def restore_state(request, item_id):
         return HttpResponseForbidden()
 
     # don't delete if only 1 state, that is the original state
-    caretakercount = ItemStatesCaretaker.objects.filter(item=item).count()
+    versions = list(ItemStatesCaretaker.history(item)[:2])
 
-    if caretakercount < 2:
+    if len(versions) < 2:
         messages.error(request, 'No previous changes found for this item.')
         return redirect('item_detail', item_id=item_id)
 
-    caretakerdel = ItemStatesCaretaker.objects.filter(item=item).order_by('-datetime_saved').first()
-
-    if caretakerdel:
-        caretakerdel.delete()
-
-    caretaker = ItemStatesCaretaker.objects.filter(item=item).order_by('-datetime_saved').first()
-    if not caretaker or not caretaker.memento:
-        messages.error(request, 'No changes found for this item.')
-        return redirect('item_detail', item_id=item_id)
+    caretakerdel, caretaker = versions
+    caretakerdel.delete_state()
 
     caretaker.restore_state()  # Restore the item to the previous state
 
@@ -417,127 +489,238 @@ def restore_state(request, item_id):
     return redirect('item_detail', item_id=item_id)
 
 
-@login_required
-def item_messages(request, item_id, userid=0):
+# Newest first, for keyset pages going back through a conversation
+MESSAGES_ORDERING = ('-timestamp', '-id')
+
+
+def get_messages_page_size(request):
+    default_page_size = getattr(settings, 'MESSAGES_PAGE_SIZE', 50)
+    try:
+        page_size = int(request.GET.get('page_size', default_page_size))
+    except ValueError:
+        page_size = default_page_size
+    return max(1, min(page_size, getattr(settings, 'MESSAGES_MAX_PAGE_SIZE', 200)))
 
-    item = get_object_or_404(Item, pk=item_id)
+
+@login_required_async
+async def item_messages(request, item_id, userid=0):
+
+    user = await aget_user(request)
+    item = await Item.objects.select_related('owner').filter(pk=item_id).afirst()
+    if item is None:
+        raise Http404('No Item matches the given query.')
 
     # owner view of messages from every user who enquired
-    if userid == 0 and item.owner == request.user:
+    if userid == 0 and item.owner_id == user.id:
 
         # Group messages by enquiring_user_id and count the number of messages for each user
-        grouped_messages = Message.objects.filter(item=item).values('enquiring_user', 'enquiring_user__username').annotate(message_count=Count('id'))
+        grouped_messages = [row async for row in Message.objects.filter(item=item).values(
+            'enquiring_user', 'enquiring_user__username').annotate(message_count=Count('id'))]
 
-        return render(request, 'irentstuffapp/item_messages_list.html', {'item': item, 'grouped_messages': grouped_messages})
+        return await arender(request, 'irentstuffapp/item_messages_list.html', {'item': item, 'grouped_messages': grouped_messages})
 
     else:
 
-        # enquiring_user = User.objects.filter(id=userid).first()
-
-        if item.owner == request.user:
-            enquiring_user = User.objects.filter(id=userid).first()
+        if item.owner_id == user.id:
+            enquiring_user = await User.objects.filter(id=userid).afirst()
         else:
-            enquiring_user = request.user
+            enquiring_user = user
 
         if request.method == 'POST':
             message_form = MessageForm(request.POST)
             if message_form.is_valid():
-                message = message_form.save(commit=False)
-                message.sender = request.user
-                if request.user == item.owner:
-                    message.recipient = enquiring_user
-                else:
-                    message.recipient = item.owner
-
-                message.item = item
-                message.enquiring_user = enquiring_user
-                message.subject = 'message'
-                message.timestamp = timezone.now()
-                message.save()
-
-                subject = 'iRentStuff.app - You have a message'
-                html_message = render_to_string('emails/enquiry_received_email.html', {'message': message})
-                plain_message = strip_tags(html_message)
-                email_from = settings.DEFAULT_FROM_EMAIL
-
-                email = EmailMultiAlternatives(
-                    subject,
-                    plain_message,
-                    email_from,
-                    [message.recipient.email],
-                )
-                email.attach_alternative(html_message, "text/html")
-                email.send()
-
-                if request.user == item.owner:
+                await sync_to_async(send_item_message)(message_form, item, user, enquiring_user)
+
+                if user == item.owner:
                     return redirect('item_messages', item_id=item.id, userid=enquiring_user.id)
 
                 else:
                     return redirect('item_messages_list', item_id=item.id)
-
-                # messages.success(request, 'Rental added successfully!')
-                # return redirect('item_detail', item_id=item.id)
-                # return redirect(reverse('current_url_name'))
-                # return render(request, 'irentstuffapp/item_messages.html', {'item': item, 'enquiring_user':enquiring_user.username,
-                #                                                             'item_messages': item_messages, 'message_form': message_form})
-
-                # item_messages = Message.objects.filter(item=item, enquiring_user = userid).order_by('timestamp')
-
-                # return render(request, 'irentstuffapp/item_messages.html', {'item': item, 'enquiring_user':enquiring_user.username,
-                #                                                             'item_messages': item_messages, 'message_form': message_form})
         else:
             message_form = MessageForm(initial={'item': item, 'recipient': item.owner})
 
         # set messages to is_read
-        item_incoming_msgs = Message.objects.filter(item=item, enquiring_user=enquiring_user, is_read=False).exclude(sender=request.user.id)
-        for itmmsg in item_incoming_msgs:
-            itmmsg.is_read = True
-            itmmsg.save()
+        await sync_to_async(MessageReadReceipt.mark_read)(user, item, enquiring_user)
 
         active_rentals = False
         accept_rental = False
         pending_purchase = False
         accept_purchase = False
-        if item.owner == request.user:
+        if item.owner_id == user.id:
             # Check if there are active rentals for this item
-            active_rentals_obj = Rental.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled").first()
-            pending_purchase_obj = Purchase.objects.filter(item=item).exclude(status="complete").exclude(status="cancelled").first()
-
-            if active_rentals_obj:
+            if item.active_rental_id:
                 active_rentals = True
-            if pending_purchase_obj:
+            if item.active_purchase_id:
                 pending_purchase = True
         else:
             # Check if there is a rental offer for this item - pending - before start_date
-            accept_rental_obj = Rental.objects.filter(item=item, renter=request.user, status='pending', start_date__gt=timezone.now()).first()
-            accept_purchase_obj = Purchase.objects.filter(item=item, buyer=request.user, status='reserved', deal_date__gt=timezone.now()).first()
-
-            if accept_rental_obj:
-                accept_rental = True
-            if accept_purchase_obj:
-                accept_purchase = True
-
-        item_messages = Message.objects.filter(item=item, enquiring_user=enquiring_user).order_by('timestamp')
-        return render(request, 'irentstuffapp/item_messages.html',
-                      {'item': item,
-                       'enquiring_user': enquiring_user.username,
-                       'item_messages': item_messages,
-                       'message_form': message_form,
-                       'active_rentals': active_rentals,
-                       'accept_rental': accept_rental,
-                       'pending_purchase': pending_purchase,
-                       'accept_purchase': accept_purchase})
+            accept_rental = await Rental.objects.filter(item=item, renter=user, status='pending', start_date__gt=timezone.now()).aexists()
+            accept_purchase = await Purchase.objects.filter(item=item, buyer=user, status='reserved', deal_date__gt=timezone.now()).aexists()
+
+        # Only the latest messages; older ones are loaded from item_messages_json
+        page = await apaginate_keyset(Message.objects.filter(item=item, enquiring_user=enquiring_user).select_related('sender'),
+                                      MESSAGES_ORDERING,
+                                      page_size=get_messages_page_size(request))
+        item_messages = page.items[::-1]
+        return await arender(request, 'irentstuffapp/item_messages.html',
+                             {'item': item,
+                              'enquiring_user': enquiring_user.username,
+                              'item_messages': item_messages,
+                              'older_messages_url': reverse('item_messages_json', kwargs={'item_id': item.id, 'userid': enquiring_user.id}),
+                              'older_messages_cursor': page.next_cursor,
+                              # New messages are pushed from here on, see item_messages_stream
+                              'message_stream_url': reverse('item_messages_stream', kwargs={'item_id': item.id, 'userid': enquiring_user.id}),
+                              'last_message_id': max((message.id for message in item_messages), default=0),
+                              'message_form': message_form,
+                              'active_rentals': active_rentals,
+                              'accept_rental': accept_rental,
+                              'pending_purchase': pending_purchase,
+                              'accept_purchase': accept_purchase})
+
+
+def send_item_message(message_form, item, sender, enquiring_user):
+    message = message_form.save(commit=False)
+    message.sender = sender
+    if sender == item.owner:
+        message.recipient = enquiring_user
+    else:
+        message.recipient = item.owner
+
+    message.item = item
+    message.enquiring_user = enquiring_user
+    message.subject = 'message'
+    message.timestamp = timezone.now()
+    message.save()
+
+    subject = 'iRentStuff.app - You have a message'
+    html_message = render_email('emails/enquiry_received_email.html', {'message': message})
+    send_email(subject, html_message, message.recipient.email)
+    return message
+
+
+def conversation_for_user(request, item_id, userid):
+    # (item id, enquiring user id) of the conversation the user may read, like item_messages, or None
+    if not request.user.is_authenticated:
+        return None
+    item = Item.objects.filter(pk=item_id).only('owner_id').first()
+    if item is None:
+        return None
+    if item.owner_id == request.user.id:
+        return (item.id, userid) if userid else None
+    return item.id, request.user.id
+
+
+def item_messages_json(request, item_id, userid):
+    """
+    Messages of a conversation, oldest first. With ?after=<message id> the messages newer than it, for refreshing
+    the page; otherwise the latest page, or the page before ?cursor=, for loading older messages.
+    """
+    conversation = conversation_for_user(request, item_id, userid)
+    if conversation is None:
+        return HttpResponseForbidden()
+    page_size = get_messages_page_size(request)
 
+    if 'after' in request.GET:
+        try:
+            after = int(request.GET['after'])
+        except ValueError:
+            after = 0
+        events = missed_message_events(*conversation, after, limit=page_size + 1)
+        return JsonResponse({'messages': events[:page_size], 'has_more': len(events) > page_size})
+
+    thread = Message.objects.filter(item_id=conversation[0], enquiring_user_id=conversation[1]).select_related('sender')
+    page = paginate_keyset(thread, MESSAGES_ORDERING, request.GET.get('cursor'), page_size)
+    return JsonResponse({
+        'messages': [message_event(message) for message in reversed(page.items)],
+        'older_cursor': page.next_cursor,
+    })
+
+
+async def item_messages_stream(request, item_id, userid=0):
+    """
+    Server-sent events with the new messages of a conversation, after the message id in Last-Event-ID or ?after=.
+    Under ASGI the stream stays open and messages are pushed as they are sent. Under WSGI it only sends the messages
+    the browser has missed and closes, and the browser reconnects after the retry interval.
+    """
+    conversation = await sync_to_async(conversation_for_user)(request, item_id, userid)
+    if conversation is None:
+        return HttpResponseForbidden()
 
-@login_required
-def inbox(request):
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.GET.get('after') or 0)
+    except ValueError:
+        after = 0
 
-    # Group messages by enquiring_user_id and count the number of messages for each user
-    grouped_messages = Message.objects.filter(recipient=request.user.id).values(
-        'enquiring_user', 'enquiring_user__username', 'item__id', 'item__title'
-        ).annotate(message_count=Count('id'))
+    if isinstance(request, ASGIRequest):
+        events = stream_message_events(conversation, after)
+    else:
+        missed_events = await sync_to_async(missed_message_events)(*conversation, after)
+        events = [message_stream_retry()] + [format_event(event) for event in missed_events]
+
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def message_stream_retry():
+    # How long the browser waits before reconnecting, in milliseconds
+    return f'retry: {getattr(settings, "MESSAGE_STREAM_RETRY", 5000)}\n\n'
+
+
+async def stream_message_events(conversation, after):
+    keepalive = getattr(settings, 'MESSAGE_STREAM_KEEPALIVE', 15)
+    # Streams end after a while, so that connections dropped by the client are not followed forever
+    deadline = asyncio.get_running_loop().time() + getattr(settings, 'MESSAGE_STREAM_TIMEOUT', 5 * 60)
+
+    # Subscribe before catching up, so that a message sent in between is not missed
+    async with get_broker().subscribe(thread_channel(*conversation)) as subscription:
+        yield message_stream_retry()
+        last_id = after
+        # Catch up in batches until a short one, so that a browser that missed many messages gets all of them
+        while True:
+            missed_events = await sync_to_async(missed_message_events)(*conversation, last_id, MISSED_MESSAGES_LIMIT)
+            for event in missed_events:
+                last_id = event['id']
+                yield format_event(event)
+            if len(missed_events) < MISSED_MESSAGES_LIMIT:
+                break
+
+        while (remaining := deadline - asyncio.get_running_loop().time()) > 0:
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=min(keepalive, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event['id'] > last_id:
+                last_id = event['id']
+                yield format_event(event)
+
+
+@login_required_async
+async def inbox(request):
+
+    # Conversation summaries, most recent first
+    grouped_messages = [row async for row in Conversation.for_user(await aget_user(request)).values(
+        'enquiring_user', 'enquiring_user__username', 'item__id', 'item__title', 'message_count', 'unread_count',
+        'last_message_at')]
 
-    return render(request, 'irentstuffapp/inbox.html', {'grouped_messages': grouped_messages})
+    return await arender(request, 'irentstuffapp/inbox.html', {'grouped_messages': grouped_messages})
+
+
+def unread_message_count_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    return str(get_unread_message_count(request.user))
+
+
+@etag(unread_message_count_etag)
+def unread_message_count_json(request):
+    # Polled by the navbar badge; the count comes from the cache, and an unchanged count is answered with 304
+    unread = get_unread_message_count(request.user) if request.user.is_authenticated else 0
+    response = JsonResponse({'unread': unread})
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @login_required
@@ -555,14 +738,8 @@ def add_rental(request, item_id, username=""):
                        please create a new entry using the "Add Stuff" button.''')
         return redirect('item_detail', item_id=item.id)
 
-    # Check if there are active rentals for the item
-    active_rentals = Rental.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if active_rentals.exists():
-        messages.error(request, 'There are active rentals for this item. You cannot add a new rental.')
-        return redirect('item_detail', item_id=item.id)
-
-    pending_purchases = Purchase.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if pending_purchases.exists():
+    # Rentals may be booked back to back, book_rental checks that their dates do not overlap
+    if item.active_purchase_id:
         messages.error(request, 'There are pending purchases for this item. You cannot add a new rental.')
         return redirect('item_detail', item_id=item.id)
 
@@ -595,12 +772,11 @@ def add_rental(request, item_id, username=""):
             rental.add_observer(rental_email_sender)
             rental.add_observer(rental_message_sender)
 
-            rental.save()
-            rental.notify_observers()
-
-            # Update the status of the item to indicate that there is an active rental
-            item.availability = 'active_rental'
-            item.save()
+            try:
+                book_rental(rental)
+            except ValidationError as error:
+                messages.error(request, ' '.join(error.messages))
+                return render(request, 'irentstuffapp/rental_add.html', {'form': form, 'item': item})
 
             return redirect('item_detail', item_id=item.id)
 
@@ -613,11 +789,11 @@ def add_rental(request, item_id, username=""):
 
 
 @login_required
-def accept_rental(request, item_id):
+def accept_rental(request, item_id, rental_id):
     item = get_object_or_404(Item, pk=item_id)
 
     # Check if the logged-in user is renter
-    accept_rental_obj = Rental.objects.filter(item=item, renter=request.user, status='pending', start_date__gt=timezone.now()).first()
+    accept_rental_obj = Rental.objects.filter(pk=rental_id, item=item, renter=request.user, status='pending', start_date__gt=timezone.now()).first()
     if accept_rental_obj:
         rental_email_sender = RentalEmailSender()
         rental_message_sender = RentalMessageSender()
@@ -626,17 +802,18 @@ def accept_rental(request, item_id):
         accept_rental_obj.add_observer(rental_email_sender)
         accept_rental_obj.add_observer(rental_message_sender)
 
-        accept_rental_obj.change_state('confirmed')
+        if not accept_rental_obj.transition('confirmed'):
+            messages.error(request, 'This rental has already been updated. Please try again.')
 
     return redirect('item_detail', item_id=item.id)
 
 
 @login_required
-def complete_rental(request, item_id):
+def complete_rental(request, item_id, rental_id):
     item = get_object_or_404(Item, pk=item_id)
 
     # Check if the logged-in user is owner and status is confirmed
-    complete_rental_obj = Rental.objects.filter(item=item, owner=request.user, status='confirmed').first()
+    complete_rental_obj = Rental.objects.filter(pk=rental_id, item=item, owner=request.user, status='confirmed').first()
     if complete_rental_obj:
         rental_email_sender = RentalEmailSender()
         rental_message_sender = RentalMessageSender()
@@ -645,21 +822,18 @@ def complete_rental(request, item_id):
         complete_rental_obj.add_observer(rental_email_sender)
         complete_rental_obj.add_observer(rental_message_sender)
 
-        complete_rental_obj.change_state('completed')
-
-        # Update the status of the item to indicate that it is now available again
-        item.availability = 'available'
-        item.save()
+        if not complete_rental_obj.transition('completed'):
+            messages.error(request, 'This rental has already been updated. Please try again.')
 
     return redirect('item_detail', item_id=item.id)
 
 
 @login_required
-def cancel_rental(request, item_id):
+def cancel_rental(request, item_id, rental_id):
     item = get_object_or_404(Item, pk=item_id)
 
     # Check if the logged-in user is owner and status is confirmed
-    cancel_rental_obj = Rental.objects.filter(item=item, owner=request.user, status='pending').first()
+    cancel_rental_obj = Rental.objects.filter(pk=rental_id, item=item, owner=request.user, status='pending').first()
     if cancel_rental_obj:
         rental_email_sender = RentalEmailSender()
         rental_message_sender = RentalMessageSender()
@@ -668,11 +842,8 @@ def cancel_rental(request, item_id):
         cancel_rental_obj.add_observer(rental_email_sender)
         cancel_rental_obj.add_observer(rental_message_sender)
 
-        cancel_rental_obj.change_state('cancelled')
-
-        # Update the status of the item to indicate that it is now available again
-        item.availability = 'available'
-        item.save()
+        if not cancel_rental_obj.transition('cancelled'):
+            messages.error(request, 'This rental has already been updated. Please try again.')
 
     return redirect('item_detail', item_id=item.id)
 
@@ -692,14 +863,12 @@ def add_purchase(request, item_id, username=""):
         return redirect('item_detail', item_id=item.id)
 
     # Redirect if item is rented out
-    active_rentals = Rental.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if active_rentals.exists():
+    if item.active_rental_id:
         messages.error(request, 'There are active rentals for this item. You cannot add a new purchase.')
         return redirect('item_detail', item_id=item.id)
 
     # Redirect if item is pending to be purchased
-    pending_purchases = Purchase.objects.filter(item=item).exclude(status="completed").exclude(status="cancelled")
-    if pending_purchases.exists():
+    if item.active_purchase_id:
         messages.error(request, 'There are pending purchases for this item. You cannot add a new purchase.')
         return redirect('item_detail', item_id=item.id)
 
@@ -711,11 +880,9 @@ def add_purchase(request, item_id, username=""):
             item.calculate_festive_discount_price()
         except Exception:
             # This exception ensures that in the edge case where the day changes (e.g. past 12mn) the festive discount details are reset
-            item.festive_discount_description = item.festive_discount_percentage = item.festive_discount_price = None
-            item.save()
+            item.clear_festive_discount()
     if item.festive_discounts is False:
-        item.festive_discount_description = item.festive_discount_percentage = item.festive_discount_price = None
-        item.save()
+        item.clear_festive_discount()
 
     festive_discount_description = item.festive_discount_description
     festive_discount_percentage = item.festive_discount_percentage
@@ -755,7 +922,7 @@ def add_purchase(request, item_id, username=""):
 
             # Update the status of the item to indicate that it is now available again
             item.availability = 'pending_purchase'
-            item.save()
+            item.save(update_fields=['availability'])
 
             return redirect('item_detail', item_id=item.id)
 
@@ -786,7 +953,8 @@ def accept_purchase(request, item_id):
         accept_purchase_obj.add_observer(purchase_email_sender)
         accept_purchase_obj.add_observer(purchase_message_sender)
 
-        accept_purchase_obj.change_state('confirmed')
+        if not accept_purchase_obj.transition('confirmed'):
+            messages.error(request, 'This purchase has already been updated. Please try again.')
 
     return redirect('item_detail', item_id=item.id)
 
@@ -805,11 +973,8 @@ def complete_purchase(request, item_id):
         complete_purchase_obj.add_observer(purchase_email_sender)
         complete_purchase_obj.add_observer(purchase_message_sender)
 
-        complete_purchase_obj.change_state('completed')
-
-        # Update the status of the item to indicate that it is now available again
-        item.availability = 'sold'
-        item.save()
+        if not complete_purchase_obj.transition('completed'):
+            messages.error(request, 'This purchase has already been updated. Please try again.')
 
     return redirect('item_detail', item_id=item.id)
 
@@ -828,11 +993,8 @@ def cancel_purchase(request, item_id):
         cancel_purchase_obj.add_observer(purchase_email_sender)
         cancel_purchase_obj.add_observer(purchase_message_sender)
 
-        cancel_purchase_obj.change_state('cancelled')
-
-        # Update the status of the item to indicate that it is now available again
-        item.availability = 'available'
-        item.save()
+        if not cancel_purchase_obj.transition('cancelled'):
+            messages.error(request, 'This purchase has already been updated. Please try again.')
 
     return redirect('item_detail', item_id=item.id)
 
@@ -859,18 +1021,8 @@ def register(request):
             user.save()
 
             subject = 'Welcome to iRentStuff.app - Your Account Registration is Successful!'
-            html_message = render_to_string('emails/welcome_email.html', {'user_name': username})
-            plain_message = strip_tags(html_message)
-            email_from = settings.DEFAULT_FROM_EMAIL
-
-            email = EmailMultiAlternatives(
-                subject,
-                plain_message,
-                email_from,
-                [email],
-            )
-            email.attach_alternative(html_message, "text/html")
-            email.send()
+            html_message = render_email('emails/welcome_email.html', {'user_name': username})
+            send_email(subject, html_message, email)
 
             messages.success(request, 'Thank you for your registration! You may log in now')
             return redirect('/login')
@@ -900,7 +1052,7 @@ def logout_user(request):
 # interest form for user to indicate category they like, items created within past 3 days by default
 @login_required
 def category_interest(request):
-    categories = Category.objects.all()
+    categories = get_category_list()
     existing_user_interests = UserInterests.objects.filter(user=request.user).first()
 
     context = {